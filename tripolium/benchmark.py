@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+benchmark.py
+
+Measure the throughput and memory of every mapper and input format on
+synthetic data from datagen.py, writing the results as JSON so they can be
+compared between versions.
+
+	python benchmark.py [--rows=N] [--output=results.json] [--label=NAME]
+		[--only=SUBSTRING] [--dataDir=DIR] [--seed=N]
+
+Each case runs in a forked child process, so its peak RSS is its own.
+"""
+
+import imp
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import datagen
+import mappers
+import reducers
+from binaryformat import BinaryInputFormat, BinaryRowWriter
+from inputformat import MmapInputFormat, NClusterPartitionInputFormat, NClusterRowInputFormat
+from mapreduce import run
+from pipeline import PipelineMapper
+from settings import COL_DELIMITER
+from utils import RowWriter
+
+# Schemas the schema mappers are benchmarked with, installed into the schema module
+BENCH_SCHEMAS = {
+	'BENCH_USERS': {
+		"userId": {"index": 1, "type": int},
+		"lastName": {"index": 3, "type": str},
+		"dob": {"index": 4, "type": str},
+	},
+	# The same columns, after a stage has prefixed each row with its key
+	'BENCH_KEYED_USERS': {
+		"userId": {"index": 2, "type": int},
+		"lastName": {"index": 4, "type": str},
+		"dob": {"index": 5, "type": str},
+	},
+	'BENCH_EVENTS': {
+		"userId": {"index": 1, "type": int},
+		"timestamp": {"index": 2, "type": str},
+	},
+}
+
+# (label, dataset, mapper, mapper kwargs, reducer)
+MAPPER_CASES = [
+	('IdentityMapper', 'users', mappers.IdentityMapper, {}, None),
+	('UpperMapper', 'users', mappers.UpperMapper, {}, None),
+	('ReverseMapper', 'users', mappers.ReverseMapper, {}, None),
+	('PartitionMapper', 'users', mappers.PartitionMapper, {}, None),
+	('SchemaMapper', 'users', mappers.SchemaMapper, {'schema': 'BENCH_USERS'}, None),
+	('SampleMapper', 'users', mappers.SampleMapper, {'sampleProb': '0.01', 'seed': '1'}, None),
+	('SampleMapper[skip]', 'users', mappers.SampleMapper, {'sampleProb': '0.01', 'mode': 'skip', 'seed': '1'}, None),
+	('SampleMapper[k=1000]', 'users', mappers.SampleMapper, {'k': '1000', 'seed': '1'}, None),
+	('ZenoSampleMapper', 'users', mappers.ZenoSampleMapper, {'seed': '1'}, None),
+	('SessionMapper', 'events', mappers.SessionMapper, {}, None),
+	('HyperLogLogMapper', 'events', mappers.HyperLogLogMapper, {'column': '1', 'partitionColumn': '0'}, None),
+	('CountMinMapper', 'events', mappers.CountMinMapper, {'column': '1', 'partitionColumn': '0', 'top': '10'}, None),
+	('QuantileMapper', 'users', mappers.QuantileMapper, {'column': '0'}, None),
+	('SketchMergeMapper', 'sketches', mappers.SketchMergeMapper, {}, None),
+	('TopNMapper', 'events', mappers.TopNMapper,
+		{'schema': 'BENCH_EVENTS', 'n': '10', 'orderBy': 'timestamp', 'partitionBy': 'userId'}, None),
+	('GroupConcatMapper+GroupConcatReducer', 'groups', mappers.GroupConcatMapper, {}, reducers.GroupConcatReducer),
+	('IdentityMapper+CountReducer', 'users', mappers.IdentityMapper, {}, reducers.CountReducer),
+	('PipelineMapper[Sample|Schema|Upper]', 'users', PipelineMapper,
+		{'stages': 'SampleMapper|SchemaMapper|UpperMapper', '0.sampleProb': '0.5', '0.seed': '1', '1.schema': 'BENCH_KEYED_USERS'}, None),
+]
+
+
+def read_partitions(inputFormat):
+	"""Return the number of rows in every partition of inputFormat."""
+	rows = 0
+	for pKey, partition in inputFormat.generate_input():
+		for row in partition:
+			rows += 1
+	return rows
+	
+	
+def read_rows(rows):
+	"""Return the number of rows generated by rows."""
+	count = 0
+	for row in rows:
+		count += 1
+	return count
+	
+	
+# (label, dataset, function of the data file name returning the number of rows read)
+INPUT_FORMAT_CASES = [
+	('NClusterPartitionInputFormat', 'events', lambda fileName: read_partitions(
+		NClusterPartitionInputFormat(0, colDelimiter=COL_DELIMITER, inputFile=open(fileName)))),
+	('NClusterPartitionInputFormat[materialize]', 'events', lambda fileName: read_partitions(
+		NClusterPartitionInputFormat(0, materialize=True, colDelimiter=COL_DELIMITER, inputFile=open(fileName)))),
+	('NClusterPartitionInputFormat[materialize,encode]', 'events', lambda fileName: read_partitions(
+		NClusterPartitionInputFormat(0, materialize=True, colDelimiter=COL_DELIMITER, encode=True, inputFile=open(fileName)))),
+	('NClusterPartitionInputFormat[unsorted]', 'events', lambda fileName: read_partitions(
+		NClusterPartitionInputFormat(0, colDelimiter=COL_DELIMITER, presorted=False, memoryBudget=8 << 20, inputFile=open(fileName)))),
+	('NClusterRowInputFormat', 'users', lambda fileName: read_partitions(
+		NClusterRowInputFormat(inputFile=open(fileName)))),
+	('MmapInputFormat', 'users', lambda fileName: read_rows(
+		MmapInputFormat(fileName).generate_input())),
+	('BinaryInputFormat', 'users.bin', lambda fileName: read_rows(
+		BinaryInputFormat(inputFile=open(fileName, 'rb')).generate_input())),
+]
+
+
+class CountingFile(object):
+	"""A file-like sink that only counts the bytes written to it."""
+	def __init__(self):
+		self.bytesWritten = 0
+		
+	def write(self, s):
+		self.bytesWritten += len(s)
+		
+	def flush(self):
+		pass
+		
+		
+def install_schemas():
+	"""Add BENCH_SCHEMAS to the schema module, creating the module if there is none."""
+	try:
+		import schema
+	except ImportError:
+		schema = sys.modules['schema'] = imp.new_module('schema')
+	for name, meta in BENCH_SCHEMAS.iteritems():
+		setattr(schema, name, meta)
+		
+		
+def measure_mapper(fileName, mapperClass, kwargs, reducerClass):
+	"""Run a mapper over fileName, returning (rows in, bytes out)."""
+	sink = CountingFile()
+	writer = RowWriter(sink)
+	if reducerClass:
+		writer = reducers.CombiningWriter(writer, reducers.HashCombiner(reducerClass()))
+	mapper = mapperClass(**kwargs)
+	rowsIn = [0]
+	def counted(f):
+		for rowsIn[0], line in enumerate(f, 1):
+			yield line
+	with open(fileName) as f:
+		# The sampling mappers report to stderr, keep the benchmark output clean
+		stderr, sys.stderr = sys.stderr, open(os.devnull, 'w')
+		try:
+			run(mapper, counted(f), writer)
+		finally:
+			sys.stderr = stderr
+	writer.close()
+	return rowsIn[0], sink.bytesWritten
+	
+	
+def run_case(measure):
+	"""Run measure in a forked child, returning its result, timing and peak RSS."""
+	readEnd, writeEnd = os.pipe()
+	pid = os.fork()
+	if pid == 0:
+		os.close(readEnd)
+		status = 0
+		try:
+			startRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+			start = time.time()
+			rows, bytesOut = measure()
+			seconds = time.time() - start
+			result = dict(rows=rows, bytesOut=bytesOut, seconds=seconds, startRssKb=startRss,
+				maxRssKb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+		except Exception, e:
+			result = dict(error="%s: %s" % (e.__class__.__name__, e))
+			status = 1
+		with os.fdopen(writeEnd, 'w') as f:
+			json.dump(result, f)
+		os._exit(status)
+	os.close(writeEnd)
+	with os.fdopen(readEnd) as f:
+		result = json.load(f)
+	os.waitpid(pid, 0)
+	return result
+	
+	
+def prepare_data(dataDir, rows, seed):
+	"""Generate the datasets into dataDir, reusing files already there."""
+	files = {}
+	for dataset, kwargs in (('users', {}), ('events', dict(users=max(1, rows // 1000))), ('groups', dict(groups=max(1, rows // 1000)))):
+		fileName = files[dataset] = os.path.join(dataDir, '%s-%d-%d.txt' % (dataset, rows, seed))
+		if not os.path.exists(fileName):
+			with open(fileName + '.tmp', 'w') as f:
+				datagen.write_rows(datagen.GENERATORS[dataset](rows, seed=seed, **kwargs), f)
+			os.rename(fileName + '.tmp', fileName)
+	fileName = files['users.bin'] = os.path.join(dataDir, 'users-%d-%d.bin' % (rows, seed))
+	if not os.path.exists(fileName):
+		with open(fileName + '.tmp', 'wb') as f:
+			writer = BinaryRowWriter(f)
+			with open(files['users']) as users:
+				for line in users:
+					writer.write_fields(line.rstrip('\n').split(COL_DELIMITER))
+			writer.close()
+		os.rename(fileName + '.tmp', fileName)
+	# HyperLogLog sketches of the events of each user, merged by SketchMergeMapper
+	fileName = files['sketches'] = os.path.join(dataDir, 'sketches-%d-%d.txt' % (rows, seed))
+	if not os.path.exists(fileName):
+		with open(fileName + '.tmp', 'w') as f:
+			writer = RowWriter(f)
+			with open(files['events']) as events:
+				run(mappers.HyperLogLogMapper(column='1', partitionColumn='0', precision='10'), events, writer)
+			writer.close()
+		os.rename(fileName + '.tmp', fileName)
+	return files
+	
+	
+def main(rows=1000000, output=None, label=None, only=None, dataDir=None, seed=0):
+	rows, seed = int(rows), int(seed)
+	keepData = dataDir is not None
+	dataDir = dataDir if keepData else tempfile.mkdtemp(prefix='tripolium-bench-')
+	install_schemas()
+	try:
+		files = prepare_data(dataDir, rows, seed)
+		cases = [('mapper', label_, dataset, (lambda f=files[dataset], m=m, kw=kw, r=r: measure_mapper(f, m, kw, r)))
+			for label_, dataset, m, kw, r in MAPPER_CASES]
+		cases += [('inputformat', label_, dataset, (lambda f=files[dataset], read=read: (read(f), 0)))
+			for label_, dataset, read in INPUT_FORMAT_CASES]
+		results = []
+		for kind, name, dataset, measure in cases:
+			if only and only not in name:
+				continue
+			result = run_case(measure)
+			result.update(kind=kind, name=name, dataset=dataset, bytesIn=os.path.getsize(files[dataset]))
+			if 'seconds' in result:
+				result['rowsPerSec'] = result['rows'] / result['seconds'] if result['seconds'] else None
+				result['bytesPerSec'] = result['bytesIn'] / result['seconds'] if result['seconds'] else None
+				sys.stderr.write("%-45s %12.0f rows/s %8.1f MB/s %8d KB maxrss\n" % (name, result['rowsPerSec'] or 0,
+					(result['bytesPerSec'] or 0) / 1e6, result['maxRssKb']))
+			else:
+				sys.stderr.write("%-45s %s\n" % (name, result['error']))
+			results.append(result)
+	finally:
+		if not keepData:
+			shutil.rmtree(dataDir)
+	report = dict(label=label, created=datetime.utcnow().isoformat(), python=platform.python_version(),
+		platform=platform.platform(), rows=rows, seed=seed, results=results)
+	if output:
+		with open(output, 'w') as f:
+			json.dump(report, f, indent=1, sort_keys=True)
+	else:
+		json.dump(report, sys.stdout, indent=1, sort_keys=True)
+		sys.stdout.write('\n')
+	return report
+	
+	
+if __name__ == '__main__':
+	options = dict(arg[2:].split('=', 1) for arg in sys.argv[1:])
+	main(**options)
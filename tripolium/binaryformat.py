@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+binaryformat.py
+
+A compact binary row format for chaining Tripolium stages.
+
+A stream starts with MAGIC and holds length-prefixed rows. Each row is a
+field count followed by typed fields, so values written by one stage are
+read back by the next without being rendered to text and parsed again.
+
+	row   := uint32 payload length, uint16 field count, field*
+	field := 'i' int64 | 'd' float64 | 's' uint32 length, bytes
+	       | 'u' uint32 length, utf-8 bytes | 'b' uint8 | 'n'
+"""
+
+import struct
+import sys
+
+from inputformat import BaseInputFormat
+from utils import RowWriter
+from settings import OUTPUT_BUFFER_SIZE, COMPRESS_LEVEL
+
+MAGIC = 'TRPB\x01'
+
+_UINT32 = struct.Struct('<I')
+_ROW_HEADER = struct.Struct('<IH')
+_INT64 = struct.Struct('<q')
+_FLOAT64 = struct.Struct('<d')
+_INT64_MIN, _INT64_MAX = -(1 << 63), (1 << 63) - 1
+
+# Number of bytes read from the input at a time
+READ_SIZE = 1 << 20
+
+
+def encode_fields(fields):
+	"""Return the encoded row for a sequence of fields.
+	
+	Values of types without an encoding of their own are written as their str.
+	"""
+	parts = []
+	append = parts.append
+	packInt, packFloat, packLength = _INT64.pack, _FLOAT64.pack, _UINT32.pack
+	for f in fields:
+		t = type(f)
+		if t is str:
+			append('s' + packLength(len(f)))
+			append(f)
+		elif t is int or (t is long and _INT64_MIN <= f <= _INT64_MAX):
+			append('i' + packInt(f))
+		elif t is float:
+			append('d' + packFloat(f))
+		elif f is None:
+			append('n')
+		elif t is bool:
+			append('b\x01' if f else 'b\x00')
+		elif t is unicode:
+			f = f.encode('utf-8')
+			append('u' + packLength(len(f)))
+			append(f)
+		else:
+			f = str(f)
+			append('s' + packLength(len(f)))
+			append(f)
+	payload = ''.join(parts)
+	return _ROW_HEADER.pack(len(payload) + 2, len(fields)) + payload
+	
+	
+def decode_fields(buf, pos, count):
+	"""Decode count fields from buf starting at pos."""
+	fields = []
+	append = fields.append
+	unpackInt, unpackFloat, unpackLength = _INT64.unpack_from, _FLOAT64.unpack_from, _UINT32.unpack_from
+	for i in xrange(count):
+		tag = buf[pos]
+		pos += 1
+		if tag == 's' or tag == 'u':
+			n = unpackLength(buf, pos)[0]
+			pos += 4
+			f = buf[pos:pos + n]
+			append(f if tag == 's' else f.decode('utf-8'))
+			pos += n
+		elif tag == 'i':
+			append(unpackInt(buf, pos)[0])
+			pos += 8
+		elif tag == 'd':
+			append(unpackFloat(buf, pos)[0])
+			pos += 8
+		elif tag == 'n':
+			append(None)
+		elif tag == 'b':
+			append(buf[pos] == '\x01')
+			pos += 1
+		else:
+			raise ValueError("Unknown field tag %r" % (tag,))
+	return tuple(fields)
+	
+	
+class BinaryInputFormat(BaseInputFormat):
+	"""Generate rows, as tuples of typed fields, from a binary row stream."""
+	def __init__(self, *args, **kwargs):
+		super(BinaryInputFormat, self).__init__(*args, **kwargs)
+		self.generate_input = self.generate_input_row
+		
+	def generate_input_row(self):
+		"""Generate each row as a tuple of typed fields."""
+		f = getattr(self.inputFile, 'buffer', self.inputFile)
+		magic = f.read(len(MAGIC))
+		if not magic:
+			return
+		if magic != MAGIC:
+			raise ValueError("%s: input is not a binary row stream" % (self.__class__.__name__,))
+		unpackHeader = _ROW_HEADER.unpack_from
+		buf, pos = '', 0
+		while True:
+			chunk = f.read(READ_SIZE)
+			buf = buf[pos:] + chunk
+			pos = 0
+			end = len(buf)
+			while end - pos >= 6:
+				length, count = unpackHeader(buf, pos)
+				if end - pos < length + 4:
+					break
+				yield decode_fields(buf, pos + 6, count)
+				self.inputLineNum += 1
+				pos += length + 4
+			if not chunk:
+				if pos < end:
+					raise ValueError("%s: truncated row at end of input" % (self.__class__.__name__,))
+				return
+				
+				
+class BinaryRowWriter(RowWriter):
+	"""Buffer key, value pairs as binary rows.
+	
+	A pair is written as a row holding the key followed by the value, or by
+	the fields of the value when it is a tuple such as a schema Record.
+	"""
+	textBlocks = False
+	
+	def __init__(self, outputFile=sys.stdout, bufferSize=OUTPUT_BUFFER_SIZE, compression=None, compressLevel=COMPRESS_LEVEL):
+		super(BinaryRowWriter, self).__init__(getattr(outputFile, 'buffer', outputFile), bufferSize, compression, compressLevel)
+		self.buffer.append(MAGIC)
+		self.bufferedBytes += len(MAGIC)
+		
+	def write_row(self, s):
+		self.write_fields((s,))
+		
+	def write_fields(self, fields):
+		"""Buffer a row of typed fields."""
+		row = encode_fields(fields)
+		self.buffer.append(row)
+		self.bufferedBytes += len(row)
+		if self.bufferedBytes >= self.bufferSize:
+			self.flush()
+			
+	def write_pairs(self, pairs):
+		rows = [encode_fields((k,) + v if isinstance(v, tuple) else (k, v)) for k, v in pairs]
+		block = ''.join(rows)
+		self.buffer.append(block)
+		self.bufferedBytes += len(block)
+		if self.bufferedBytes >= self.bufferSize:
+			self.flush()
+			
+	def write_block(self, block):
+		raise TypeError("%s cannot write blocks of text rows" % (self.__class__.__name__,))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+checkpoint.py
+
+Checkpoints that let a long run of the driver resume where it died.
+
+Every so often, between blocks of rows, the output is flushed and synced to
+disk and a checkpoint file is replaced atomically with the number of input
+rows consumed, the size of the output and the number of rows in it, and a
+pickled snapshot of the mapper's state from its get_state. A restarted run
+reads the checkpoint, truncates the output back to its recorded size, which
+drops any rows written after it, restores the mapper and skips to the
+recorded input row. The checkpoint is removed when the run completes.
+
+	python mapreduce.py SessionMapper --inputFile=events.txt --outputFile=sessions.txt --checkpoint=sessions.ckpt
+	
+Rows are resumed by line number, which a plain input file seeks to through
+its line-offset index. Compressed output is checkpointed at the end of a
+stream, so the truncated output is a complete concatenation of streams.
+"""
+
+import cPickle as pickle
+import os
+import time
+
+from settings import CHECKPOINT_INTERVAL
+from utils import generate_batches
+
+# Version of the checkpoint file layout
+VERSION = 1
+
+
+class Checkpoint(object):
+	"""A checkpoint file, replaced atomically each time it is saved.
+	
+	:type fileName: string
+	:param fileName: The path of the checkpoint file
+	"""
+	def __init__(self, fileName):
+		super(Checkpoint, self).__init__()
+		self.fileName = fileName
+		
+	def load(self):
+		"""Return the saved state as a dictionary, None when there is no checkpoint."""
+		try:
+			f = open(self.fileName, 'rb')
+		except IOError:
+			return None
+		with f:
+			state = pickle.load(f)
+		if state.get('version') != VERSION:
+			raise ValueError("checkpoint %s has version %r, expected %d" % (self.fileName, state.get('version'), VERSION))
+		return state
+		
+	def save(self, state):
+		"""Atomically replace the checkpoint with state, synced to disk."""
+		state = dict(state, version=VERSION, time=time.time())
+		tmpName = self.fileName + '.tmp'
+		with open(tmpName, 'wb') as f:
+			pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+			f.flush()
+			os.fsync(f.fileno())
+		os.rename(tmpName, self.fileName)
+		
+	def remove(self):
+		"""Remove the checkpoint once the run is complete."""
+		try:
+			os.remove(self.fileName)
+		except OSError:
+			pass
+			
+			
+class LineCounter(object):
+	"""Iterate the rows of source, counting the rows consumed.
+	
+	:type line: int
+	:param line: The line number of the first row of source
+	"""
+	def __init__(self, source, line=0):
+		super(LineCounter, self).__init__()
+		self.source = source
+		self.line = line
+		self.exhausted = False
+		
+	def __iter__(self):
+		for row in self.source:
+			self.line += 1
+			yield row
+		self.exhausted = True
+		
+	def generate_batches(self, batchSize, offset):
+		"""Generate the (keys, values) blocks of source, counting the rows of each block."""
+		for keys, values in generate_batches(self.source, batchSize, offset):
+			self.line += len(keys)
+			yield keys, values
+		self.exhausted = True
+		
+		
+def check_resumable(mapper):
+	"""Raise ValueError unless the state of mapper can be checkpointed."""
+	if not mapper.stateless and mapper.checkpointFields is None:
+		raise ValueError("%s does not declare its checkpointFields and can not be checkpointed" % (mapper.__class__.__name__,))
+		
+		
+def open_output(fileName, state):
+	"""Open the output file of a checkpointed run, truncated to the size saved in state.
+	
+	Without a saved state the file is created, or emptied when it exists.
+	"""
+	if state is None:
+		return open(fileName, 'wb')
+	outputBytes = state['outputBytes']
+	outputFile = open(fileName, 'r+b')
+	outputFile.seek(0, os.SEEK_END)
+	if outputFile.tell() < outputBytes:
+		outputFile.close()
+		raise ValueError("%s is shorter than the %d bytes recorded by its checkpoint" % (fileName, outputBytes))
+	outputFile.seek(outputBytes)
+	outputFile.truncate()
+	return outputFile
+	
+	
+class CheckpointingWriter(object):
+	"""Wrap a writer, saving a checkpoint after a block of rows once interval seconds have passed.
+	
+	The mapper is between blocks when its output is written, so its state
+	matches the rows source has consumed. No checkpoint is saved once source
+	is exhausted, as the rows written by the mapper's finish are not resumable.
+	
+	:type writer: RowWriter
+	:param writer: The writer to wrap, writing to outputFile
+	
+	:type outputFile: file
+	:param outputFile: The output file, as opened by open_output
+	
+	:type source: LineCounter
+	:param source: The counted input rows
+	
+	:type checkpoint: Checkpoint
+	:param checkpoint: The checkpoint to save
+	
+	:type job: dict
+	:param job: The mapper name and arguments, saved to check that a resumed run is the same job
+	
+	:type outputRows: int
+	:param outputRows: The number of rows already in the output
+	"""
+	def __init__(self, writer, outputFile, source, mapper, checkpoint, job, outputRows=0, interval=CHECKPOINT_INTERVAL):
+		super(CheckpointingWriter, self).__init__()
+		self.writer = writer
+		self.outputFile = outputFile
+		self.source = source
+		self.mapper = mapper
+		self.checkpoint = checkpoint
+		self.job = job
+		self.outputRows = outputRows
+		self.interval = interval
+		self.textBlocks = getattr(writer, 'textBlocks', False)
+		self.lastSaved = time.time()
+		
+	def write_pairs(self, pairs):
+		if not isinstance(pairs, list):
+			pairs = list(pairs)
+		self.writer.write_pairs(pairs)
+		self.outputRows += len(pairs)
+		if time.time() - self.lastSaved >= self.interval and not self.source.exhausted:
+			self.save()
+			
+	def save(self):
+		"""Sync the output to disk and save a checkpoint of the run so far."""
+		self.writer.sync()
+		os.fsync(self.outputFile.fileno())
+		self.checkpoint.save(dict(self.job, inputLine=self.source.line, outputBytes=self.outputFile.tell(),
+			outputRows=self.outputRows, mapperState=self.mapper.get_state() if self.mapper.checkpointFields else {}))
+		self.lastSaved = time.time()
+		
+	def end_partition(self):
+		self.writer.end_partition()
+		
+	def close(self):
+		self.writer.close()
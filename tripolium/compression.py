@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+compression.py
+
+Transparent gzip, bz2 and xz streams for input formats and row writers.
+
+Compressed input is recognised by its magic bytes and decompressed a large
+block at a time, optionally on a background thread; zlib and bz2 release the
+GIL while they work, so decompression overlaps with the mapper. Concatenated
+streams, as written by pigz or cat, are read through. xz needs an lzma
+module, which Python 2 does not ship; backports.lzma or pyliblzma provide one.
+"""
+
+import bz2
+import zlib
+from Queue import Queue
+from itertools import chain
+from cStringIO import StringIO
+
+from settings import DECOMPRESS_BLOCK_SIZE, COMPRESS_LEVEL
+
+try:
+	import lzma
+except ImportError:
+	try:
+		from backports import lzma
+	except ImportError:
+		lzma = None
+		
+# Leading bytes of each compressed format
+MAGIC = (
+	('gzip', '\x1f\x8b'),
+	('bz2', 'BZh'),
+	('xz', '\xfd7zXZ\x00'),
+)
+
+# Number of decompressed blocks a background thread may read ahead
+READ_AHEAD = 4
+
+
+def detect(head):
+	"""Return the compression format whose magic bytes start head, None for plain data."""
+	for name, magic in MAGIC:
+		if head.startswith(magic):
+			return name
+	return None
+	
+	
+def require_lzma():
+	"""Raise ImportError if no lzma module is available for xz streams."""
+	if lzma is None:
+		raise ImportError("xz streams need an lzma module, install backports.lzma")
+		
+		
+def check_compression(compression, auto=False):
+	"""Raise an error if streams in the given format can not be read or written here.
+	
+	Drivers call this while parsing their options, so a bad format is
+	reported before any output file is opened and truncated.
+	
+	:type auto: bool
+	:param auto: Accept 'auto', as open_input does
+	
+	:raises ValueError: If compression is not a known format
+	:raises ImportError: If compression is 'xz' and no lzma module is available
+	"""
+	if compression is None or (auto and compression == 'auto'):
+		return
+	if compression not in [name for name, magic in MAGIC]:
+		raise ValueError("unknown compression %r, expected one of %s" % (compression, ', '.join([name for name, magic in MAGIC])))
+	if compression == 'xz':
+		require_lzma()
+		
+		
+class PlainDecompressor(object):
+	"""A stand-in decompressor for data that is not compressed."""
+	unused_data = ''
+	
+	def decompress(self, data):
+		return data
+		
+		
+def new_decompressor(compression):
+	"""Return a decompressor for one stream in the given format."""
+	if compression == 'gzip':
+		return zlib.decompressobj(16 + zlib.MAX_WBITS)
+	elif compression == 'bz2':
+		return bz2.BZ2Decompressor()
+	elif compression == 'xz':
+		require_lzma()
+		return lzma.LZMADecompressor()
+	elif compression is None:
+		return PlainDecompressor()
+	raise ValueError("unknown compression %r" % (compression,))
+	
+	
+def new_compressor(compression, level=COMPRESS_LEVEL):
+	"""Return a compressor writing one stream in the given format."""
+	if compression == 'gzip':
+		return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+	elif compression == 'bz2':
+		return bz2.BZ2Compressor(max(1, level))
+	elif compression == 'xz':
+		require_lzma()
+		return lzma.LZMACompressor(preset=level)
+	raise ValueError("unknown compression %r" % (compression,))
+	
+	
+class DecompressingReader(object):
+	"""A read-only file object over a compressed stream.
+	
+	Iterating yields lines with their line endings, like a file. read is
+	provided for binary formats.
+	
+	:type inputFile: file
+	:param inputFile: The file the compressed stream is read from
+	
+	:type compression: string
+	:param compression: 'gzip', 'bz2', 'xz', or None for plain data
+	
+	:type head: string
+	:param head: Bytes already read from inputFile to detect the format
+	
+	:type blockSize: int
+	:param blockSize: The number of compressed bytes read at a time
+	
+	:type background: bool
+	:param background: Read and decompress on a background thread
+	"""
+	def __init__(self, inputFile, compression, head='', blockSize=DECOMPRESS_BLOCK_SIZE, background=False):
+		super(DecompressingReader, self).__init__()
+		self.inputFile = inputFile
+		self.compression = compression
+		self.head = head
+		self.blockSize = blockSize
+		self.blocks = self.generate_background_blocks() if background else self.generate_blocks()
+		self.pending = ''
+		
+	def generate_blocks(self):
+		"""Generate blocks of decompressed data."""
+		read, blockSize = self.inputFile.read, self.blockSize
+		decompressor = new_decompressor(self.compression)
+		data, self.head = self.head or read(blockSize), ''
+		while data:
+			try:
+				block = decompressor.decompress(data)
+			except EOFError:
+				# The stream ended exactly at the end of the last read, so its unused_data
+				# was empty, and another stream follows it
+				decompressor = new_decompressor(self.compression)
+				continue
+			if block:
+				yield block
+			data = decompressor.unused_data
+			if data:
+				# The stream ended and another one follows it
+				decompressor = new_decompressor(self.compression)
+			else:
+				data = read(blockSize)
+		if hasattr(decompressor, 'flush'):
+			block = decompressor.flush()
+			if block:
+				yield block
+				
+	def generate_background_blocks(self):
+		"""Generate blocks of decompressed data read ahead by a background thread."""
+		# Imported here, threads are only started for background decompression
+		from overlap import StageThread, END
+		queue = Queue(READ_AHEAD)
+		def read_ahead():
+			try:
+				for block in self.generate_blocks():
+					queue.put(block)
+			finally:
+				queue.put(END)
+		thread = StageThread(read_ahead)
+		thread.start()
+		for block in iter(queue.get, END):
+			yield block
+		thread.join()
+		thread.reraise()
+		
+	def __iter__(self):
+		blocks, tail = self.blocks, ''
+		if self.pending:
+			blocks = chain([self.pending], blocks)
+			self.pending = ''
+		for block in blocks:
+			lines = StringIO(tail + block).readlines()
+			tail = lines.pop() if not lines[-1].endswith('\n') else ''
+			for line in lines:
+				yield line
+		if tail:
+			yield tail
+			
+	def read(self, size=-1):
+		"""Read at most size decompressed bytes, all of them if size is negative."""
+		chunks, n = [self.pending], len(self.pending)
+		while size < 0 or n < size:
+			block = next(self.blocks, None)
+			if block is None:
+				break
+			chunks.append(block)
+			n += len(block)
+		data = ''.join(chunks)
+		if size < 0:
+			self.pending = ''
+			return data
+		self.pending = data[size:]
+		return data[:size]
+		
+	def unread(self, data):
+		"""Push data back, to be read again before the rest of the stream."""
+		self.pending = data + self.pending
+		
+	def close(self):
+		self.inputFile.close()
+		
+		
+def open_input(inputFile, compression='auto', blockSize=DECOMPRESS_BLOCK_SIZE, background=False):
+	"""Return a file object with the decompressed contents of inputFile.
+	
+	With compression 'auto' the format is detected from the leading bytes. A
+	plain seekable file is returned as it is, rewound.
+	
+	:type inputFile: file or string
+	:param inputFile: An open file or the name of one
+	
+	:type compression: string
+	:param compression: 'auto', 'gzip', 'bz2', 'xz', or None for plain data
+	"""
+	if isinstance(inputFile, basestring):
+		inputFile = open(inputFile, 'rb')
+	head = ''
+	if compression == 'auto':
+		head = inputFile.read(blockSize)
+		compression = detect(head)
+		if compression is None:
+			try:
+				inputFile.seek(0)
+				return inputFile
+			except IOError:
+				pass
+	elif compression is None:
+		return inputFile
+	return DecompressingReader(inputFile, compression, head, blockSize, background)
+	
+	
+class CompressingFile(object):
+	"""A write-only file object that compresses what is written to another file.
+	
+	:type outputFile: file
+	:param outputFile: The file the compressed stream is written to
+	
+	:type compression: string
+	:param compression: 'gzip', 'bz2' or 'xz'
+	
+	:type level: int
+	:param level: The compression level, 1 is fastest and 9 is smallest
+	"""
+	def __init__(self, outputFile, compression, level=COMPRESS_LEVEL):
+		super(CompressingFile, self).__init__()
+		self.outputFile = outputFile
+		self.compression = compression
+		self.level = level
+		self.compressor = new_compressor(compression, level)
+		
+	def write(self, data):
+		data = self.compressor.compress(data)
+		if data:
+			self.outputFile.write(data)
+			
+	def flush(self):
+		"""Flush the underlying file, the compressor keeps its partial block."""
+		self.outputFile.flush()
+		
+	def finish(self):
+		"""End the compressed stream and flush it, leaving the underlying file open."""
+		if self.compressor is not None:
+			self.outputFile.write(self.compressor.flush())
+			self.compressor = None
+		self.outputFile.flush()
+		
+	def end_stream(self):
+		"""End the compressed stream and start another, concatenated streams are read as one."""
+		self.finish()
+		self.compressor = new_compressor(self.compression, self.level)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+counters.py
+
+Hadoop-style runtime counters and per-stage timing for the driver.
+
+Counters are only collected when the driver is asked for them, and then
+once per block of rows rather than once per row.
+"""
+
+import sys
+import time
+from collections import defaultdict
+
+from settings import ROW_DELIMITER
+
+# Stages whose cumulative wall-clock time is recorded
+STAGES = ('input', 'mapper', 'output')
+
+
+class Counters(object):
+	"""Named counters in groups, and cumulative time per stage.
+	
+	:type progressInterval: float
+	:param progressInterval: Seconds between progress lines on stderr, None for no progress lines
+	
+	:type reportFile: string
+	:param reportFile: The sidecar file the summary is written to, stderr if None
+	"""
+	def __init__(self, progressInterval=None, reportFile=None):
+		super(Counters, self).__init__()
+		self.progressInterval = progressInterval
+		self.reportFile = reportFile
+		self.groups = []
+		self.counts = defaultdict(int)
+		self.times = dict((stage, 0.0) for stage in STAGES)
+		self.start = self.lastProgress = time.time()
+		
+	def incr(self, group, name, n=1):
+		"""Add n to counter name of group."""
+		if (group, name) not in self.counts and group not in self.groups:
+			self.groups.append(group)
+		self.counts[(group, name)] += n
+		
+	def get(self, group, name):
+		"""Return the value of counter name of group."""
+		return self.counts.get((group, name), 0)
+		
+	def add_time(self, stage, seconds):
+		"""Add seconds to the cumulative time of stage."""
+		self.times[stage] += seconds
+		
+	def progress(self):
+		"""Write a progress line to stderr when progressInterval has passed since the last one."""
+		if self.progressInterval is None:
+			return
+		now = time.time()
+		if now - self.lastProgress < self.progressInterval:
+			return
+		self.lastProgress = now
+		rowsIn = self.get('Input', 'ROWS_IN')
+		elapsed = now - self.start
+		sys.stderr.write("progress: %d rows in, %d rows out, %.1fs elapsed, %.0f rows/s\n" % (
+			rowsIn, self.get('Output', 'ROWS_OUT'), elapsed, rowsIn / elapsed if elapsed else 0.0))
+		
+	def report(self):
+		"""Return the summary of all counters and timings as text."""
+		lines = ["Counters:"]
+		groups = [g for g in self.groups if g not in ('Input', 'Output')]
+		for group in [g for g in ['Input'] + groups + ['Output'] if g in self.groups]:
+			lines.append("\t%s" % (group,))
+			names = [name for g, name in self.counts if g == group]
+			for name in sorted(names):
+				lines.append("\t\t%s=%d" % (name, self.counts[(group, name)]))
+			rowsIn, rowsOut = self.counts.get((group, 'ROWS_IN')), self.counts.get((group, 'ROWS_OUT'))
+			if group not in ('Input', 'Output') and rowsIn is not None and rowsOut is not None:
+				lines.append("\t\tROWS_DROPPED=%d" % (max(0, rowsIn - rowsOut),))
+		lines.append("\tTiming (seconds)")
+		for stage in STAGES:
+			lines.append("\t\t%s=%.3f" % (stage.upper(), self.times[stage]))
+		lines.append("\t\tTOTAL=%.3f" % (time.time() - self.start,))
+		return '\n'.join(lines) + '\n'
+		
+	def emit(self):
+		"""Write the summary to the sidecar file or stderr."""
+		if self.reportFile:
+			with open(self.reportFile, 'w') as f:
+				f.write(self.report())
+		else:
+			sys.stderr.write(self.report())
+			
+			
+class CountingWriter(object):
+	"""Wrap a writer, counting the rows written through it and timing the writes.
+	
+	:type writer: RowWriter
+	:param writer: The writer to wrap
+	
+	:type counters: Counters
+	:param counters: The counters to update
+	"""
+	def __init__(self, writer, counters):
+		super(CountingWriter, self).__init__()
+		self.writer = writer
+		self.counters = counters
+		self.textBlocks = getattr(writer, 'textBlocks', False)
+		
+	def write_pairs(self, pairs):
+		start = time.time()
+		pairs = list(pairs)
+		self.writer.write_pairs(pairs)
+		self.counters.add_time('output', time.time() - start)
+		self.counters.incr('Output', 'ROWS_OUT', len(pairs))
+		
+	def write_block(self, block):
+		start = time.time()
+		self.writer.write_block(block)
+		self.counters.add_time('output', time.time() - start)
+		self.counters.incr('Output', 'ROWS_OUT', block.count(ROW_DELIMITER))
+		
+	def end_partition(self):
+		self.writer.end_partition()
+		
+	def close(self):
+		start = time.time()
+		self.writer.close()
+		self.counters.add_time('output', time.time() - start)
+		
+		
+def count_rows(source, counters, every=4096):
+	"""Generate the rows of source, counting them and their bytes as input every so many rows."""
+	rows = nbytes = 0
+	try:
+		for line in source:
+			rows += 1
+			nbytes += len(line) if isinstance(line, basestring) else 0
+			if rows == every:
+				counters.incr('Input', 'ROWS_IN', rows)
+				counters.incr('Input', 'BYTES_READ', nbytes)
+				counters.progress()
+				rows = nbytes = 0
+			yield line
+	finally:
+		counters.incr('Input', 'ROWS_IN', rows)
+		counters.incr('Input', 'BYTES_READ', nbytes)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+csvloader.py
+
+Convert CSV files to delimited db rows for loading into nCluster.
+
+A large plain file is split into chunks on record boundaries, and the chunks
+are converted by a pool of worker processes. A newline ends a record only when
+an even number of quote characters precede it, so quoted fields that span
+lines are never cut. This holds for dialects that escape quotes by doubling
+them, which the csv module does by default; files that escape with an
+escapechar, and compressed files, are converted serially.
+
+	python csvloader.py <file.csv> [--workers=N] [--columns=a,b] [--header=auto|1|0] [--dialect=excel]
+"""
+
+import csv
+import mmap
+import sys
+from contextlib import closing
+from itertools import islice
+from cStringIO import StringIO
+
+from settings import COL_DELIMITER, ROW_DELIMITER, BATCH_SIZE, CSV_CHUNK_SIZE
+
+# Number of bytes read from the start of a file to sniff its dialect and header
+SAMPLE_SIZE = 1 << 16
+
+# Attributes that describe a csv dialect
+DIALECT_PARAMS = ('delimiter', 'quotechar', 'escapechar', 'doublequote', 'skipinitialspace', 'quoting', 'lineterminator')
+
+
+def dialect_params(sample, dialect=None):
+	"""Return the csv reader parameters of a dialect as a dictionary.
+
+	:type dialect: string or csv.Dialect
+	:param dialect: A registered dialect name or a dialect, sniffed from sample if None
+	"""
+	if dialect is None:
+		try:
+			dialect = csv.Sniffer().sniff(sample)
+		except csv.Error:
+			dialect = csv.excel
+	elif isinstance(dialect, basestring):
+		dialect = csv.get_dialect(dialect)
+	return dict((name, getattr(dialect, name)) for name in DIALECT_PARAMS)
+
+
+def has_header(sample, header='auto'):
+	"""Return whether the first record is a header, sniffing sample when header is 'auto'."""
+	if header != 'auto':
+		return bool(header) and header not in ('0', 'false')
+	try:
+		return csv.Sniffer().has_header(sample)
+	except csv.Error:
+		return False
+
+
+def next_boundary(mm, pos, odd, quotechar):
+	"""Return the offset just past the first newline at or after pos that ends a record.
+
+	:type odd: bool
+	:param odd: Whether an odd number of quote characters precede pos in its record
+	"""
+	size = len(mm)
+	while True:
+		nl = mm.find('\n', pos)
+		if nl == -1:
+			return size
+		if quotechar:
+			odd ^= mm[pos:nl].count(quotechar) & 1
+		if not odd:
+			return nl + 1
+		pos = nl + 1
+
+
+def split_records(mm, start, chunkSize, quotechar):
+	"""Generate (start, end) byte ranges of about chunkSize bytes that hold whole records."""
+	size = len(mm)
+	while start < size:
+		target = start + chunkSize
+		if target >= size:
+			yield start, size
+			return
+		odd = bool(mm[start:target].count(quotechar) & 1) if quotechar else False
+		end = next_boundary(mm, target, odd, quotechar)
+		yield start, end
+		start = end
+
+
+def convert_rows(rows, columns=None, joined=True):
+	"""Return the csv records rows as db rows, a block of delimited text if joined."""
+	join = COL_DELIMITER.join
+	if columns is None:
+		lines = [join(row) for row in rows]
+	else:
+		lines = [join([row[i] for i in columns]) for row in rows]
+	if joined:
+		return ''.join([line + ROW_DELIMITER for line in lines])
+	return lines
+
+
+def convert_chunk(task):
+	"""Convert the records in a byte range of a csv file, run in a worker process."""
+	fileName, start, end, params, columns, joined = task
+	with open(fileName, 'rb') as f:
+		f.seek(start)
+		data = f.read(end - start)
+	return convert_rows(csv.reader(StringIO(data), **params), columns, joined)
+
+
+def resolve_columns(columns, headerRow):
+	"""Return columns as 0-based indices, looking names up in headerRow."""
+	if columns is None:
+		return None
+	if isinstance(columns, basestring):
+		columns = columns.split(',')
+	indices = []
+	for column in columns:
+		if isinstance(column, int) or str(column).isdigit():
+			indices.append(int(column))
+		elif headerRow is None:
+			raise ValueError("column %r is selected by name but the file has no header" % (column,))
+		else:
+			indices.append(headerRow.index(column))
+	return indices
+
+
+def generate_blocks(csvFile, dialect=None, columns=None, header='auto', workers=1, chunkSize=CSV_CHUNK_SIZE, joined=True):
+	"""Generate the db rows of a csv file in blocks, in file order.
+
+	:type csvFile: string
+	:param csvFile: The name of the csv file, which may be compressed
+
+	:type dialect: string or csv.Dialect
+	:param dialect: The csv dialect, sniffed from the start of the file if None
+
+	:type columns: list
+	:param columns: The 0-based indices or header names of the columns to keep, all if None
+
+	:type header: bool or string
+	:param header: Whether the first record is a header to skip, sniffed if 'auto'
+
+	:type workers: int
+	:param workers: The number of worker processes converting chunks
+
+	:type chunkSize: int
+	:param chunkSize: The approximate number of bytes in a chunk
+
+	:type joined: bool
+	:param joined: Yield blocks of delimited text rather than lists of rows
+	"""
+	# Imported here, compression is only needed for csv input
+	from compression import DecompressingReader, open_input
+	f = open_input(csvFile)
+	sample = f.read(SAMPLE_SIZE)
+	params = dialect_params(sample, dialect)
+	headerRow = None
+	if has_header(sample, header):
+		headerRow = next(csv.reader(StringIO(sample), **params), None)
+	columns = resolve_columns(columns, headerRow)
+	quotechar = params['quotechar'] if params['quoting'] != csv.QUOTE_NONE else None
+	# An empty file can not be mapped, and has no records to split anyway
+	parallel = workers > 1 and sample and not isinstance(f, DecompressingReader) and not params['escapechar']
+	if not parallel:
+		if isinstance(f, DecompressingReader):
+			f.unread(sample)
+		else:
+			f.seek(0)
+		with closing(f):
+			rows = csv.reader(f, **params)
+			if headerRow is not None:
+				next(rows)
+			while True:
+				block = list(islice(rows, BATCH_SIZE))
+				if not block:
+					break
+				yield convert_rows(block, columns, joined)
+		return
+	# Imported here, process pools are only needed for parallel conversion
+	import multiprocessing
+	from parallel import imap_ordered
+	with closing(f):
+		mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		start = next_boundary(mm, 0, False, quotechar) if headerRow is not None else 0
+		ranges = list(split_records(mm, start, chunkSize, quotechar))
+		mm.close()
+	tasks = ((csvFile, start, end, params, columns, joined) for start, end in ranges)
+	pool = multiprocessing.Pool(workers)
+	try:
+		for block in imap_ordered(pool, convert_chunk, tasks, 2 * workers):
+			yield block
+	finally:
+		# At most a window of chunks is in flight, finishing them is quicker
+		# and safer than terminating workers that are sending large results
+		pool.close()
+		pool.join()
+
+
+def load_csv(csvFile, outputFile=sys.stdout, **kwargs):
+	"""Write the db rows of a csv file to outputFile in large buffered writes.
+
+	The keyword arguments are those of generate_blocks.
+	"""
+	from utils import RowWriter
+	writer = RowWriter(outputFile)
+	# Closed explicitly so a failed write shuts the worker pool down straight away
+	with closing(generate_blocks(csvFile, joined=True, **kwargs)) as blocks:
+		for block in blocks:
+			writer.write_block(block)
+	writer.close()
+
+
+if __name__ == '__main__':
+	options = dict(arg[2:].split('=', 1) for arg in sys.argv[2:])
+	load_csv(sys.argv[1], dialect=options.get('dialect'), columns=options.get('columns'),
+		header=options.get('header', 'auto'), workers=int(options.get('workers', 1)),
+		chunkSize=int(options.get('chunkSize', CSV_CHUNK_SIZE)))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+datagen.py
+
+Generate synthetic input at any scale, modelled on the users table of the
+driver's DEBUG data and on the event streams the mappers process.
+
+	users:  userId, firstName, lastName, dob
+	events: userId, timestamp, sorted by user; events per user are Zipf skewed
+	groups: group, order, value, sorted by group; group sizes are Zipf skewed
+"""
+
+import random
+import sys
+import time
+from itertools import islice
+
+from settings import COL_DELIMITER, ROW_DELIMITER
+
+FIRST_NAMES = ("Paul", "Albert", "Richard", "Erwin", "Marie", "Niels", "Werner", "Max", "Lise", "Enrico")
+LAST_NAMES = ("Dirac", "Einstein", "Feynman", "Schrodinger", "Curie", "Bohr", "Heisenberg", "Planck", "Meitner", "Fermi")
+
+# Midnight 2010-01-01 UTC
+EPOCH_START = 1262304000
+
+
+def zipf_counts(total, keys, skew=1.0):
+	"""Split total rows over keys with Zipf weights 1 / rank ** skew, at least one row each."""
+	weights = [1.0 / (rank ** skew) for rank in xrange(1, keys + 1)]
+	scale = float(total) / sum(weights)
+	return [max(1, int(w * scale)) for w in weights]
+	
+	
+def generate_users(n, seed=0):
+	"""Generate n user rows."""
+	rnd = random.Random(seed)
+	rowFormat = COL_DELIMITER.join(["%d", "%s", "%s", "%s"])
+	for i in xrange(n):
+		dob = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(-2000000000 + rnd.randrange(2900000000)))
+		yield rowFormat % (1001 + i, rnd.choice(FIRST_NAMES), rnd.choice(LAST_NAMES), dob)
+		
+		
+def generate_events(n, users=1000, skew=1.0, seed=0):
+	"""Generate about n event rows for users, grouped by user with increasing timestamps."""
+	rnd = random.Random(seed)
+	rowFormat = "%d" + COL_DELIMITER + "%s"
+	strftime, gmtime = time.strftime, time.gmtime
+	for i, count in enumerate(zipf_counts(n, users, skew)):
+		t = EPOCH_START + rnd.randrange(86400)
+		for j in xrange(count):
+			# Mostly short gaps, with the occasional long one to start a new session
+			t += rnd.randrange(30) if rnd.random() < 0.9 else rnd.randrange(3600)
+			yield rowFormat % (1001 + i, strftime("%Y-%m-%d %H:%M:%S", gmtime(t)))
+			
+			
+def generate_groups(n, groups=1000, skew=1.0, seed=0):
+	"""Generate about n group, order, value rows, grouped by group."""
+	rnd = random.Random(seed)
+	rowFormat = COL_DELIMITER.join(["g%d", "%d", "%s"])
+	for i, count in enumerate(zipf_counts(n, groups, skew)):
+		for j in xrange(count):
+			yield rowFormat % (i, j, rnd.choice(LAST_NAMES))
+			
+			
+GENERATORS = {
+	'users': generate_users,
+	'events': generate_events,
+	'groups': generate_groups,
+}
+
+
+def write_rows(rows, f, blockSize=10000):
+	"""Write rows to f in blocks, returning the number of rows written."""
+	count = 0
+	while True:
+		block = list(islice(rows, blockSize))
+		if not block:
+			return count
+		f.write(ROW_DELIMITER.join(block) + ROW_DELIMITER)
+		count += len(block)
+		
+		
+if __name__ == '__main__':
+	# datagen.py <users|events|groups> <rows> [--keys=N] [--skew=S] [--seed=N]
+	kind, n = sys.argv[1], int(sys.argv[2])
+	options = dict(arg[2:].split('=') for arg in sys.argv[3:])
+	kwargs = dict(seed=int(options.get('seed', 0)))
+	if kind != 'users':
+		kwargs['skew'] = float(options.get('skew', 1.0))
+		kwargs['users' if kind == 'events' else 'groups'] = int(options.get('keys', 1000))
+	write_rows(GENERATORS[kind](n, **kwargs), sys.stdout)
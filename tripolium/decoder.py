@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+decoder.py
+
+Compile schema metadata into fast row decoders.
+
+A schema maps column names to their 1-based column index and type, e.g.
+{"userId": {"index": 1, "type": int}, "dob": {"index": 4, "type": str}}
+
+A column may also set "cache" to the number of converted values to keep in
+an LRU cache keyed on the raw string, for columns with few distinct values
+and an expensive type, e.g. {"country": {"index": 2, "type": Country, "cache": 1024}}
+"""
+
+from itertools import izip
+
+from settings import COL_DELIMITER
+
+
+def make_record_class(names):
+	"""Return a tuple-backed record class with the given column names.
+	
+	Records support attribute access, dictionary style access by column name
+	and render like a dictionary in schema order. Names that are not valid
+	attributes, such as 'user-id' or 'class', are only reachable by name or
+	position, their attributes are renamed to _<position>.
+	"""
+	# Imported here, collections is slow to import and only schema mappers need it
+	from collections import namedtuple
+	names = tuple(names)
+	base = namedtuple('Record', names, rename=True)
+	nameIndex = dict((name, i) for i, name in enumerate(names))
+	
+	class Record(base):
+		__slots__ = ()
+		
+		def __getitem__(self, key):
+			if isinstance(key, basestring):
+				key = nameIndex[key]
+			return tuple.__getitem__(self, key)
+			
+		def keys(self):
+			return list(names)
+			
+		def iteritems(self):
+			return izip(names, self)
+			
+		def __reduce__(self):
+			# The class is built at runtime, so records pickle as plain tuples
+			return (tuple, (tuple(self),))
+			
+		def __str__(self):
+			return '{' + ', '.join(['%r: %r' % item for item in izip(names, self)]) + '}'
+			
+	return Record
+	
+	
+class SchemaDecoder(object):
+	"""Decode raw delimited rows into typed records.
+	
+	The schema is compiled once: only the fields up to the highest referenced
+	column are split, and converters are applied from precomputed
+	(index, type) pairs. Rows that are already tuples of typed fields, as read
+	from a binary row stream, are projected without conversion.
+	
+	:type meta: dict
+	:param meta: The schema metadata
+	
+	:type colDelimiter: string
+	:param colDelimiter: The column delimiter of raw rows
+	"""
+	def __init__(self, meta, colDelimiter=COL_DELIMITER):
+		super(SchemaDecoder, self).__init__()
+		columns = sorted(meta.iteritems(), key=lambda item: item[1]["index"])
+		self.colDelimiter = colDelimiter
+		self.names = tuple([name for name, v in columns])
+		self.converters = tuple([(v["index"] - 1, self.make_converter(name, v)) for name, v in columns])
+		self.indices = tuple([i for i, colType in self.converters])
+		self.maxSplit = max([i for i, colType in self.converters]) + 1
+		self.recordClass = make_record_class(self.names)
+		
+	def make_converter(self, name, column):
+		"""Return the converter of a column, wrapped in an LRU cache if the column sets one."""
+		if not column.get("cache"):
+			return column["type"]
+		# Imported here, only schemas with cached columns need it
+		from memo import LRUCache
+		return LRUCache(column["type"], int(column["cache"]), name)
+		
+	def __call__(self, raw):
+		if not isinstance(raw, basestring):
+			return self.recordClass._make([raw[i] for i in self.indices])
+		fields = raw.split(self.colDelimiter, self.maxSplit)
+		return self.recordClass._make([colType(fields[i]) for i, colType in self.converters])
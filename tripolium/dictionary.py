@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+dictionary.py
+
+Dictionary encoding of repeated column values, to hold large partitions and
+per-key state in a fraction of the memory of their strings.
+
+A partition repeats the same values over and over, its partition key in
+every row and the few distinct values of most other columns. An InternTable
+keeps one copy of each distinct value and gives it a small integer code, and
+EncodedRows stores a partition as arrays of those codes, a few bytes a
+column, rather than a string and a list slot of about 80 bytes a row.
+
+	rows = EncodedRows('\\t')
+	rows.extend(lines)
+	for line in rows: ...
+	
+Columns with few repeats, such as timestamps, would cost more in the
+dictionary than they save, so a column whose first rows were mostly
+distinct values is packed end to end into delimited strings instead.
+Encoding costs a few microseconds a row, it pays off for partitions or
+key tables that would not otherwise fit in memory.
+"""
+
+from array import array
+from bisect import bisect_right
+from itertools import chain, count, imap, islice, izip
+
+
+class InternTable(object):
+	"""Map distinct values to small integer codes and back.
+	
+	Codes are assigned in order from 0. A discarded value's code is reused
+	for the next new value, so a table whose values come and go stays as
+	small as the values it holds.
+	"""
+	def __init__(self):
+		super(InternTable, self).__init__()
+		self.codes = {}
+		self.values = []
+		self.free = []
+		
+	def code(self, value):
+		"""Return the code of value, assigning the next one when value is new."""
+		codes = self.codes
+		try:
+			return codes[value]
+		except KeyError:
+			pass
+		if self.free:
+			code = self.free.pop()
+			self.values[code] = value
+		else:
+			code = len(self.values)
+			self.values.append(value)
+		codes[value] = code
+		return code
+		
+	def encode(self, values):
+		"""Return the codes of a list of values, assigning codes to the new ones."""
+		codes = map(self.codes.get, values)
+		if None in codes:
+			code = self.code
+			codes = [c if c is not None else code(value) for c, value in izip(codes, values)]
+		return codes
+		
+	def value(self, code):
+		"""Return the value of code."""
+		return self.values[code]
+		
+	def decoder(self):
+		"""Return a function from a code to its value."""
+		return self.values.__getitem__
+		
+	def intern(self, value):
+		"""Return the table's copy of value, so equal values share one object."""
+		return self.values[self.code(value)]
+		
+	def discard(self, value):
+		"""Forget value, its code is reused for the next new value."""
+		code = self.codes.pop(value)
+		self.values[code] = None
+		self.free.append(code)
+		
+	def __contains__(self, value):
+		return value in self.codes
+		
+	def __len__(self):
+		return len(self.values) - len(self.free)
+		
+		
+class PackedColumn(object):
+	"""The values of a column that rarely repeat, packed into delimited strings.
+	
+	Values come from splitting rows on the column delimiter, so they never
+	contain it and a block of them is stored as one string joined by it,
+	which costs a value its length, a delimiter and an offset rather than a
+	string object. Iterating splits a block at a time.
+	
+	:type delimiter: string
+	:param delimiter: A string no value contains
+	"""
+	def __init__(self, delimiter, values=()):
+		super(PackedColumn, self).__init__()
+		self.delimiter = delimiter
+		self.blocks = []
+		self.firstCodes = array('L')
+		self.offsets = array('I')
+		if values:
+			self.encode(values)
+			
+	def encode(self, values):
+		"""Append a block of values and return their codes."""
+		first = len(self.offsets)
+		offsets, pos, step = self.offsets, 0, len(self.delimiter)
+		for n in map(len, values):
+			offsets.append(pos)
+			pos += n + step
+		self.blocks.append(self.delimiter.join(values))
+		self.firstCodes.append(first)
+		return xrange(first, len(offsets))
+		
+	def value(self, code):
+		"""Return the value of code."""
+		firstCodes, offsets = self.firstCodes, self.offsets
+		i = bisect_right(firstCodes, code) - 1
+		block = self.blocks[i]
+		last = firstCodes[i + 1] - 1 if i + 1 < len(firstCodes) else len(offsets) - 1
+		end = len(block) if code == last else offsets[code + 1] - len(self.delimiter)
+		return block[offsets[code]:end]
+		
+	def decoder(self):
+		"""Return a function from a code to its value."""
+		return self.value
+		
+	def __iter__(self):
+		"""Generate the values in code order."""
+		return chain.from_iterable(block.split(self.delimiter) for block in self.blocks)
+		
+	def __len__(self):
+		return len(self.offsets)
+		
+		
+class EncodedRows(object):
+	"""A list-like sequence of delimited rows stored as the codes of their column values.
+	
+	Every column has its own InternTable, or PackedColumn once the column is
+	found to rarely repeat, and an array of the code of its value in every
+	row. Appended rows are buffered and encoded a block at a time, a column
+	at a time, which keeps most of the work in map, join and split. Rows are
+	decoded back into the strings they were appended as. A row with fewer
+	columns than others has the code -1 in the columns it lacks.
+	
+	:type colDelimiter: string
+	:param colDelimiter: The delimiter rows are split into columns on
+	
+	:type sampleRows: int
+	:param sampleRows: The number of rows after which columns with few repeats are packed
+	
+	:type maxDistinct: float
+	:param maxDistinct: The fraction of distinct values over sampleRows above which a column is packed
+	
+	:type blockSize: int
+	:param blockSize: The number of rows encoded at a time
+	"""
+	def __init__(self, colDelimiter=',', sampleRows=1024, maxDistinct=0.5, blockSize=4096):
+		super(EncodedRows, self).__init__()
+		self.colDelimiter = colDelimiter
+		self.sampleRows = sampleRows
+		self.maxDistinct = maxDistinct
+		self.blockSize = blockSize
+		self.columns = []
+		self.rowCodes = []
+		self.rows = 0
+		self.ragged = False
+		self.pending = []
+		
+	def append(self, line):
+		self.pending.append(line)
+		if len(self.pending) >= self.blockSize:
+			self.flush()
+			
+	def extend(self, lines):
+		lines = iter(lines)
+		while True:
+			self.pending.extend(islice(lines, self.blockSize - len(self.pending)))
+			if len(self.pending) < self.blockSize:
+				break
+			self.flush()
+			
+	def flush(self):
+		"""Encode the buffered rows."""
+		if self.pending:
+			lines, self.pending = self.pending, []
+			self.encode_block(lines)
+			
+	def encode_block(self, lines):
+		"""Encode a list of rows, a column at a time."""
+		colDelimiter = self.colDelimiter
+		rows = [line.split(colDelimiter) for line in lines]
+		width = max(map(len, rows))
+		if width != min(map(len, rows)) or (self.rows and width != len(self.columns)):
+			self.ragged = True
+			rows = [row + [None] * (width - len(row)) for row in rows]
+		while len(self.columns) < width:
+			self.columns.append(InternTable())
+			self.rowCodes.append(array('i', [-1]) * self.rows)
+		for j, values in enumerate(izip(*rows)):
+			if self.ragged:
+				present = [value for value in values if value is not None]
+				codes = iter(self.columns[j].encode(present))
+				self.rowCodes[j].extend([next(codes) if value is not None else -1 for value in values])
+			else:
+				self.rowCodes[j].extend(self.columns[j].encode(values))
+		for j in xrange(width, len(self.columns)):
+			self.rowCodes[j].extend(array('i', [-1]) * len(rows))
+		before = self.rows
+		self.rows += len(rows)
+		if before < self.sampleRows <= self.rows:
+			self.pack_columns()
+			
+	def pack_columns(self):
+		"""Replace the InternTable of every column that was mostly distinct values by a PackedColumn.
+		
+		The values of the packed column are stored in row order, so the
+		codes of a column without gaps are the row numbers.
+		"""
+		limit = self.maxDistinct * self.rows
+		for j, column in enumerate(self.columns):
+			if isinstance(column, InternTable) and len(column) > limit:
+				rowCodes = self.rowCodes[j]
+				self.columns[j] = PackedColumn(self.colDelimiter, [column.values[code] for code in rowCodes if code >= 0])
+				codes = count()
+				self.rowCodes[j] = array('i', [next(codes) if code >= 0 else -1 for code in rowCodes])
+				
+	def row(self, i):
+		"""Return row i as the string it was appended as."""
+		codes = [rowCodes[i] for rowCodes in self.rowCodes]
+		return self.colDelimiter.join([column.value(code) for column, code in izip(self.columns, codes) if code >= 0])
+		
+	def __getitem__(self, i):
+		self.flush()
+		if isinstance(i, slice):
+			return [self.row(j) for j in xrange(*i.indices(self.rows))]
+		if i < 0:
+			i += self.rows
+		if not 0 <= i < self.rows:
+			raise IndexError("row index out of range")
+		return self.row(i)
+		
+	def __iter__(self):
+		self.flush()
+		if self.ragged:
+			return (self.row(i) for i in xrange(self.rows))
+		columns = [iter(column) if isinstance(column, PackedColumn) else imap(column.decoder(), rowCodes)
+			for column, rowCodes in izip(self.columns, self.rowCodes)]
+		return imap(self.colDelimiter.join, izip(*columns))
+		
+	def __len__(self):
+		return self.rows + len(self.pending)
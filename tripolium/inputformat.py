@@ -7,14 +7,41 @@ Created by Balfanz, Ryan on 2010-09-06.
 Copyright (c) 2010 __MyCompanyName__. All rights reserved.
 """
 
+import cPickle as pickle
+import heapq
+import mmap
+import os
 import sys
+import tempfile
 import cStringIO as StringIO
+from array import array
+from bisect import bisect_right
+from contextlib import closing
+from itertools import groupby
+from operator import itemgetter
+
+from dictionary import EncodedRows, InternTable
+from settings import ROW_DELIMITER, GROUPING_MEMORY, DICTIONARY_ENCODING
+from utils import RowReader
+
+# Leads the header of a persisted line-offset index, telling it from the headerless layout
+INDEX_MAGIC = 0x747269786964781
 
 
 class BaseInputFormat(object):
-	"""docstring for BaseInputFormat"""
-	def __init__(self, inputFile=sys.stdin):
+	"""docstring for BaseInputFormat
+	
+	:type compression: string
+	:param compression: 'auto' to detect, or 'gzip', 'bz2' or 'xz' to decompress inputFile, None for plain input
+	
+	:type background: bool
+	:param background: Decompress on a background thread
+	"""
+	def __init__(self, inputFile=sys.stdin, compression=None, background=False):
 		super(BaseInputFormat, self).__init__()
+		if compression:
+			from compression import open_input
+			inputFile = open_input(inputFile, compression, background=background)
 		self.inputFile = inputFile
 		self.inputLineNum = 0
 		
@@ -34,36 +61,166 @@ class BaseInputFormat(object):
 				
 				
 class NClusterPartitionInputFormat(BaseInputFormat):
-	"""docstring for NClusterRowInputFormat"""
-	def __init__(self, partitionColumnIndex=None, *args, **kwargs):
+	"""Generate (key, rows) pairs for runs of lines sharing a partition key.
+	
+	By default the rows of each partition are streamed lazily from the input
+	file, in the style of itertools.groupby, so memory does not grow with the
+	partition size. A partition's rows must be consumed before advancing to the
+	next partition; any rows left unconsumed are skipped.
+	
+	:type partitionColumnIndex: int
+	:param partitionColumnIndex: The 0-based index of the partition column, the whole line if None
+	
+	:type materialize: bool
+	:param materialize: Yield each partition as a list, for mappers that need random access
+	
+	:type colDelimiter: string
+	:param colDelimiter: The column delimiter used to find the partition column
+	
+	:type presorted: bool
+	:param presorted: Whether rows sharing a partition key are already adjacent
+	
+	:type memoryBudget: int
+	:param memoryBudget: The estimated number of bytes of rows held in memory when sorting
+	
+	:type encode: bool
+	:param encode: Dictionary-encode materialized partitions as EncodedRows and intern the keys of rows held when sorting
+	"""
+	# Estimated bytes per buffered row beyond the line and key themselves
+	ENTRY_OVERHEAD = 100
+	
+	def __init__(self, partitionColumnIndex=None, materialize=False, colDelimiter=',', presorted=True,
+		memoryBudget=GROUPING_MEMORY, encode=DICTIONARY_ENCODING, *args, **kwargs):
 		super(NClusterPartitionInputFormat, self).__init__(*args, **kwargs)
 		self.partitionColumnIndex = partitionColumnIndex
+		self.colDelimiter = colDelimiter
+		self.materialize = materialize
+		self.memoryBudget = memoryBudget
+		self.encode = encode
 		self.partitionKeys = []
 		self.partitions = []
-		self.generate_input = self.generate_input_partition
+		self.runs = []
+		if not presorted:
+			self.generate_input = self.generate_input_grouped
+		elif self.materialize:
+			self.generate_input = self.generate_input_partition
+		else:
+			self.generate_input = self.generate_input_stream
+			
+	def get_partition_key(self, line):
+		"""Return the partition key of a stripped input line."""
+		if self.partitionColumnIndex is None:
+			return line
+		return line.split(self.colDelimiter, self.partitionColumnIndex + 1)[self.partitionColumnIndex]
+		
+	def new_partition(self, rows=()):
+		"""Return the rows of a materialized partition, as EncodedRows when encoding."""
+		if not self.encode:
+			return list(rows)
+		partition = EncodedRows(self.colDelimiter)
+		partition.extend(rows)
+		return partition
+		
+	def generate_input_lines(self, f):
+		"""Generate the lines of f without their row delimiter, tracking the input line number.
 		
+		Only the row delimiter is removed, stripping whitespace would also drop
+		leading and trailing tab-delimited empty columns.
+		"""
+		i = -1
+		for i, line in enumerate(f):
+			self.inputLineNum = i
+			yield line.rstrip(ROW_DELIMITER)
+		self.inputLineNum = i + 1
+		
+	def generate_input_stream(self):
+		"""Generate (key, row iterator) pairs, reading rows lazily."""
+		with closing(self.inputFile) as f:
+			for pKey, rows in groupby(self.generate_input_lines(f), self.get_partition_key):
+				yield (pKey, rows)
+				
 	def generate_input_partition(self):
-		"""docstring for generate_input_row"""
-		from contextlib import closing
+		"""Generate (key, list) pairs, materializing each partition."""
 		with closing(self.inputFile) as f:
 			prevKey = None
 			for i, line in enumerate(f):
 				self.inputLineNum = i
-				line = line.strip()
-				pKey = line.split(',')[self.partitionColumnIndex] if self.partitionColumnIndex is not None else line
+				line = line.rstrip(ROW_DELIMITER)
+				pKey = self.get_partition_key(line)
 				if not self.partitionKeys:
 					self.partitionKeys.append(pKey)
-					self.partitions.append([])
+					self.partitions.append(self.new_partition())
 				elif not pKey == prevKey:
 					p = self.partitions.pop()
-					self.partitions.append([])
+					self.partitions.append(self.new_partition())
 					yield (prevKey, p)
 				else:
 					pass
 				self.partitions[-1].append(line)
 				prevKey = pKey
-			self.inputLineNum += 1
-			yield (pKey, self.partitions.pop())
+			if self.partitions:
+				self.inputLineNum += 1
+				yield (pKey, self.partitions.pop())
+			
+	def spill(self, items):
+		"""Write items to a temporary file as a sorted run."""
+		run = tempfile.TemporaryFile(prefix='tripolium-sort-')
+		dump = pickle.Pickler(run, pickle.HIGHEST_PROTOCOL).dump
+		items.sort()
+		for item in items:
+			dump(item)
+		run.seek(0)
+		self.runs.append(run)
+		
+	def read_run(self, run):
+		"""Generate the (key, line number, line) items of a spilled run."""
+		load = pickle.Unpickler(run).load
+		try:
+			while True:
+				yield load()
+		except EOFError:
+			run.close()
+			
+	def sort_lines(self, lines):
+		"""Generate (key, line number, line) items for lines, sorted by key and line number.
+		
+		Items are buffered until their estimated size exceeds memoryBudget and
+		then spilled as a sorted run, the runs are merged at the end. When
+		encoding, the items of a run share one copy of each key.
+		"""
+		getKey, getsizeof = self.get_partition_key, sys.getsizeof
+		overhead = self.ENTRY_OVERHEAD
+		keys = InternTable() if self.encode else None
+		items = []
+		itemBytes = 0
+		for i, line in enumerate(lines):
+			key = getKey(line)
+			if keys is None or key not in keys:
+				itemBytes += getsizeof(key)
+			if keys is not None:
+				key = keys.intern(key)
+			items.append((key, i, line))
+			itemBytes += getsizeof(line) + overhead
+			if itemBytes > self.memoryBudget:
+				self.spill(items)
+				keys = InternTable() if self.encode else None
+				items = []
+				itemBytes = 0
+		items.sort()
+		if not self.runs:
+			return iter(items)
+		sources = [self.read_run(run) for run in self.runs]
+		sources.append(iter(items))
+		self.runs = []
+		return heapq.merge(*sources)
+		
+	def generate_input_grouped(self):
+		"""Generate (key, rows) pairs from unsorted input, sorting it by partition key first."""
+		getLine = itemgetter(2)
+		with closing(self.inputFile) as f:
+			for pKey, items in groupby(self.sort_lines(self.generate_input_lines(f)), itemgetter(0)):
+				rows = (getLine(item) for item in items)
+				yield (pKey, self.new_partition(rows) if self.materialize else rows)
 			
 			
 class NClusterRowInputFormat(NClusterPartitionInputFormat):
@@ -73,6 +230,169 @@ class NClusterRowInputFormat(NClusterPartitionInputFormat):
 		self.generate_input_row = self.generate_input_partition
 				
 				
+class MmapInputFormat(BaseInputFormat):
+	"""Generate rows from a memory-mapped file.
+	
+	Row boundaries are found by searching the mapping, so the file is never
+	read through a file object. With useIndex, the byte offset of every row is
+	kept in an index persisted next to the file as <fileName>.idx, which makes
+	seeking to a line number and splitting the file for parallel readers O(1).
+	The index starts with a header of the size and modification time of the
+	file it was built from and is rebuilt when either differs. When the index
+	can not be written, as in a read-only directory, it is kept in memory.
+	
+	:type fileName: string
+	:param fileName: The path of the file to map, instead of an open inputFile
+	
+	:type useIndex: bool
+	:param useIndex: Load, or build and persist, the line-offset index
+	"""
+	def __init__(self, fileName=None, useIndex=False, *args, **kwargs):
+		if fileName is not None:
+			kwargs['inputFile'] = open(fileName, 'rb')
+		super(MmapInputFormat, self).__init__(*args, **kwargs)
+		self.fileName = fileName if fileName is not None else getattr(self.inputFile, 'name', None)
+		self.size = os.fstat(self.inputFile.fileno()).st_size
+		# Empty files cannot be mapped
+		self.map = mmap.mmap(self.inputFile.fileno(), 0, access=mmap.ACCESS_READ) if self.size else ''
+		self.offsets = None
+		if useIndex:
+			self.load_index()
+			
+	def get_index_file_name(self):
+		"""Return the path of the persisted line-offset index."""
+		return self.fileName + '.idx'
+	INDEXFILE = property(get_index_file_name)
+	
+	def build_index(self):
+		"""Return an array of the byte offset of every row, followed by the file size."""
+		offsets = array('L')
+		append, find = offsets.append, self.map.find
+		pos = 0
+		while pos < self.size:
+			append(pos)
+			pos = find(ROW_DELIMITER, pos)
+			if pos < 0:
+				break
+			pos += 1
+		append(self.size)
+		return offsets
+		
+	def index_header(self):
+		"""Return the header that identifies the current contents of the file in its index."""
+		stat = os.fstat(self.inputFile.fileno())
+		return array('L', [INDEX_MAGIC, stat.st_size, int(stat.st_mtime * 1000000)])
+		
+	def load_index(self):
+		"""Load the persisted index, building and saving it when missing or stale."""
+		header = self.index_header()
+		offsets = array('L')
+		try:
+			with open(self.INDEXFILE, 'rb') as f:
+				offsets.fromstring(f.read())
+		except (IOError, ValueError):
+			offsets = None
+		if not offsets or offsets[:len(header)] != header or offsets[-1] != self.size:
+			offsets = self.build_index()
+			self.save_index(header, offsets)
+		else:
+			offsets = offsets[len(header):]
+		self.offsets = offsets
+		
+	def save_index(self, header, offsets):
+		"""Atomically write the header and offsets to the index file, leaving the index in memory on failure."""
+		tmpName = self.INDEXFILE + '.tmp'
+		try:
+			with open(tmpName, 'wb') as f:
+				header.tofile(f)
+				offsets.tofile(f)
+			os.rename(tmpName, self.INDEXFILE)
+		except (IOError, OSError), e:
+			sys.stderr.write("could not save the line index %s, keeping it in memory: %s\n" % (self.INDEXFILE, e))
+			try:
+				os.remove(tmpName)
+			except OSError:
+				pass
+		
+	def get_line_count(self):
+		"""Return the number of rows in the file, building the index if needed."""
+		if self.offsets is None:
+			self.offsets = self.build_index()
+		return len(self.offsets) - 1
+	LINECOUNT = property(get_line_count)
+	
+	def line_offset(self, lineNum):
+		"""Return the byte offset of the 0-based line lineNum."""
+		if self.offsets is not None:
+			return self.offsets[min(lineNum, len(self.offsets) - 1)]
+		pos, find = 0, self.map.find
+		for i in xrange(lineNum):
+			pos = find(ROW_DELIMITER, pos)
+			if pos < 0:
+				return self.size
+			pos += 1
+		return pos
+		
+	def line_number(self, offset):
+		"""Return the 0-based number of the first line starting at or after offset."""
+		if self.offsets is None:
+			self.offsets = self.build_index()
+		pos = self.align(offset)
+		return bisect_right(self.offsets, pos - 1) if pos else 0
+		
+	def align(self, offset):
+		"""Return the offset of the first row starting at or after offset."""
+		if offset <= 0:
+			return 0
+		if offset >= self.size:
+			return self.size
+		pos = self.map.find(ROW_DELIMITER, offset - 1)
+		return self.size if pos < 0 else pos + 1
+		
+	def split(self, n):
+		"""Split the file into n (start, end) byte ranges that begin at row boundaries."""
+		bounds = [self.align(self.size * i // n) for i in xrange(n)] + [self.size]
+		return [(bounds[i], bounds[i + 1]) for i in xrange(n) if bounds[i] < bounds[i + 1]]
+		
+	def read_rows(self, startLine=0):
+		"""Return a RowReader of the rows from the 0-based line startLine, split from the mapping a block at a time."""
+		if not self.size:
+			return iter([])
+		self.map.seek(self.line_offset(startLine))
+		return RowReader(self.map)
+		
+	def generate_input(self, startLine=0, start=None, end=None):
+		"""Generate rows, without their row delimiter.
+		
+		Either start at the 0-based line startLine or read the rows that begin
+		in the byte range [start, end).
+		"""
+		if start is None:
+			pos = self.line_offset(startLine)
+			lineNum = startLine
+		else:
+			pos = self.align(start)
+			lineNum = self.line_number(pos) if self.offsets is not None else None
+		end = self.size if end is None else min(end, self.size)
+		m, find = self.map, self.map.find
+		while pos < end:
+			nxt = find(ROW_DELIMITER, pos)
+			if nxt < 0:
+				nxt = self.size
+			self.inputLineNum = lineNum
+			yield m[pos:nxt]
+			if lineNum is not None:
+				lineNum += 1
+			pos = nxt + 1
+		self.inputLineNum = lineNum
+		
+	def close(self):
+		"""Unmap and close the file."""
+		if self.size:
+			self.map.close()
+		self.inputFile.close()
+		
+		
 if __name__ == '__main__':
 	inputString = """
 	1,1,1,1,1,1
@@ -87,5 +407,5 @@ if __name__ == '__main__':
 	inp = BaseInputFormat()
 	inp = NClusterRowInputFormat(inputFile=inpFile)
 	inp = NClusterPartitionInputFormat(inputFile=inpFile, partitionColumnIndex=5)
-	for line in inp.generate_input():
-		print "PRINT LINE: ", line, inp.LINENUM
+	for key, rows in inp.generate_input():
+		print "PRINT LINE: ", (key, list(rows)), inp.LINENUM
@@ -1,3 +1,9 @@
+import math
+import sys
+from itertools import izip
+
+from decoder import SchemaDecoder
+from registry import resolve_schema
 from settings import COL_DELIMITER, ROW_DELIMITER
 
 
@@ -13,6 +19,16 @@ class BaseMapper(object):
 	:rtype: none
 	:return: Using this mapper directly will caise an Exception to be thrown
 	"""
+	# True when the driver may call skip_ahead to drop rows the mapper would ignore
+	skipAhead = False
+	# True when the output for a row depends on nothing but that row
+	stateless = False
+	# True when values may be tuples of typed fields rather than strings
+	acceptsFields = False
+	# Attributes holding the state a stateful mapper carries between rows, saved by
+	# checkpoints; None when unknown, which keeps the mapper from being checkpointed
+	checkpointFields = None
+	
 	def __init__(self, colDelimiter=None, rowDelimiter=None, schema=None, *args, **kwargs):
 		self.colDelimiter = colDelimiter if colDelimiter else COL_DELIMITER
 		self.rowDelimiter = rowDelimiter if rowDelimiter else ROW_DELIMITER
@@ -20,38 +36,68 @@ class BaseMapper(object):
 		# 	import schema as ss
 		# 	self.meta = getattr(ss, 'DEBUG_SCHEMA')
 		if schema:
-			import schema as s
-			self.meta = getattr(s, schema)
+			self.meta = resolve_schema(schema)
 		else:
 			self.meta = None
 		# self.meta = kwargs if kwargs else None
 		# logger.debug("Meta: %s" % (str(self.meta),))
-		self.columns = {} if self.meta else None
+		self.decoder = SchemaDecoder(self.meta, self.colDelimiter) if self.meta else None
+		self.columns = None
 		
 	def __call__(self,key,value):
 		# if DEBUG: return
 		raise NotImplementedError("%s must implement its __call__ method." % (self.__class__.__name__,))
 		
 	def process_raw_columns(self, raw=None):
-		"""Process raw columns data into a dictionary
+		"""Process raw columns data into a record
 		
-		:rtype: dict
-		:return: A dictionary mapping string column names to their typed values
+		:rtype: Record
+		:return: A tuple-backed record mapping column names to their typed values
 		"""
-		assert self.meta
-		fields = raw.split(COL_DELIMITER)
-		# logger.debug("Fields: %s" % (str(map(str, fields))),)
+		assert self.decoder
+		try:
+			self.columns = self.decoder(raw)
+		except Exception, e:
+			raise Exception(e)
+		return self.columns
 		
-		for k, v in self.meta.iteritems():
-			# logger.debug("k: v; %s: %s" % (k, v,))
-			colData = fields[v["index"]-1]
-			colType = v["type"]
-			# logger.debug("k, colData, colType: %s, %s, %s" % (k, colData, colType))
-			try:
-				self.columns[k] = map(colType, (colData,))[0]
-				# logger.debug("Processed field '%s' into %s: %s" % (k, type(self.columns[k]), self.columns[k]))
-			except Exception, e:
-				raise Exception(e)
+	def map_batch(self, keys, values):
+		"""Map a block of input rows at once.
+		
+		The default implementation falls back to calling the mapper once per row;
+		stateless mappers should override it with a bulk operation.
+		
+		:type keys: list
+		:param keys: The 0-based indices of the input rows
+		
+		:type values: list
+		:param values: The string representations of the input rows
+		
+		:rtype: list
+		:return: A list of 2-tuple key, value pairs
+		"""
+		pairs = []
+		extend = pairs.extend
+		for key, value in izip(keys, values):
+			extend(self(key, value))
+		return pairs
+		
+	def get_state(self):
+		"""Return a picklable snapshot of the state carried between rows, see checkpoint.py."""
+		return dict((name, getattr(self, name)) for name in self.checkpointFields if hasattr(self, name))
+		
+	def set_state(self, state):
+		"""Restore a snapshot returned by get_state."""
+		for name, value in state.iteritems():
+			setattr(self, name, value)
+			
+	def finish(self):
+		"""Called once after the last input row.
+		
+		:rtype: list
+		:return: A list of 2-tuple key, value pairs to emit at the end of the input
+		"""
+		return []
 
 
 class IdentityMapper(BaseMapper):
@@ -66,34 +112,39 @@ class IdentityMapper(BaseMapper):
 	:rtype: tuple
 	:return: A 2-tuple containing a key, value equal to the input key, value pair
 	"""
+	stateless = True
+
 	def __call__(self, key, value):
 		yield key, value
+		
+	def map_batch(self, keys, values):
+		return zip(keys, values)
 
 
-# class GroupConcatMapper(mappers.BaseMapper):
-# 	"""Concatenate values from a group into a single string result.
-# 	
-# 	:type key: int
-# 	:param key: The 0-based index of the input row
-# 	
-# 	:type value: string
-# 	:param key: The string representation of the input row
-# 	
-# 	:rtype: tuple
-# 	:return: 
-# 	"""
-# 	def __init__(self, timeout=60, *args, **kwargs):
-# 		super(GroupConcatMapper, self).__init__(*args, **kwargs)
-# 		self.separator = ','
-# 		self.elements = []
-# 		
-# 	def __call__(self, key, value):
-# 		yield key, value
-# 		partitionRowNum, row = key, value
-# 		group, order, value= row.split(COL_DELIMITER)
-# 		
-# 		u, v = str(group), self.separator.join(map(str, [order, value]))
-# 		# yield u, v
+class GroupConcatMapper(BaseMapper):
+	"""Key group, order, value rows by group for concatenation by a GroupConcatReducer.
+
+	:type key: int
+	:param key: The 0-based index of the input row
+
+	:type value: string
+	:param key: The string representation of the input row
+
+	:rtype: tuple
+	:return: A 2-tuple containing the group and the order and value joined by a comma
+	"""
+	stateless = True
+
+	def __init__(self, *args, **kwargs):
+		super(GroupConcatMapper, self).__init__(*args, **kwargs)
+		self.separator = ','
+
+	def __call__(self, key, value):
+		partitionRowNum, row = key, value
+		group, order, value = row.split(COL_DELIMITER)
+
+		u, v = str(group), self.separator.join(map(str, [order, value]))
+		yield u, v
 
 
 class ReverseMapper(BaseMapper):
@@ -108,14 +159,25 @@ class ReverseMapper(BaseMapper):
 	:rtype: tuple
 	:return: A 2-tuple containing a key, value pair where value is the reversed version of the input value
 	"""
+	stateless = True
+
 	def __call__(self, key, value):
 		u, v = key, value[::-1]
 		yield u, v
+		
+	def map_batch(self, keys, values):
+		return zip(keys, [v[::-1] for v in values])
 
 
 class SampleMapper(BaseMapper):
 	"""Sample input rows.
 
+	In the default 'bernoulli' mode a random number is drawn for every row. In
+	'skip' mode the number of rows to skip before the next hit is drawn from a
+	geometric distribution, so the driver can drop skipped rows without calling
+	the mapper. Given k, a fixed-size reservoir sample of k rows is emitted at
+	the end of the input instead.
+
 	:type key: int
 	:param key: The 0-based index of the input row
 
@@ -123,25 +185,130 @@ class SampleMapper(BaseMapper):
 	:param key: The string representation of the input row
 
 	:rtype: tuple
-	:return: A 2-tuple containing a key, value pair where value is the original uppercase version of the input value
+	:return: A 2-tuple containing a key, value pair equal to the input key, value pair for sampled rows
 
 	:SQL/MR parameters:
 		:type sampleProb: float
-		:param partitionColumnIndex: The sampling probability
+		:param sampleProb: The sampling probability
 		:default: 1.0
+
+		:type mode: string
+		:param mode: Either 'bernoulli' or 'skip'
+		:default: 'bernoulli'
+
+		:type k: int
+		:param k: The reservoir size, enables reservoir sampling
+		:default: None
+
+		:type seed: int
+		:param seed: The random number generator seed
+		:default: None
 	"""
-	def __init__(self, sampleProb=None, *args, **kwargs):
+	checkpointFields = ('random', 'rowsSeen', 'rowsSampled', 'pendingSkip', 'reservoir', 'reservoirWeight')
+
+	def __init__(self, sampleProb=None, mode=None, k=None, seed=None, *args, **kwargs):
 		super(SampleMapper, self).__init__(*args, **kwargs)
 		if not sampleProb:
 			sampleProb = 1.0
-			logger.debug("%s was not given a sampling probability, using %f" % (self.__class__.__name__, sampleProb,))
+			# logger.debug("%s was not given a sampling probability, using %f" % (self.__class__.__name__, sampleProb,))
 		self.sampleProb = float(sampleProb)
-		logger.debug("%s.sampleProb is %f" % (self.__class__.__name__, self.sampleProb,))
+		# logger.debug("%s.sampleProb is %f" % (self.__class__.__name__, self.sampleProb,))
+		self.mode = mode if mode else 'bernoulli'
+		if self.mode not in ('bernoulli', 'skip'):
+			raise ValueError("%s does not support mode '%s'" % (self.__class__.__name__, self.mode))
+		self.k = int(k) if k else None
+		if seed is not None and str(seed).isdigit():
+			seed = int(seed)
+		# random and sessions are imported by the mappers that use them, keeping startup light
+		import random
+		self.random = random.Random(seed)
+		self.rowsSeen = 0
+		self.rowsSampled = 0
+		self.pendingSkip = 0
+		if self.k:
+			self.reservoir = []
+			self.reservoirWeight = 1.0
+			self.skipAhead = True
+		else:
+			self.skipAhead = self.mode == 'skip'
+			if self.skipAhead:
+				self.pendingSkip = self.draw_skip(self.sampleProb)
+
+	def draw_skip(self, p):
+		"""Draw the number of rows to skip before the next hit at probability p."""
+		if p >= 1.0:
+			return 0
+		if p <= 0.0:
+			return sys.maxint
+		# log1p keeps tiny probabilities, for which 1.0 - p rounds to 1.0 and log(1.0 - p) to 0.0
+		skip = math.log1p(-self.random.random()) / math.log1p(-p)
+		return int(skip) if skip < sys.maxint else sys.maxint
+
+	def skip_ahead(self):
+		"""Return the number of upcoming rows the mapper would ignore.
+
+		The driver drops up to that many rows, reports how many it dropped with
+		skipped, then calls the mapper with the next row as usual.
+		"""
+		n, self.pendingSkip = self.pendingSkip, 0
+		return n
 
+	def skipped(self, n):
+		"""Record that the driver dropped n rows."""
+		self.rowsSeen += n
 
 	def __call__(self, key, value):
-		if random.random() <= self.sampleProb:
-			yield key, value
+		self.rowsSeen += 1
+		if self.k:
+			return self.sample_reservoir(key, value)
+		if self.mode == 'skip':
+			if self.pendingSkip:
+				self.pendingSkip -= 1
+				return ()
+			self.pendingSkip = self.draw_skip(self.sampleProb)
+			self.rowsSampled += 1
+			return ((key, value),)
+		if self.random.random() <= self.sampleProb:
+			self.rowsSampled += 1
+			return ((key, value),)
+		return ()
+
+	def map_batch(self, keys, values):
+		if self.k or self.mode == 'skip':
+			return super(SampleMapper, self).map_batch(keys, values)
+		rnd, p = self.random.random, self.sampleProb
+		pairs = [(k, v) for k, v in izip(keys, values) if rnd() <= p]
+		self.rowsSeen += len(keys)
+		self.rowsSampled += len(pairs)
+		return pairs
+
+	def sample_reservoir(self, key, value):
+		"""Maintain a reservoir of k rows using skip-based Algorithm L."""
+		reservoir, k = self.reservoir, self.k
+		if len(reservoir) < k:
+			reservoir.append((key, value))
+			if len(reservoir) == k:
+				self.next_reservoir_skip()
+		elif self.pendingSkip:
+			self.pendingSkip -= 1
+		else:
+			reservoir[self.random.randrange(k)] = (key, value)
+			self.next_reservoir_skip()
+		return ()
+
+	def next_reservoir_skip(self):
+		"""Update the reservoir weight and draw the rows to skip before the next replacement."""
+		self.reservoirWeight *= math.exp(math.log1p(-self.random.random()) / self.k)
+		self.pendingSkip = self.draw_skip(self.reservoirWeight)
+
+	def finish(self):
+		pairs = []
+		if self.k:
+			pairs = sorted(self.reservoir)
+			self.rowsSampled = len(pairs)
+		sys.stderr.write("%s: sampled %d of %d rows (%s)\n" % (self.__class__.__name__, self.rowsSampled, self.rowsSeen,
+			"k=%d" % (self.k,) if self.k else "mode=%s, sampleProb=%g" % (self.mode, self.sampleProb)))
+		return pairs
 
 
 class SchemaMapper(BaseMapper):
@@ -156,9 +323,16 @@ class SchemaMapper(BaseMapper):
 	:rtype: tuple
 	:return: A 2-tuple containing a key, value equal to the input key, value pair
 	"""
+	stateless = True
+	acceptsFields = True
+
 	def __call__(self, key, value):
 		self.process_raw_columns(value)
-		yield key, str(self.columns)
+		yield key, self.columns
+		
+	def map_batch(self, keys, values):
+		assert self.decoder
+		return zip(keys, map(self.decoder, values))
 
 
 class SessionMapper(BaseMapper):
@@ -178,33 +352,59 @@ class SessionMapper(BaseMapper):
 		:type fmt: string
 		:param fmt: The format specifier of the datetime column
 		:default: '%Y-%m-%d %H:%M:%S'
+
+		:type maxUsers: int
+		:param maxUsers: The maximum number of users to keep session state for
+		:default: 1000000
+
+		:type cacheSize: int
+		:param cacheSize: The number of parsed timestamps to keep in an LRU cache, 0 for none
+		:default: 0 for the default fmt, whose parser is cheaper than a cache miss, 65536 otherwise
+
+		:type encode: int
+		:param encode: 1 to keep session state in arrays indexed by dictionary codes of the users
+		:default: 0
 	"""
-	def __init__(self, timeout=60, fmt=None, *args, **kwargs):
+	checkpointFields = ('sessionizer',)
+
+	def __init__(self, timeout=60, fmt=None, maxUsers=1000000, cacheSize=None, encode=0, *args, **kwargs):
 		super(SessionMapper, self).__init__(*args, **kwargs)
-		self.sessionTimeoutSeconds = timedelta(seconds=int(timeout))
-		self.dateTimeFormat = fmt if fmt else "%Y-%m-%d %H:%M:%S"
-		self.currentSession = {}
+		from datetime import datetime
+		from sessions import EncodedSessionizer, Sessionizer, TimestampParser, format_seconds
+		self.strptime = datetime.strptime
+		self.sessionTimeoutSeconds = int(timeout)
+		self.parseTimestamp = TimestampParser(fmt)
+		self.dateTimeFormat = self.parseTimestamp.fmt
+		sessionizer = EncodedSessionizer if int(encode) else Sessionizer
+		self.sessionizer = sessionizer(self.sessionTimeoutSeconds, int(maxUsers))
+		self.currentSession = self.sessionizer.sessions
+		self.formatSeconds = format_seconds
+		self.convertTimestamp = self.convert_timestamp
+		if cacheSize is None:
+			cacheSize = 0 if self.parseTimestamp.fast else 65536
+		if int(cacheSize):
+			from memo import LRUCache
+			self.convertTimestamp = LRUCache(self.convert_timestamp, int(cacheSize), 'SessionMapper.timestamp')
+
+	def convert_timestamp(self, timeString):
+		"""Return the epoch seconds of timeString and timeString rendered as str(datetime) would."""
+		epoch = self.parseTimestamp(timeString)
+		if not self.parseTimestamp.is_canonical(timeString):
+			timeString = str(self.strptime(timeString, self.dateTimeFormat))
+		return epoch, timeString
 
 	def __call__(self, key, value):
 		partitionRowNum, row = key, value
 
 		userId, timeString = row.split(COL_DELIMITER)
-		timeString = datetime.strptime(timeString, self.dateTimeFormat)
-
-		if not self.currentSession:
-			self.currentSession["number"] = 0
-			self.currentSession["start"] = timeString
-			self.currentSession["length"] = timedelta(0.0)
-
-		dt = timeString - self.currentSession["start"]
-		if dt > self.sessionTimeoutSeconds:
-			self.currentSession["number"] += 1
-			self.currentSession["start"] = timeString
-			self.currentSession["length"] = timedelta(0.0)
-		else:
-			self.currentSession["length"] = dt
+		epoch, timeString = self.convertTimestamp(timeString)
+		number, length = self.sessionizer(userId, epoch)
 
-		yield str(userId), str(timeString) + "___" + str(self.currentSession["number"]) + "___" + str(self.currentSession["length"])
+		yield str(userId), timeString + "___" + str(number) + "___" + self.formatSeconds(length)
+
+	def set_state(self, state):
+		super(SessionMapper, self).set_state(state)
+		self.currentSession = self.sessionizer.sessions
 
 
 class ZenoSampleMapper(SampleMapper):
@@ -219,18 +419,29 @@ class ZenoSampleMapper(SampleMapper):
 	:rtype: unknown
 	:return: A 2-tuple key, value pair when appropriate
 	"""
-	# def __init__(self, sampleProb=None, *args, **kwargs):
-	# 	super(ZenoSampleMapper, self).__init__(*args, **kwargs)
-	# 	if not sampleProb:
-	# 		sampleProb = 1.0
-	# 		logger.debug("%s was not given a sampling probability, using %f" % (self.__class__.__name__, sampleProb,))
-	# 	self.sampleProb = sampleProb
-	# 	logger.debug("%s.sampleProb is %f" % (self.__class__.__name__, self.sampleProb,))
-	# 	
+	checkpointFields = SampleMapper.checkpointFields + ('sampleProb',)
+
+	def __init__(self, *args, **kwargs):
+		super(ZenoSampleMapper, self).__init__(*args, **kwargs)
+		if self.k:
+			raise ValueError("%s does not support reservoir sampling" % (self.__class__.__name__,))
+
 	def __call__(self, key, value):
-		if random.random() <= self.sampleProb:
-			self.sampleProb = 0.5 * self.sampleProb
-			yield key, value + '___' + str(2.0 * self.sampleProb)
+		self.rowsSeen += 1
+		if self.mode == 'skip':
+			if self.pendingSkip:
+				self.pendingSkip -= 1
+				return ()
+		elif self.random.random() > self.sampleProb:
+			return ()
+		self.rowsSampled += 1
+		self.sampleProb = 0.5 * self.sampleProb
+		if self.mode == 'skip':
+			self.pendingSkip = self.draw_skip(self.sampleProb)
+		return ((key, value + '___' + str(2.0 * self.sampleProb)),)
+
+	def map_batch(self, keys, values):
+		return BaseMapper.map_batch(self, keys, values)
 
 
 class PartitionMapper(BaseMapper):
@@ -239,12 +450,17 @@ class PartitionMapper(BaseMapper):
 	Note that nCluster initializes a new instance for each partition.
 	The mechanism is more than likely just separate invocations of the script.
 	"""
+	checkpointFields = ()
+
 	def __init__(self, timeout=60, *args, **kwargs):
 		super(PartitionMapper, self).__init__(*args, **kwargs)
 
 	def __call__(self, key, value):
 		partitionRowNum, row = key, value
 		yield partitionRowNum, row
+		
+	def map_batch(self, keys, values):
+		return zip(keys, values)
 
 
 class UpperMapper(BaseMapper):
@@ -259,7 +475,349 @@ class UpperMapper(BaseMapper):
 	:rtype: tuple
 	:return: A 2-tuple containing a key, value pair where value is the original uppercase version of the input value
 	"""
+	stateless = True
+
 	def __call__(self, key, value):
 		u, v = key, value.upper()
 		yield u, v
+		
+	def map_batch(self, keys, values):
+		return zip(keys, map(str.upper, values))
+
 
+
+class SketchMapper(BaseMapper):
+	"""Summarise the rows of each partition key in a sketch.
+
+	Output is O(partitions) rather than O(rows). A key's sketch is emitted
+	when the next key starts and the last one by finish, so input that is
+	not grouped by key emits several sketches for a key, which are combined
+	like the sketches of different partitions, with a SketchMergeMapper or a
+	SketchReducer.
+
+	:rtype: tuple
+	:return: A 2-tuple of the partition key and the serialized sketch
+
+	:SQL/MR parameters:
+		:type column: int
+		:param column: The 0-based index of the column to sketch
+		:default: the whole row
+
+		:type partitionColumn: int
+		:param partitionColumn: The 0-based index of the column whose value keys the output
+		:default: '*' for every partition
+	"""
+	checkpointFields = ('partitionKey', 'sketch')
+
+	def __init__(self, column=None, partitionColumn=None, *args, **kwargs):
+		super(SketchMapper, self).__init__(*args, **kwargs)
+		self.column = int(column) if column is not None else None
+		self.partitionColumn = int(partitionColumn) if partitionColumn is not None else None
+		self.partitionKey = '*' if self.partitionColumn is None else None
+		self.sketch = None
+
+	def __call__(self, key, value):
+		return self.map_batch([key], [value])
+
+	def new_sketch(self):
+		"""Return an empty sketch."""
+		raise NotImplementedError("%s must implement its new_sketch method." % (self.__class__.__name__,))
+
+	def column_values(self, values):
+		"""Return the sketched column of each row in values."""
+		column = self.column
+		if column is None:
+			return values
+		colDelimiter = self.colDelimiter
+		return [value.split(colDelimiter, column + 1)[column] for value in values]
+
+	def map_batch(self, keys, values):
+		if self.partitionColumn is None:
+			self.add_rows(values)
+			return []
+		colDelimiter, partitionColumn = self.colDelimiter, self.partitionColumn
+		partitionKeys = [value.split(colDelimiter, partitionColumn + 1)[partitionColumn] for value in values]
+		pairs = []
+		start = 0
+		for i, partitionKey in enumerate(partitionKeys):
+			if partitionKey != self.partitionKey:
+				self.add_rows(values[start:i])
+				start = i
+				if self.partitionKey is not None:
+					pairs.append((self.partitionKey, self.sketch.dumps()))
+				self.partitionKey, self.sketch = partitionKey, self.new_sketch()
+		self.add_rows(values[start:])
+		return pairs
+
+	def add_rows(self, values):
+		"""Add a block of rows of the current partition key to its sketch."""
+		if values:
+			self.add_values(self.column_values(values))
+
+	def add_values(self, values):
+		"""Add a block of column values to the sketch."""
+		raise NotImplementedError("%s must implement its add_values method." % (self.__class__.__name__,))
+
+	def finish(self):
+		if self.partitionKey is None:
+			return []
+		return [(self.partitionKey, self.sketch.dumps())]
+
+
+class HyperLogLogMapper(SketchMapper):
+	"""Count the distinct values of a column with a HyperLogLog sketch.
+
+	:SQL/MR parameters:
+		:type precision: int
+		:param precision: The number of register index bits, the sketch takes 2 ** precision bytes
+		:default: 14
+	"""
+	def __init__(self, precision=14, *args, **kwargs):
+		super(HyperLogLogMapper, self).__init__(*args, **kwargs)
+		self.precision = int(precision)
+		self.sketch = self.new_sketch()
+
+	def new_sketch(self):
+		from sketches import HyperLogLog
+		return HyperLogLog(self.precision)
+
+	def add_values(self, values):
+		self.sketch.update(values)
+
+
+class CountMinMapper(SketchMapper):
+	"""Count the values of a column with a Count-Min sketch, keeping the heaviest values.
+
+	:SQL/MR parameters:
+		:type width: int
+		:param width: The number of counters per row of the sketch
+		:default: 2048
+
+		:type depth: int
+		:param depth: The number of rows of the sketch
+		:default: 4
+
+		:type top: int
+		:param top: The number of heavy hitters to keep
+		:default: 100
+
+		:type weightColumn: int
+		:param weightColumn: The 0-based index of a numeric column to sum instead of counting rows
+		:default: None
+	"""
+	def __init__(self, width=2048, depth=4, top=100, weightColumn=None, *args, **kwargs):
+		super(CountMinMapper, self).__init__(*args, **kwargs)
+		self.width, self.depth, self.top = int(width), int(depth), int(top)
+		self.sketch = self.new_sketch()
+		self.weightColumn = int(weightColumn) if weightColumn is not None else None
+
+	def new_sketch(self):
+		from sketches import CountMinSketch
+		return CountMinSketch(self.width, self.depth, self.top)
+
+	def add_rows(self, values):
+		if self.weightColumn is None:
+			return super(CountMinMapper, self).add_rows(values)
+		colDelimiter, weightColumn = self.colDelimiter, self.weightColumn
+		weights = [float(value.split(colDelimiter)[weightColumn]) for value in values]
+		add = self.sketch.add
+		for item, weight in izip(self.column_values(values), weights):
+			add(item, weight)
+
+	def add_values(self, values):
+		add = self.sketch.add
+		for item in values:
+			add(item)
+
+
+class QuantileMapper(SketchMapper):
+	"""Estimate the quantiles of a numeric column with a t-digest.
+
+	Values that are not numbers are counted in skippedRows and left out.
+
+	:SQL/MR parameters:
+		:type compression: int
+		:param compression: Bounds the number of centroids, larger is more accurate
+		:default: 100
+	"""
+	checkpointFields = SketchMapper.checkpointFields + ('skippedRows',)
+
+	def __init__(self, compression=100, *args, **kwargs):
+		super(QuantileMapper, self).__init__(*args, **kwargs)
+		self.compression = int(compression)
+		self.sketch = self.new_sketch()
+		self.skippedRows = 0
+
+	def new_sketch(self):
+		from sketches import TDigest
+		return TDigest(self.compression)
+
+	def add_values(self, values):
+		add = self.sketch.add
+		for value in values:
+			try:
+				add(float(value))
+			except ValueError:
+				self.skippedRows += 1
+
+
+class SketchMergeMapper(BaseMapper):
+	"""Merge serialized sketches, as emitted by the sketch mappers, by key.
+
+	:rtype: tuple
+	:return: A 2-tuple of the key and the merged sketch, or its summary
+
+	:SQL/MR parameters:
+		:type byKey: bool
+		:param byKey: Merge the sketches of each key separately, rather than all into '*'
+		:default: 1
+
+		:type summary: bool
+		:param summary: Emit the estimate, heavy hitters or quantiles rather than the sketch
+		:default: 0
+	"""
+	checkpointFields = ('merged',)
+
+	def __init__(self, byKey=1, summary=0, *args, **kwargs):
+		super(SketchMergeMapper, self).__init__(*args, **kwargs)
+		from sketches import loads
+		self.loads = loads
+		self.byKey = int(byKey)
+		self.summary = int(summary)
+		self.merged = {}
+
+	def __call__(self, key, value):
+		key, sketch = value.rsplit(self.colDelimiter, 1)
+		key = key if self.byKey else '*'
+		sketch = self.loads(sketch)
+		if key in self.merged:
+			self.merged[key].merge(sketch)
+		else:
+			self.merged[key] = sketch
+		return []
+
+	def finish(self):
+		if self.summary:
+			return [(key, sketch.summary()) for key, sketch in sorted(self.merged.iteritems())]
+		return [(key, sketch.dumps()) for key, sketch in sorted(self.merged.iteritems())]
+
+
+class ReverseOrder(object):
+	"""Wrap a value so that it sorts in reverse, for heaps that keep the smallest values."""
+	__slots__ = ('value',)
+
+	def __init__(self, value):
+		self.value = value
+
+	def __lt__(self, other):
+		return other.value < self.value
+
+	def __eq__(self, other):
+		return self.value == other.value
+
+	def __ne__(self, other):
+		return self.value != other.value
+
+	def __getstate__(self):
+		return self.value
+
+	def __setstate__(self, value):
+		self.value = value
+
+
+class TopNMapper(BaseMapper):
+	"""Keep the top n rows of each partition key, ordered by a typed column of the schema.
+
+	A heap of at most n rows is kept per partition key, so memory and output
+	are O(n) per partition rather than O(partition size). When the input is
+	grouped by partition key, as nCluster delivers a partition, the rows of a
+	key are emitted as soon as the next key starts; otherwise every key's rows
+	are emitted at the end of the input. Ties go to the row seen first.
+
+	:rtype: tuple
+	:return: A 2-tuple of the partition key and the row, best rows first
+
+	:SQL/MR parameters:
+		:type n: int
+		:param n: The number of rows to keep per partition key
+		:default: 10
+
+		:type orderBy: string
+		:param orderBy: The schema column whose typed value orders the rows
+
+		:type direction: string
+		:param direction: 'desc' to keep the largest values, 'asc' the smallest
+		:default: 'desc'
+
+		:type partitionBy: string
+		:param partitionBy: The schema column whose value keys the partitions
+		:default: '*' for every row
+
+		:type grouped: bool
+		:param grouped: Whether the rows of a partition key arrive together
+		:default: 1
+	"""
+	checkpointFields = ('heaps', 'currentKey', 'sequence')
+
+	def __init__(self, n=10, orderBy=None, direction='desc', partitionBy=None, grouped=1, *args, **kwargs):
+		super(TopNMapper, self).__init__(*args, **kwargs)
+		if self.decoder is None:
+			raise ValueError("%s needs a schema to order rows by" % (self.__class__.__name__,))
+		names = self.decoder.names
+		for column in (orderBy, partitionBy):
+			if column is not None and column not in names:
+				raise ValueError("%s is not a column of the schema, expected one of %s" % (column, ', '.join(names)))
+		if orderBy is None:
+			raise ValueError("%s needs an orderBy column" % (self.__class__.__name__,))
+		if direction not in ('asc', 'desc'):
+			raise ValueError("%s does not support direction '%s'" % (self.__class__.__name__, direction))
+		import heapq
+		self.heappush, self.heapreplace = heapq.heappush, heapq.heapreplace
+		self.n = int(n)
+		self.orderIndex = names.index(orderBy)
+		self.partitionIndex = names.index(partitionBy) if partitionBy is not None else None
+		self.ascending = direction == 'asc'
+		self.grouped = int(grouped)
+		self.heaps = {}
+		self.currentKey = None
+		# Counts down, so of two rows with equal values the earlier one ranks higher
+		self.sequence = 0
+
+	def __call__(self, key, value):
+		return self.map_batch([key], [value])
+
+	def emit(self, partitionKey):
+		"""Return the rows kept for partitionKey as pairs, best first, and forget them."""
+		heap = self.heaps.pop(partitionKey)
+		heap.sort(reverse=True)
+		return [(partitionKey, entry[2]) for entry in heap]
+
+	def map_batch(self, keys, values):
+		pairs = []
+		heaps, n = self.heaps, self.n
+		heappush, heapreplace = self.heappush, self.heapreplace
+		orderIndex, partitionIndex, ascending = self.orderIndex, self.partitionIndex, self.ascending
+		currentKey, sequence = self.currentKey, self.sequence
+		heap = heaps.get(currentKey)
+		for value, record in izip(values, map(self.decoder, values)):
+			partitionKey = record[partitionIndex] if partitionIndex is not None else '*'
+			if partitionKey != currentKey or heap is None:
+				if self.grouped and currentKey in heaps:
+					pairs.extend(self.emit(currentKey))
+				currentKey = partitionKey
+				heap = heaps.setdefault(partitionKey, [])
+			orderValue = record[orderIndex]
+			sequence -= 1
+			entry = (ReverseOrder(orderValue) if ascending else orderValue, sequence, value)
+			if len(heap) < n:
+				heappush(heap, entry)
+			elif heap[0] < entry:
+				heapreplace(heap, entry)
+		self.currentKey, self.sequence = currentKey, sequence
+		return pairs
+
+	def finish(self):
+		pairs = []
+		for partitionKey in sorted(self.heaps):
+			pairs.extend(self.emit(partitionKey))
+		return pairs
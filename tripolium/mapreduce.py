@@ -11,22 +11,25 @@ A Python module for creating SQL/MR functions to be used with Aster Data's nClus
 
 # import logging
 # import logging.handlers
-import random
 import sys
-try:
-	import cStringIO as StringIO
-except ImportError:
-	import StringIO
-from datetime import datetime
-from datetime import timedelta
+import time
+from itertools import islice
 
 # Tripolium modules
 # from mapreduce import mappers
 # from mapreduce.settings import COL_DELIMITER, ROW_DELIMITER
 # from settings import DEBUG
-from mappers import IdentityMapper
-from settings import COL_DELIMITER, ROW_DELIMITER, DEBUG
-from utils import emitRow
+# Everything else is imported where it is needed, nCluster pays for startup once per partition
+from registry import resolve_mapper, resolve_reducer
+from settings import (COL_DELIMITER, ROW_DELIMITER, DEBUG, STAGE_SEPARATOR, GROUPING_MEMORY, QUEUE_DEPTH,
+	OUTPUT_COMPRESSION, COMPRESS_LEVEL)
+from utils import RowReader, RowWriter, generate_batches
+
+# Options consumed by the driver rather than passed to the mapper
+DRIVER_OPTIONS = ('reducer', 'combinerMemory', 'workers', 'partitionColumnIndex', 'inputFile', 'startLine',
+	'inputFormat', 'outputFormat', 'counters', 'countersFile', 'progressInterval', 'unsorted', 'groupingMemory',
+	'overlap', 'queueDepth', 'inputCompression', 'decompressThread', 'outputCompression', 'compressLevel', 'outputFile',
+	'checkpoint', 'checkpointInterval', 'cacheStats')
 
 # if DEBUG:
 # 	LOG_FILENAME = 'debug.log.out.txt'
@@ -288,8 +291,96 @@ from utils import emitRow
 # 	def __call__(self, key, value):
 # 		u, v = key, value.upper()
 # 		yield u, v
+
+
+def run_batches(mapper, source, writer, offset=0):
+	"""Feed source to the mapper in blocks of rows."""
+	for keys, values in generate_batches(source, offset=offset):
+		# logger.debug("%s input: %d rows starting at %d" % (mapper.__class__.__name__, len(keys), keys[0]))
+		writer.write_pairs(mapper.map_batch(keys, values))
+		
 		
+def run_batches_counted(mapper, source, writer, offset, counters):
+	"""Feed source to the mapper in blocks of rows, recording counters and timings per block."""
+	clock = time.time
+	name = mapper.__class__.__name__
+	batches = generate_batches(source, offset=offset)
+	while True:
+		start = clock()
+		batch = next(batches, None)
+		parsed = clock()
+		counters.add_time('input', parsed - start)
+		if batch is None:
+			break
+		keys, values = batch
+		pairs = mapper.map_batch(keys, values)
+		counters.add_time('mapper', clock() - parsed)
+		counters.incr('Input', 'ROWS_IN', len(keys))
+		if isinstance(values[0], basestring):
+			counters.incr('Input', 'BYTES_READ', sum(map(len, values)) + len(values))
+		counters.incr(name, 'ROWS_IN', len(keys))
+		counters.incr(name, 'ROWS_OUT', len(pairs))
+		writer.write_pairs(pairs)
+		counters.progress()
 		
+		
+def run_skipping(mapper, source, writer, offset=0):
+	"""Feed source to a mapper that can skip ahead, dropping the rows it would ignore.
+	
+	:rtype: int
+	:return: The number of rows read from source
+	"""
+	source = iter(source)
+	i = offset
+	while True:
+		n = mapper.skip_ahead()
+		if n:
+			dropped = 0
+			for dropped, line in enumerate(islice(source, n), 1):
+				pass
+			mapper.skipped(dropped)
+			i += dropped
+		line = next(source, None)
+		if line is None:
+			break
+		writer.write_pairs(mapper(i, line.rstrip(ROW_DELIMITER)))
+		i += 1
+	return i - offset
+	
+	
+def run(mapper, source, writer, offset=0, counters=None):
+	"""Run the mapper over every row of source, writing its output to writer.
+	
+	Rows are keyed by their 0-based line number, counted from offset. Given
+	counters, rows and bytes are counted and time is recorded per stage.
+	"""
+	if counters is None:
+		if mapper.skipAhead:
+			run_skipping(mapper, source, writer, offset)
+		else:
+			run_batches(mapper, source, writer, offset)
+		writer.write_pairs(mapper.finish())
+		return
+	from counters import CountingWriter
+	writer = CountingWriter(writer, counters)
+	if getattr(mapper, 'counters', False) is None:
+		mapper.counters = counters
+	if mapper.skipAhead:
+		start, outputTime, rowsOut = time.time(), counters.times['output'], counters.get('Output', 'ROWS_OUT')
+		rows = run_skipping(mapper, source, writer, offset)
+		counters.add_time('mapper', time.time() - start - (counters.times['output'] - outputTime))
+		counters.incr('Input', 'ROWS_IN', rows)
+		counters.incr(mapper.__class__.__name__, 'ROWS_IN', rows)
+		counters.incr(mapper.__class__.__name__, 'ROWS_OUT', counters.get('Output', 'ROWS_OUT') - rowsOut)
+	else:
+		run_batches_counted(mapper, source, writer, offset, counters)
+	start = time.time()
+	pairs = list(mapper.finish())
+	counters.add_time('mapper', time.time() - start)
+	counters.incr(mapper.__class__.__name__, 'ROWS_OUT', len(pairs))
+	writer.write_pairs(pairs)
+	
+	
 if __name__ == "__main__":
 	if DEBUG:
 		users = []
@@ -304,32 +395,172 @@ if __name__ == "__main__":
 		users.append(rowTemplate.format(userId=1002, firstName="Albert", lastName="Einstein", dob="1955-04-18 00:00:0"))
 		users.append(rowTemplate.format(userId=1003, firstName="Richard", lastName="Feynman", dob="1918-05-11 00:00:0"))
 		users.append(rowTemplate.format(userId=1004, firstName="Erwin", lastName="Schrodinger", dob="1887-08-12 00:00:0"))
-		source = StringIO.StringIO(ROW_DELIMITER.join(users) + ROW_DELIMITER)
+		from cStringIO import StringIO
+		source = StringIO(ROW_DELIMITER.join(users) + ROW_DELIMITER)
 	else:
 		source = sys.stdin
 		
 	argsDict = {}
-	dynamicMapper = None
-	if len(sys.argv) > 1:
-		try:
-			if hasattr(globals()[sys.argv[1]], '__call__'):
-				dynamicMapper = globals()[sys.argv[1]]
-				className = sys.argv.pop(1)
-		except KeyError, e:
-			logging.error("%s is missing" % (e,))
-			sys.exit()
-		# logger.debug("parsing args")
-		for arg in sys.argv[1:]:
-			option, value = arg.split('=')
-			assert option.startswith('--')
-			argsDict[option[2:]] = value
-		# logger.debug("argsDict: %s" % (argsDict,))
+	className = 'IdentityMapper'
+	if len(sys.argv) > 1 and STAGE_SEPARATOR in sys.argv[1]:
+		className = 'PipelineMapper'
+		argsDict['stages'] = sys.argv.pop(1)
+	elif len(sys.argv) > 1 and not sys.argv[1].startswith('--'):
+		className = sys.argv.pop(1)
+	try:
+		mapperClass = resolve_mapper(className)
+	except LookupError, e:
+		sys.stderr.write("%s\n" % (e,))
+		sys.exit(1)
+	# logger.debug("parsing args")
+	for arg in sys.argv[1:]:
+		option, value = arg.split('=')
+		assert option.startswith('--')
+		argsDict[option[2:]] = value
+	# logger.debug("argsDict: %s" % (argsDict,))
 		
-	mapper = dynamicMapper(**argsDict) if dynamicMapper else IdentityMapper(**argsDict)
+	driverOptions = dict((option, argsDict.pop(option)) for option in DRIVER_OPTIONS if option in argsDict)
+	if driverOptions.get('cacheStats') not in (None, '0'):
+		# Before the mapper is created, its constructor may already make caches
+		from memo import report_at_exit
+		report_at_exit()
+	mapper = mapperClass(**argsDict)
 	# logger.info("Created new %s instance with extra kwargs %s" % (mapper.__class__.__name__, str(argsDict)))
-	for i, line in enumerate(source):
-		i, line = i, line.rstrip(ROW_DELIMITER)
-		# logger.debug("%s input: {k:'%d', v:'%s'}" % (mapper.__class__.__name__, i, line))
-		for k, v in mapper(i, line):
-			emitRow(COL_DELIMITER.join(map(str, [k, v])))
+	startLine = int(driverOptions.get('startLine', 0))
+	checkpoint = checkpointState = None
+	if 'checkpoint' in driverOptions:
+		from checkpoint import Checkpoint, check_resumable
+		job = {'mapper': className, 'arguments': argsDict}
+		try:
+			check_resumable(mapper)
+			if 'outputFile' not in driverOptions:
+				raise ValueError("--checkpoint needs an --outputFile to truncate when resuming")
+			if int(driverOptions.get('workers', 1)) > 1 or [option for option in ('reducer', 'overlap', 'unsorted') if option in driverOptions]:
+				raise ValueError("--checkpoint runs serially, without --workers, --reducer, --overlap or --unsorted")
+			checkpoint = Checkpoint(driverOptions['checkpoint'])
+			checkpointState = checkpoint.load()
+			if checkpointState is not None and (checkpointState['mapper'], checkpointState['arguments']) != (className, argsDict):
+				raise ValueError("checkpoint %s is of a different job, %s %r" % (checkpoint.fileName, checkpointState['mapper'], checkpointState['arguments']))
+		except ValueError, e:
+			sys.stderr.write("%s\n" % (e,))
+			sys.exit(1)
+		if checkpointState is not None:
+			mapper.set_state(checkpointState['mapperState'])
+			startLine = checkpointState['inputLine']
+			sys.stderr.write("resuming from %s at row %d\n" % (checkpoint.fileName, startLine))
+	# Input files are checked for compression unless told otherwise, stdin only when asked
+	inputCompression = driverOptions.get('inputCompression', 'auto' if 'inputFile' in driverOptions else 'none')
+	inputCompression = None if inputCompression == 'none' else inputCompression
+	outputCompression = driverOptions.get('outputCompression', OUTPUT_COMPRESSION)
+	outputCompression = None if outputCompression == 'none' else outputCompression
+	if inputCompression or outputCompression:
+		from compression import check_compression
+		try:
+			check_compression(inputCompression, auto=True)
+			check_compression(outputCompression)
+		except (ValueError, ImportError), e:
+			sys.stderr.write("%s\n" % (e,))
+			sys.exit(1)
+	background = driverOptions.get('decompressThread') not in (None, '0')
+	if driverOptions.get('inputFormat') == 'binary':
+		from binaryformat import BinaryInputFormat
+		inputFile = open(driverOptions['inputFile'], 'rb') if 'inputFile' in driverOptions else source
+		source = BinaryInputFormat(inputFile=inputFile, compression=inputCompression, background=background).generate_input()
+		if not mapper.acceptsFields:
+			source = (COL_DELIMITER.join(map(str, fields)) for fields in source)
+		if startLine:
+			source = islice(source, startLine, None)
+	elif 'inputFile' in driverOptions:
+		from compression import DecompressingReader, open_input
+		inputFile = open_input(driverOptions['inputFile'], inputCompression, background=background)
+		if isinstance(inputFile, DecompressingReader):
+			source = RowReader(inputFile, startLine)
+		else:
+			# A plain file is memory-mapped instead
+			inputFile.close()
+			from inputformat import MmapInputFormat
+			inputFormat = MmapInputFormat(driverOptions['inputFile'], useIndex=startLine > 0)
+			source = inputFormat.read_rows(startLine)
+	else:
+		if inputCompression:
+			from compression import open_input
+			source = open_input(source, inputCompression, background=background)
+		# Rows are split from large blocks rather than read and stripped one line at a time
+		source = RowReader(source, startLine)
+		
+	workers = int(driverOptions.get('workers', 1))
+	partitionColumnIndex = driverOptions.get('partitionColumnIndex')
+	if partitionColumnIndex is not None:
+		partitionColumnIndex = int(partitionColumnIndex)
+	if workers > 1 and not mapper.stateless and partitionColumnIndex is None:
+		sys.stderr.write("%s is stateful and needs --partitionColumnIndex to run with workers, running serially\n" % (mapperClass.__name__,))
+		workers = 1
+	presorted = driverOptions.get('unsorted') in (None, '0')
+	groupingMemory = int(driverOptions.get('groupingMemory', GROUPING_MEMORY))
+	if not presorted and partitionColumnIndex is not None and workers == 1:
+		# Regroup unsorted input so every partition reaches the mapper as one run of rows
+		from inputformat import NClusterPartitionInputFormat
+		inp = NClusterPartitionInputFormat(partitionColumnIndex, colDelimiter=COL_DELIMITER, presorted=False,
+			memoryBudget=groupingMemory, inputFile=source)
+		source = (row for pKey, rows in inp.generate_input() for row in rows)
+		
+	if checkpoint is not None:
+		from checkpoint import LineCounter
+		source = LineCounter(source, startLine)
+		
+	counters = None
+	if driverOptions.get('counters') not in (None, '0') or 'countersFile' in driverOptions or 'progressInterval' in driverOptions:
+		from counters import Counters
+		progressInterval = driverOptions.get('progressInterval')
+		counters = Counters(float(progressInterval) if progressInterval else None, driverOptions.get('countersFile'))
+		
+	compressLevel = int(driverOptions.get('compressLevel', COMPRESS_LEVEL))
+	outputFile = sys.stdout
+	if checkpoint is not None:
+		from checkpoint import open_output
+		outputFile = open_output(driverOptions['outputFile'], checkpointState)
+	elif 'outputFile' in driverOptions:
+		outputFile = open(driverOptions['outputFile'], 'wb')
+	if driverOptions.get('outputFormat') == 'binary':
+		from binaryformat import BinaryRowWriter
+		writer = rowWriter = BinaryRowWriter(outputFile, compression=outputCompression, compressLevel=compressLevel)
+	else:
+		writer = rowWriter = RowWriter(outputFile, compression=outputCompression, compressLevel=compressLevel)
+	if checkpoint is not None:
+		from checkpoint import CheckpointingWriter
+		from settings import CHECKPOINT_INTERVAL
+		outputRows = 0
+		if checkpointState is not None and checkpointState['outputBytes']:
+			outputRows = checkpointState['outputRows']
+			# The truncated output already starts with whatever the writer begins with
+			rowWriter.discard()
+		writer = CheckpointingWriter(rowWriter, outputFile, source, mapper, checkpoint, job, outputRows,
+			float(driverOptions.get('checkpointInterval', CHECKPOINT_INTERVAL)))
+	if 'reducer' in driverOptions:
+		import reducers
+		from settings import COMBINER_MEMORY
+		reducer = resolve_reducer(driverOptions['reducer'])(**argsDict)
+		memoryBudget = int(driverOptions.get('combinerMemory', COMBINER_MEMORY))
+		writer = reducers.CombiningWriter(writer, reducers.HashCombiner(reducer, memoryBudget))
+	if workers > 1:
+		from parallel import run_parallel
+		if counters:
+			from counters import CountingWriter, count_rows
+			source = count_rows(source, counters)
+			writer = CountingWriter(writer, counters)
+		run_parallel(mapperClass, argsDict, source, writer, workers, partitionColumnIndex, startLine, mapper.stateless,
+			presorted, groupingMemory)
+	elif driverOptions.get('overlap') not in (None, '0') and not mapper.skipAhead:
+		from overlap import run_overlapped
+		run_overlapped(mapper, source, writer, startLine, counters, int(driverOptions.get('queueDepth', QUEUE_DEPTH)))
+	else:
+		run(mapper, source, writer, startLine, counters)
+	writer.close()
+	if outputFile is not sys.stdout:
+		outputFile.close()
+	if checkpoint is not None:
+		checkpoint.remove()
+	if counters:
+		counters.incr('Output', 'BYTES_WRITTEN', rowWriter.bytesWritten)
+		counters.emit()
 			
\ No newline at end of file
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+memo.py
+
+Size-bounded LRU memoization of column converters.
+
+Input columns are highly repetitive, the same country codes, ids, URLs and
+timestamps recur millions of times, so a converter is worth caching on the
+raw string. A cache is set on a schema column with a "cache" entry,
+
+	{"country": {"index": 3, "type": str.upper, "cache": 1024}}
+	
+or on any one-argument function with the memoize decorator. Every cache
+counts its hits, misses and evictions, which are written to stderr at exit
+when REPORT_CACHE_STATS is set or the driver is given --cacheStats=1, to help
+tune the cache sizes of a job.
+"""
+
+import atexit
+import sys
+import weakref
+
+from settings import REPORT_CACHE_STATS
+
+# Fields of a link in a cache's circular doubly linked list
+PREV, NEXT, KEY, RESULT = 0, 1, 2, 3
+
+# Fields of a cache's counts
+HITS, MISSES, EVICTIONS = 0, 1, 2
+
+# Weak references to the caches alive in this process
+LIVE = set()
+
+# Summed [maxSize, hits, misses, evictions] of freed caches by name, and the names in order of first use
+TOTALS = {}
+NAMES = []
+
+# Whether report runs at exit, see report_at_exit
+_reportAtExit = REPORT_CACHE_STATS
+
+
+class LRUCache(object):
+	"""Call a one-argument function through a cache of its most recent results.
+	
+	Results are kept in a dictionary of links in a circular doubly linked
+	list, most recently used last, so a hit and an eviction both take
+	constant time.
+	
+	:type function: function
+	:param function: The function to cache, its argument must be hashable
+	
+	:type maxSize: int
+	:param maxSize: The number of results kept, the least recently used is evicted beyond it
+	
+	:type name: string
+	:param name: The name of the cache in the statistics report
+	"""
+	def __init__(self, function, maxSize=4096, name=None):
+		super(LRUCache, self).__init__()
+		if maxSize < 1:
+			raise ValueError("an LRU cache needs a maxSize of at least 1, not %d" % (maxSize,))
+		self.function = function
+		self.maxSize = maxSize
+		self.name = name if name else getattr(function, '__name__', repr(function))
+		self.cache = {}
+		self.root = []
+		self.root[:] = [self.root, self.root, None, None]
+		self.counts = [0, 0, 0]
+		register(self)
+		
+	def __call__(self, key):
+		cache = self.cache
+		link = cache.get(key)
+		if link is not None:
+			self.counts[HITS] += 1
+			# Move the link to the most recently used end
+			prev, next = link[PREV], link[NEXT]
+			prev[NEXT], next[PREV] = next, prev
+			root = self.root
+			last = root[PREV]
+			last[NEXT] = root[PREV] = link
+			link[PREV], link[NEXT] = last, root
+			return link[RESULT]
+		self.counts[MISSES] += 1
+		result = self.function(key)
+		root = self.root
+		if len(cache) >= self.maxSize:
+			# Reuse the old root as the new link and make the least recently used link the root
+			root[KEY], root[RESULT] = key, result
+			cache[key] = root
+			self.root = root = root[NEXT]
+			del cache[root[KEY]]
+			root[KEY] = root[RESULT] = None
+			self.counts[EVICTIONS] += 1
+		else:
+			last = root[PREV]
+			last[NEXT] = root[PREV] = cache[key] = [last, root, key, result]
+		return result
+		
+	def clear(self):
+		"""Drop every cached result, the statistics are kept."""
+		self.cache.clear()
+		self.root[:] = [self.root, self.root, None, None]
+		
+	def stats(self):
+		"""Return the hits, misses and evictions of the cache as a dictionary."""
+		return dict(zip(('hits', 'misses', 'evictions'), self.counts), name=self.name, size=len(self.cache), maxSize=self.maxSize)
+		
+		
+def memoize(maxSize=4096, name=None):
+	"""Decorate a one-argument function with an LRUCache of maxSize results."""
+	def decorate(function):
+		return LRUCache(function, maxSize, name)
+	return decorate
+	
+	
+class CacheRef(weakref.ref):
+	"""A weak reference to a cache that keeps its name and counts after the cache is freed."""
+	def __init__(self, cache, callback):
+		super(CacheRef, self).__init__(cache, callback)
+		self.name = cache.name
+		self.maxSize = cache.maxSize
+		self.counts = cache.counts
+		
+		
+def retire(ref):
+	"""Add the counts of a freed cache to the totals of its name."""
+	LIVE.discard(ref)
+	add_counts(ref.name, ref.maxSize, ref.counts)
+	
+	
+def add_counts(name, maxSize, counts, totals=TOTALS, names=NAMES):
+	"""Add counts to the [maxSize, hits, misses, evictions] totals of name in totals."""
+	if name not in totals:
+		totals[name] = [maxSize, 0, 0, 0]
+		names.append(name)
+	total = totals[name]
+	total[0] = max(total[0], maxSize)
+	for i, n in enumerate(counts):
+		total[i + 1] += n
+		
+		
+def register(cache):
+	"""Track the counts of cache, the report is set up to run at exit with the first cache.
+	
+	Mappers are created once per partition, so only weak references to
+	caches are kept and the counts of a freed cache are summed by name.
+	"""
+	if not NAMES and _reportAtExit:
+		atexit.register(report)
+	add_counts(cache.name, cache.maxSize, ())
+	LIVE.add(CacheRef(cache, retire))
+	
+	
+def report_at_exit():
+	"""Write the statistics of the caches to stderr at exit, whatever REPORT_CACHE_STATS says."""
+	global _reportAtExit
+	if not _reportAtExit:
+		_reportAtExit = True
+		if NAMES:
+			atexit.register(report)
+			
+			
+def report(outputFile=None):
+	"""Write the summed statistics of every cache, by name, that was used."""
+	outputFile = outputFile if outputFile else sys.stderr
+	totals, names = dict((name, list(total)) for name, total in TOTALS.iteritems()), list(NAMES)
+	for ref in LIVE:
+		add_counts(ref.name, ref.maxSize, ref.counts, totals, names)
+	for name in names:
+		maxSize, hits, misses, evictions = totals[name]
+		if hits or misses:
+			outputFile.write("cache %s: %d hits, %d misses, %d evictions, maxSize %d, %.1f%% hit rate\n" % (
+				name, hits, misses, evictions, maxSize, 100.0 * hits / (hits + misses)))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+overlap.py
+
+Run a mapper with its input and output on their own threads.
+
+A reader thread parses blocks of rows onto a bounded queue, the mapper runs on
+the calling thread and a writer thread drains a second bounded queue of output
+blocks. Reads and writes on pipes release the GIL, so I/O in both directions
+overlaps with the mapper. A full queue blocks its producer, so memory stays
+bounded when one side is slower than the others.
+"""
+
+import sys
+import threading
+import time
+from Queue import Queue
+
+from settings import QUEUE_DEPTH
+from utils import generate_batches
+
+# Marks the end of the blocks on a queue
+END = object()
+
+
+class StageThread(threading.Thread):
+	"""A daemon thread that keeps the exception it died with."""
+	def __init__(self, target, *args):
+		super(StageThread, self).__init__(target=target, args=args)
+		self.daemon = True
+		self.excInfo = None
+		
+	def run(self):
+		try:
+			super(StageThread, self).run()
+		except:
+			self.excInfo = sys.exc_info()
+			
+	def reraise(self):
+		"""Raise the exception the thread died with, if any."""
+		if self.excInfo:
+			raise self.excInfo[0], self.excInfo[1], self.excInfo[2]
+			
+			
+def read_blocks(source, offset, queue, stop):
+	"""Put the (keys, values) blocks of source on queue, followed by END.
+	
+	On an error stop is set before END is queued, so the mapper does not
+	mistake the end of the blocks for the end of the input.
+	"""
+	try:
+		for batch in generate_batches(source, offset=offset):
+			if stop.is_set():
+				return
+			queue.put(batch)
+	except:
+		stop.set()
+		raise
+	finally:
+		queue.put(END)
+		
+		
+def write_blocks(writer, queue, stop):
+	"""Write the blocks of pairs on queue until END, discarding them once stop is set.
+	
+	On an error stop is set and the queue is drained to END, so the mapper
+	never blocks on a full queue nobody reads.
+	"""
+	try:
+		for pairs in iter(queue.get, END):
+			if not stop.is_set():
+				writer.write_pairs(pairs)
+	except:
+		stop.set()
+		for pairs in iter(queue.get, END):
+			pass
+		raise
+		
+		
+def map_blocks(mapper, inQueue, outQueue, stop, counters=None):
+	"""Map the blocks on inQueue until END, putting the blocks of output pairs on outQueue.
+	
+	:rtype: bool
+	:return: True when END was taken from inQueue, False when stopped before it
+	"""
+	clock = time.time
+	name = mapper.__class__.__name__
+	start = clock()
+	for keys, values in iter(inQueue.get, END):
+		if stop.is_set():
+			return False
+		if counters is None:
+			outQueue.put(mapper.map_batch(keys, values))
+			continue
+		mapped = clock()
+		pairs = mapper.map_batch(keys, values)
+		counters.add_time('input', mapped - start)
+		counters.add_time('mapper', clock() - mapped)
+		counters.incr('Input', 'ROWS_IN', len(keys))
+		if isinstance(values[0], basestring):
+			counters.incr('Input', 'BYTES_READ', sum(map(len, values)) + len(values))
+		counters.incr(name, 'ROWS_IN', len(keys))
+		counters.incr(name, 'ROWS_OUT', len(pairs))
+		counters.progress()
+		outQueue.put(pairs)
+		start = clock()
+	if stop.is_set():
+		return True
+	pairs = list(mapper.finish())
+	if counters is not None:
+		counters.incr(name, 'ROWS_OUT', len(pairs))
+	outQueue.put(pairs)
+	return True
+	
+	
+def run_overlapped(mapper, source, writer, offset=0, counters=None, depth=QUEUE_DEPTH):
+	"""Run the mapper over every row of source with input and output on their own threads.
+	
+	Output is written in input order, as with mapreduce.run. If the mapper
+	raises, the writer discards what is queued and the exception propagates.
+	An exception in the reader or writer stops the mapper and is raised here.
+	
+	:type depth: int
+	:param depth: The number of blocks each queue holds before its producer blocks
+	"""
+	if counters is not None:
+		from counters import CountingWriter
+		writer = CountingWriter(writer, counters)
+		if getattr(mapper, 'counters', False) is None:
+			mapper.counters = counters
+	stop = threading.Event()
+	inQueue, outQueue = Queue(depth), Queue(depth)
+	reader = StageThread(read_blocks, source, offset, inQueue, stop)
+	writerThread = StageThread(write_blocks, writer, outQueue, stop)
+	reader.start()
+	writerThread.start()
+	try:
+		readerDone = map_blocks(mapper, inQueue, outQueue, stop, counters)
+	except:
+		stop.set()
+		raise
+	finally:
+		# The reader may be blocked on a pipe or a full queue, as a daemon it is left behind
+		outQueue.put(END)
+		writerThread.join()
+	if readerDone or not writerThread.excInfo:
+		# The reader queues END before its thread records an error, wait for it to finish. Unless
+		# the writer failed, a stop came from the reader, which may be blocked queueing END
+		if not readerDone:
+			for batch in iter(inQueue.get, END):
+				pass
+		reader.join()
+	writerThread.reraise()
+	reader.reraise()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+parallel.py
+
+Run a mapper over the driver's input with a pool of worker processes.
+
+Stateless mappers are fed chunks of rows, stateful mappers are fed whole
+partitions with a fresh mapper instance per partition, just as nCluster
+runs a separate invocation per partition. Output is written in input order.
+"""
+
+import multiprocessing
+from collections import deque
+
+from inputformat import NClusterPartitionInputFormat
+from settings import COL_DELIMITER, ROW_DELIMITER, GROUPING_MEMORY
+from utils import format_rows, generate_batches
+
+
+# Set in each worker process by init_worker
+_mapperClass = None
+_mapperKwargs = None
+_mapperInstance = None
+_formatted = True
+
+
+def init_worker(mapperClass, mapperKwargs, formatted, stateless):
+	"""Record the mapper to run in this worker process."""
+	global _mapperClass, _mapperKwargs, _mapperInstance, _formatted
+	_mapperClass, _mapperKwargs, _formatted = mapperClass, mapperKwargs, formatted
+	if stateless:
+		_mapperInstance = mapperClass(**mapperKwargs)
+	
+	
+def format_pairs(pairs):
+	"""Return pairs as a block of delimited rows, or as a list when unformatted output is wanted."""
+	if not _formatted:
+		return list(pairs)
+	return format_rows('%s' + COL_DELIMITER + '%s' + ROW_DELIMITER, pairs)
+	
+	
+def map_chunk(chunk):
+	"""Map a (keys, values) chunk with this worker's stateless mapper."""
+	keys, values = chunk
+	return format_pairs(_mapperInstance.map_batch(keys, values))
+	
+	
+def map_partition(partition):
+	"""Map a (key, rows) partition with a fresh mapper instance."""
+	# Imported here, the driver module imports this one
+	from mapreduce import run
+	pKey, rows = partition
+	mapper = _mapperClass(**_mapperKwargs)
+	collector = PairCollector()
+	run(mapper, rows, collector)
+	return format_pairs(collector.pairs)
+	
+	
+class PairCollector(object):
+	"""A writer that keeps the pairs written to it in a list."""
+	def __init__(self):
+		super(PairCollector, self).__init__()
+		self.pairs = []
+		
+	def write_pairs(self, pairs):
+		self.pairs.extend(pairs)
+		
+		
+def imap_ordered(pool, func, iterable, window):
+	"""Like pool.imap, but with at most window tasks in flight so input is read lazily."""
+	pending = deque()
+	for item in iterable:
+		pending.append(pool.apply_async(func, (item,)))
+		if len(pending) >= window:
+			yield pending.popleft().get()
+	while pending:
+		yield pending.popleft().get()
+		
+		
+def run_parallel(mapperClass, mapperKwargs, source, writer, workers, partitionColumnIndex=None, offset=0, stateless=None,
+	presorted=True, groupingMemory=GROUPING_MEMORY):
+	"""Run mapperClass over source with a pool of workers, writing output in input order.
+	
+	:type workers: int
+	:param workers: The number of worker processes
+	
+	:type partitionColumnIndex: int
+	:param partitionColumnIndex: The 0-based partition column, used to split input for stateful mappers
+	
+	:type offset: int
+	:param offset: The line number of the first row of source
+	
+	:type stateless: bool
+	:param stateless: Whether the mapper is stateless, defaults to mapperClass.stateless
+	
+	:type presorted: bool
+	:param presorted: Whether rows sharing a partition key are adjacent in source
+	
+	:type groupingMemory: int
+	:param groupingMemory: The memory budget for grouping source by partition key when it is not presorted
+	"""
+	if stateless is None:
+		stateless = mapperClass.stateless
+	formatted = getattr(writer, 'textBlocks', False)
+	pool = multiprocessing.Pool(workers, init_worker, (mapperClass, mapperKwargs, formatted, stateless))
+	try:
+		if stateless:
+			results = imap_ordered(pool, map_chunk, generate_batches(source, offset=offset), 2 * workers)
+		else:
+			inp = NClusterPartitionInputFormat(partitionColumnIndex, colDelimiter=COL_DELIMITER, presorted=presorted,
+				memoryBudget=groupingMemory, inputFile=source)
+			partitions = ((pKey, list(rows)) for pKey, rows in inp.generate_input())
+			results = imap_ordered(pool, map_partition, partitions, 2 * workers)
+		for result in results:
+			if formatted:
+				writer.write_block(result)
+			else:
+				writer.write_pairs(result)
+		pool.close()
+	except:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+pipeline.py
+
+Run a chain of mappers in one process.
+
+A pipeline spec such as 'SampleMapper|SchemaMapper|UpperMapper' names the
+stages in order. Each stage sees exactly what it would see if the previous
+stage's output were piped into a separate invocation: rows keyed by their
+line number in the intermediate stream, with the previous key and value as
+a delimited line. When a stage emits tuples, such as schema Records, and the
+next stage accepts fields, the typed fields are passed on as they would be
+through the binary row format, without rendering them to text.
+
+Stages are not fused into a single per-row function. A stage's input
+value contains the previous stage's key, the intermediate line number,
+which mappers such as UpperMapper or SchemaMapper read as a column. So
+text-accepting stages get a rendered line at every boundary, as a separate
+invocation would. What the pipeline saves is the pipes, the processes and
+the parsing of rows into blocks. Lines are rendered a block at a time
+without unpacking the pairs.
+"""
+
+from mappers import BaseMapper
+from registry import resolve_mapper
+from settings import COL_DELIMITER, STAGE_SEPARATOR
+
+
+def split_stage_kwargs(names, kwargs):
+	"""Return the keyword arguments of each stage.
+	
+	Arguments named '<stage>.<param>' go to the stage with that class name or
+	0-based position, other arguments go to every stage.
+	"""
+	shared = dict((k, v) for k, v in kwargs.iteritems() if '.' not in k)
+	stageKwargs = [dict(shared) for name in names]
+	for k, v in kwargs.iteritems():
+		if '.' not in k:
+			continue
+		stage, param = k.split('.', 1)
+		for i, name in enumerate(names):
+			if stage == name or stage == str(i):
+				stageKwargs[i][param] = v
+	return stageKwargs
+	
+	
+class PipelineMapper(BaseMapper):
+	"""Run a chain of mappers as a single mapper.
+	
+	Each block of rows is passed through every stage with map_batch, so
+	the whole chain runs in the driver's loop with no queues or processes
+	between stages.
+	
+	:SQL/MR parameters:
+		:type stages: string
+		:param stages: The stage class names separated by '|'
+	"""
+	# Set by the driver to count rows in and out of every stage
+	counters = None
+	
+	def __init__(self, stages=None, *args, **kwargs):
+		super(PipelineMapper, self).__init__(*args, **dict((k, v) for k, v in kwargs.iteritems() if '.' not in k))
+		names = stages.split(STAGE_SEPARATOR)
+		self.stages = [resolve_mapper(name)(**stageKwargs) for name, stageKwargs in zip(names, split_stage_kwargs(names, kwargs))]
+		self.rowCounts = [0] * len(self.stages)
+		self.rowFormat = '%s' + COL_DELIMITER + '%s'
+		self.stageNames = ['%d:%s' % (i, name) for i, name in enumerate(names)]
+		self.stateless = all([stage.stateless for stage in self.stages])
+		self.acceptsFields = self.stages[0].acceptsFields
+		self.skipAhead = self.stages[0].skipAhead
+		if all([stage.stateless or stage.checkpointFields is not None for stage in self.stages]):
+			self.checkpointFields = ('rowCounts',)
+		
+	def skip_ahead(self):
+		return self.stages[0].skip_ahead()
+		
+	def skipped(self, n):
+		self.stages[0].skipped(n)
+		
+	def __call__(self, key, value):
+		return self.map_batch([key], [value])
+		
+	def chain(self, i, pairs):
+		"""Return pairs from stage i - 1 as the (keys, values) input of stage i."""
+		start = self.rowCounts[i]
+		self.rowCounts[i] = start + len(pairs)
+		rowFormat = self.rowFormat
+		if self.stages[i].acceptsFields:
+			values = [(k,) + v if isinstance(v, tuple) else rowFormat % (k, v) for k, v in pairs]
+		else:
+			try:
+				# Formatting each pair as it is skips unpacking it
+				values = map(rowFormat.__mod__, pairs)
+			except TypeError:
+				# Pairs that are lists rather than tuples
+				values = [rowFormat % (k, v) for k, v in pairs]
+		return range(start, start + len(pairs)), values
+		
+	def map_stages(self, first, pairs):
+		"""Feed pairs emitted by stage first - 1 through the remaining stages."""
+		counters = self.counters
+		for i in xrange(first, len(self.stages)):
+			if not pairs:
+				break
+			keys, values = self.chain(i, pairs)
+			pairs = self.stages[i].map_batch(keys, values)
+			if counters is not None:
+				counters.incr(self.stageNames[i], 'ROWS_IN', len(keys))
+				counters.incr(self.stageNames[i], 'ROWS_OUT', len(pairs))
+		return pairs
+		
+	def map_batch(self, keys, values):
+		pairs = self.stages[0].map_batch(keys, values)
+		if self.counters is not None:
+			self.counters.incr(self.stageNames[0], 'ROWS_IN', len(keys))
+			self.counters.incr(self.stageNames[0], 'ROWS_OUT', len(pairs))
+		return self.map_stages(1, pairs)
+		
+	def get_state(self):
+		state = super(PipelineMapper, self).get_state()
+		state['stages'] = [stage.get_state() if stage.checkpointFields else {} for stage in self.stages]
+		return state
+		
+	def set_state(self, state):
+		state = dict(state)
+		for stage, stageState in zip(self.stages, state.pop('stages')):
+			stage.set_state(stageState)
+		super(PipelineMapper, self).set_state(state)
+		
+	def finish(self):
+		pairs = []
+		for i, stage in enumerate(self.stages):
+			if pairs:
+				keys, values = self.chain(i, pairs)
+				pairs = stage.map_batch(keys, values)
+			pairs = list(pairs) + list(stage.finish())
+		return pairs
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+reducers.py
+
+Reducers and the in-process hash combiner used by the driver.
+"""
+
+import cPickle as pickle
+import heapq
+import sys
+import tempfile
+from itertools import groupby, islice
+
+from settings import BATCH_SIZE, COMBINER_MEMORY
+
+
+class BaseReducer(object):
+	"""This is the base class for a reducer.
+	
+	A reducer folds the values emitted for a key into an accumulator with
+	initial and combine, merges accumulators built from different runs with
+	merge and renders the final accumulator with result.
+	
+	:type key: object
+	:param key: The key emitted by a mapper
+	
+	:type values: iterable
+	:param values: The values emitted for key
+	
+	:rtype: tuple
+	:return: A 2-tuple containing the key and the reduced value
+	"""
+	# True when the accumulator grows with every value combined into it
+	growing = False
+	
+	def __init__(self, *args, **kwargs):
+		super(BaseReducer, self).__init__()
+		
+	def __call__(self, key, values):
+		values = iter(values)
+		acc = self.initial(next(values))
+		for value in values:
+			acc = self.combine(acc, value)
+		yield key, self.result(acc)
+		
+	def initial(self, value):
+		"""Return a new accumulator holding value."""
+		raise NotImplementedError("%s must implement its initial method." % (self.__class__.__name__,))
+		
+	def combine(self, acc, value):
+		"""Return acc with value folded in."""
+		raise NotImplementedError("%s must implement its combine method." % (self.__class__.__name__,))
+		
+	def merge(self, acc, other):
+		"""Return the union of two accumulators."""
+		raise NotImplementedError("%s must implement its merge method." % (self.__class__.__name__,))
+		
+	def result(self, acc):
+		"""Return the output value of an accumulator."""
+		return acc
+		
+		
+class CountReducer(BaseReducer):
+	"""Count the values emitted for each key."""
+	def initial(self, value):
+		return 1
+		
+	def combine(self, acc, value):
+		return acc + 1
+		
+	def merge(self, acc, other):
+		return acc + other
+		
+		
+class SumReducer(BaseReducer):
+	"""Sum the numeric values emitted for each key."""
+	def initial(self, value):
+		try:
+			return int(value)
+		except ValueError:
+			return float(value)
+			
+	def combine(self, acc, value):
+		return acc + self.initial(value)
+		
+	def merge(self, acc, other):
+		return acc + other
+		
+		
+class GroupConcatReducer(BaseReducer):
+	"""Concatenate the values emitted for each key in arrival order.
+	
+	:SQL/MR parameters:
+		:type separator: string
+		:param separator: The string placed between values
+		:default: '|'
+	"""
+	growing = True
+	
+	def __init__(self, separator=None, *args, **kwargs):
+		super(GroupConcatReducer, self).__init__(*args, **kwargs)
+		self.separator = separator if separator else '|'
+		
+	def initial(self, value):
+		return [value]
+		
+	def combine(self, acc, value):
+		acc.append(value)
+		return acc
+		
+	def merge(self, acc, other):
+		acc.extend(other)
+		return acc
+		
+	def result(self, acc):
+		return self.separator.join(map(str, acc))
+		
+		
+class SketchReducer(BaseReducer):
+	"""Merge the serialized sketches emitted for each key.
+	
+	:SQL/MR parameters:
+		:type summary: bool
+		:param summary: Emit the estimate, heavy hitters or quantiles rather than the sketch
+		:default: 0
+	"""
+	def __init__(self, summary=0, *args, **kwargs):
+		super(SketchReducer, self).__init__(*args, **kwargs)
+		from sketches import loads
+		self.loads = loads
+		self.summary = int(summary)
+		
+	def initial(self, value):
+		return self.loads(value)
+		
+	def combine(self, acc, value):
+		acc.merge(self.loads(value))
+		return acc
+		
+	def merge(self, acc, other):
+		acc.merge(other)
+		return acc
+		
+	def result(self, acc):
+		return acc.summary() if self.summary else acc.dumps()
+		
+		
+class HashCombiner(object):
+	"""Aggregate key, value pairs in a hash table under a memory budget.
+	
+	When the estimated size of the table exceeds memoryBudget bytes, it is
+	sorted by key and spilled to a temporary file. The spilled runs and the
+	final table are merged with heapq.merge when the output is generated.
+	
+	:type reducer: BaseReducer
+	:param reducer: The reducer that aggregates values
+	
+	:type memoryBudget: int
+	:param memoryBudget: The estimated number of bytes the table may hold
+	"""
+	# Estimated bytes per table entry beyond the key and accumulator themselves
+	ENTRY_OVERHEAD = 120
+	
+	def __init__(self, reducer, memoryBudget=COMBINER_MEMORY):
+		super(HashCombiner, self).__init__()
+		self.reducer = reducer
+		self.memoryBudget = memoryBudget
+		self.table = {}
+		self.tableBytes = 0
+		self.runs = []
+		
+	def add_pairs(self, pairs):
+		"""Fold a block of key, value pairs into the table."""
+		table = self.table
+		initial, combine, growing = self.reducer.initial, self.reducer.combine, self.reducer.growing
+		getsizeof = sys.getsizeof
+		added = 0
+		for k, v in pairs:
+			if k in table:
+				table[k] = combine(table[k], v)
+				if growing:
+					added += getsizeof(v)
+			else:
+				table[k] = initial(v)
+				added += getsizeof(k) + getsizeof(v) + self.ENTRY_OVERHEAD
+		self.tableBytes += added
+		if self.tableBytes > self.memoryBudget:
+			self.spill()
+			
+	def spill(self):
+		"""Write the table to a temporary file as a sorted run and clear it."""
+		run = tempfile.TemporaryFile(prefix='tripolium-run-')
+		dump = pickle.Pickler(run, pickle.HIGHEST_PROTOCOL).dump
+		for item in sorted(self.table.iteritems()):
+			dump(item)
+		run.seek(0)
+		self.runs.append(run)
+		self.table = {}
+		self.tableBytes = 0
+		
+	def read_run(self, run, runIndex):
+		"""Generate (key, runIndex, acc) items from a spilled run."""
+		load = pickle.Unpickler(run).load
+		try:
+			while True:
+				k, acc = load()
+				yield k, runIndex, acc
+		except EOFError:
+			run.close()
+			
+	def generate_output(self):
+		"""Generate the reduced key, value pairs, sorted by key."""
+		result = self.reducer.result
+		table = sorted(self.table.iteritems())
+		self.table = {}
+		if not self.runs:
+			for k, acc in table:
+				yield k, result(acc)
+			return
+		sources = [self.read_run(run, i) for i, run in enumerate(self.runs)]
+		sources.append((k, len(self.runs), acc) for k, acc in table)
+		self.runs = []
+		merge = self.reducer.merge
+		for k, items in groupby(heapq.merge(*sources), lambda item: item[0]):
+			acc = next(items)[2]
+			for item in items:
+				acc = merge(acc, item[2])
+			yield k, result(acc)
+			
+			
+class CombiningWriter(object):
+	"""A RowWriter stand-in that combines pairs before they are written.
+	
+	:type writer: RowWriter
+	:param writer: The writer that receives the reduced pairs on close
+	
+	:type combiner: HashCombiner
+	:param combiner: The combiner that aggregates pairs
+	"""
+	def __init__(self, writer, combiner):
+		super(CombiningWriter, self).__init__()
+		self.writer = writer
+		self.combiner = combiner
+		
+	def write_pairs(self, pairs):
+		"""Fold a block of key, value pairs into the combiner."""
+		self.combiner.add_pairs(pairs)
+		
+	def write_output(self):
+		"""Write the reduced pairs to the underlying writer in blocks."""
+		output = self.combiner.generate_output()
+		while True:
+			pairs = list(islice(output, BATCH_SIZE))
+			if not pairs:
+				break
+			self.writer.write_pairs(pairs)
+			
+	def end_partition(self):
+		"""Write the reduced pairs of the partition and flush them."""
+		self.write_output()
+		self.writer.end_partition()
+		
+	def close(self):
+		"""Write the reduced pairs and close the underlying writer."""
+		self.write_output()
+		self.writer.close()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+registry.py
+
+Lazy lookup of mappers, reducers and schemas by name.
+
+nCluster starts a fresh interpreter for every partition, so the driver only
+imports the module that defines the mapper it was asked for. Names map to
+module paths and are resolved on first use. Third-party mappers are added
+with INSTALLED_MAPPERS in settings, with register_mapper, or by passing a
+dotted 'package.module.ClassName' path in place of a name.
+"""
+
+from importlib import import_module
+
+from settings import INSTALLED_MAPPERS, INSTALLED_SCHEMA
+
+
+MAPPERS = {
+	'IdentityMapper': 'mappers',
+	'UpperMapper': 'mappers',
+	'ReverseMapper': 'mappers',
+	'GroupConcatMapper': 'mappers',
+	'SampleMapper': 'mappers',
+	'SchemaMapper': 'mappers',
+	'SessionMapper': 'mappers',
+	'ZenoSampleMapper': 'mappers',
+	'PartitionMapper': 'mappers',
+	'HyperLogLogMapper': 'mappers',
+	'CountMinMapper': 'mappers',
+	'QuantileMapper': 'mappers',
+	'SketchMergeMapper': 'mappers',
+	'TopNMapper': 'mappers',
+	'PipelineMapper': 'pipeline',
+}
+MAPPERS.update(INSTALLED_MAPPERS)
+
+REDUCERS = {
+	'CountReducer': 'reducers',
+	'SumReducer': 'reducers',
+	'GroupConcatReducer': 'reducers',
+	'SketchReducer': 'reducers',
+}
+
+_schemas = {}
+
+
+def register_mapper(name, module):
+	"""Make the mapper class called name in module available to the driver."""
+	MAPPERS[name] = module
+
+
+def register_reducer(name, module):
+	"""Make the reducer class called name in module available to the driver."""
+	REDUCERS[name] = module
+
+
+def resolve(name, table):
+	"""Import and return the object registered in table as name.
+
+	A name that is not registered but contains a '.' is taken to be a dotted
+	'module.attribute' path.
+
+	:raises LookupError: If the name can not be resolved
+	"""
+	if name in table:
+		module = table[name]
+		attribute = name
+	elif '.' in name:
+		module, attribute = name.rsplit('.', 1)
+	else:
+		raise LookupError("%s is not registered" % (name,))
+	try:
+		return getattr(import_module(module), attribute)
+	except (ImportError, AttributeError), e:
+		raise LookupError("%s could not be loaded from %s: %s" % (name, module, e))
+
+
+def resolve_mapper(name):
+	"""Return the mapper class registered as name."""
+	return resolve(name, MAPPERS)
+
+
+def resolve_reducer(name):
+	"""Return the reducer class registered as name."""
+	return resolve(name, REDUCERS)
+
+
+def resolve_schema(name):
+	"""Return the schema metadata called name.
+
+	The modules in INSTALLED_SCHEMA are searched in order and the result is
+	cached, so mappers created over and over share one lookup.
+
+	:raises LookupError: If no installed schema module defines name
+	"""
+	if name in _schemas:
+		return _schemas[name]
+	for module in INSTALLED_SCHEMA:
+		try:
+			meta = getattr(import_module(module), name)
+		except (ImportError, AttributeError):
+			continue
+		_schemas[name] = meta
+		return meta
+	raise LookupError("schema %s was not found in %s" % (name, ', '.join(INSTALLED_SCHEMA)))
+
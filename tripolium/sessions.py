@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+sessions.py
+
+Timestamp parsing and per-key session state for sessionizing event streams.
+"""
+
+import calendar
+from array import array
+from datetime import datetime, timedelta
+
+from dictionary import InternTable
+
+
+DEFAULT_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class TimestampParser(object):
+	"""Parse timestamp strings into integer seconds since the epoch.
+	
+	Strings in the default '%Y-%m-%d %H:%M:%S' format are parsed by slicing,
+	with the epoch seconds of each date prefix cached. Anything else falls
+	back to datetime.strptime.
+	
+	:type fmt: string
+	:param fmt: The format specifier of the timestamps
+	
+	:type maxCachedDates: int
+	:param maxCachedDates: The number of date prefixes to cache before the cache is reset
+	"""
+	def __init__(self, fmt=None, maxCachedDates=4096):
+		super(TimestampParser, self).__init__()
+		self.fmt = fmt if fmt else DEFAULT_DATETIME_FORMAT
+		self.fast = self.fmt == DEFAULT_DATETIME_FORMAT
+		self.maxCachedDates = maxCachedDates
+		self.dateCache = {}
+		
+	def parse_date(self, prefix):
+		"""Return the epoch seconds of a 'YYYY-MM-DD' date prefix, cached."""
+		try:
+			return self.dateCache[prefix]
+		except KeyError:
+			pass
+		if len(self.dateCache) >= self.maxCachedDates:
+			self.dateCache.clear()
+		d = datetime.strptime(prefix, "%Y-%m-%d")
+		epoch = self.dateCache[prefix] = calendar.timegm(d.timetuple())
+		return epoch
+		
+	def parse_slow(self, s):
+		"""Parse s with datetime.strptime."""
+		return calendar.timegm(datetime.strptime(s, self.fmt).timetuple())
+		
+	def __call__(self, s):
+		"""Return the integer epoch seconds of timestamp string s.
+		
+		:rtype: int
+		:return: Seconds since 1970-01-01 00:00:00, with the timestamp taken as UTC
+		"""
+		if self.fast and len(s) == 19 and s[10] == ' ' and s[13] == ':' and s[16] == ':':
+			hms = s[11:13] + s[14:16] + s[17:19]
+			if hms.isdigit():
+				h, m, sec = int(hms[0:2]), int(hms[2:4]), int(hms[4:6])
+				if h < 24 and m < 60 and sec < 60:
+					return self.parse_date(s[:10]) + 3600 * h + 60 * m + sec
+		return self.parse_slow(s)
+		
+	def is_canonical(self, s):
+		"""Return True when s is rendered exactly as str(datetime) would render it."""
+		return self.fast and len(s) == 19 and s[10] == ' ' and s[13] == ':' and s[16] == ':'
+		
+		
+def format_seconds(seconds):
+	"""Render a number of seconds as str(timedelta(seconds=seconds)) would."""
+	if 0 <= seconds < 86400:
+		return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+	return str(timedelta(seconds=seconds))
+	
+	
+class Sessionizer(object):
+	"""Track sessions for many keys at once.
+	
+	Each key maps to a compact [start, last, number] list of integers. A new
+	session begins when an event arrives more than timeout seconds after the
+	start of the current session.
+	
+	State is bounded by maxKeys: when it is exceeded, keys idle for longer than
+	timeout are evicted, then the least recently seen keys until the table is
+	back to half its bound. An evicted key that reappears starts again at
+	session 0.
+	
+	:type timeout: int
+	:param timeout: The session timeout in seconds
+	
+	:type maxKeys: int
+	:param maxKeys: The maximum number of keys to keep state for
+	"""
+	def __init__(self, timeout=60, maxKeys=1000000):
+		super(Sessionizer, self).__init__()
+		self.timeout = timeout
+		self.maxKeys = maxKeys
+		self.sessions = {}
+		self.latest = None
+		self.evicted = 0
+		
+	def __call__(self, key, epoch):
+		"""Record an event for key at epoch seconds.
+		
+		:rtype: tuple
+		:return: A 2-tuple of the session number and the seconds since the session start
+		"""
+		if self.latest is None or epoch > self.latest:
+			self.latest = epoch
+		state = self.sessions.get(key)
+		if state is None:
+			if len(self.sessions) >= self.maxKeys:
+				self.evict()
+			self.sessions[key] = [epoch, epoch, 0]
+			return 0, 0
+		state[1] = epoch
+		dt = epoch - state[0]
+		if dt > self.timeout:
+			state[0] = epoch
+			state[2] += 1
+			return state[2], 0
+		return state[2], dt
+		
+	def evict(self):
+		"""Evict idle keys, then the least recently seen keys, down to half of maxKeys."""
+		cutoff = self.latest - self.timeout
+		sessions = self.sessions
+		before = len(sessions)
+		for key in [k for k, state in sessions.iteritems() if state[1] < cutoff]:
+			del sessions[key]
+		target = self.maxKeys // 2
+		if len(sessions) > target:
+			byLast = sorted(sessions.iteritems(), key=lambda item: item[1][1])
+			for key, state in byLast[:len(sessions) - target]:
+				del sessions[key]
+		self.evicted += before - len(sessions)
+		
+		
+class EncodedSessionizer(Sessionizer):
+	"""A Sessionizer keeping its state in arrays indexed by the dictionary codes of the keys.
+	
+	An InternTable gives each key a small integer code, and the start, last
+	and number of its session are kept at that code in three arrays, about
+	24 bytes a key instead of a list of three integers of about 130. The
+	code of an evicted key is reused by the next new key. Sessions are the
+	same as a Sessionizer's, evictions included.
+	"""
+	def __init__(self, timeout=60, maxKeys=1000000):
+		super(EncodedSessionizer, self).__init__(timeout, maxKeys)
+		self.keys = InternTable()
+		self.sessions = self.keys.codes
+		self.starts = array('l')
+		self.lasts = array('l')
+		self.numbers = array('l')
+		
+	def __call__(self, key, epoch):
+		"""Record an event for key at epoch seconds.
+		
+		:rtype: tuple
+		:return: A 2-tuple of the session number and the seconds since the session start
+		"""
+		if self.latest is None or epoch > self.latest:
+			self.latest = epoch
+		code = self.sessions.get(key)
+		if code is None:
+			if len(self.sessions) >= self.maxKeys:
+				self.evict()
+			code = self.keys.code(key)
+			if code == len(self.starts):
+				self.starts.append(epoch)
+				self.lasts.append(epoch)
+				self.numbers.append(0)
+			else:
+				self.starts[code] = self.lasts[code] = epoch
+				self.numbers[code] = 0
+			return 0, 0
+		self.lasts[code] = epoch
+		dt = epoch - self.starts[code]
+		if dt > self.timeout:
+			self.starts[code] = epoch
+			self.numbers[code] += 1
+			return self.numbers[code], 0
+		return self.numbers[code], dt
+		
+	def evict(self):
+		"""Evict idle keys, then the least recently seen keys, down to half of maxKeys."""
+		cutoff = self.latest - self.timeout
+		sessions, lasts, discard = self.sessions, self.lasts, self.keys.discard
+		before = len(sessions)
+		for key in [k for k, code in sessions.iteritems() if lasts[code] < cutoff]:
+			discard(key)
+		target = self.maxKeys // 2
+		if len(sessions) > target:
+			byLast = sorted(sessions.iteritems(), key=lambda item: lasts[item[1]])
+			for key, code in byLast[:len(sessions) - target]:
+				discard(key)
+		self.evicted += before - len(sessions)
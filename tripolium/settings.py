@@ -1,10 +1,65 @@
 # from mapreduce.settings import COL_DELIMITER, ROW_DELIMITER
 
-DEBUG = True
+import os
+
+# The driver maps a few built-in rows instead of stdin, TRIPOLIUM_DEBUG=0 in the environment reads stdin
+DEBUG = os.environ.get('TRIPOLIUM_DEBUG', '1') not in ('0', 'false', 'False')
 
 COL_DELIMITER = '\t'
 ROW_DELIMITER = '\n'
 
-# INSTALLED_SCHEMA = (
-#     'schema',
-# )
+# Number of input rows handed to a mapper's map_batch at a time
+BATCH_SIZE = 4096
+
+# Number of blocks of rows queued between the reader, mapper and writer threads of an overlapped run
+QUEUE_DEPTH = 8
+
+# Number of bytes of plain input read and split into rows at a time
+INPUT_BLOCK_SIZE = 1 << 20
+
+# Number of compressed bytes read at a time from a compressed input stream
+DECOMPRESS_BLOCK_SIZE = 1 << 20
+
+# Compression of rows written with emitRow, None, 'gzip', 'bz2' or 'xz'
+OUTPUT_COMPRESSION = None
+
+# Compression level of compressed output, 1 is fastest and 9 is smallest
+COMPRESS_LEVEL = 6
+
+# Approximate number of bytes of csv converted by a worker at a time
+CSV_CHUNK_SIZE = 16 << 20
+
+# Number of output bytes buffered by a RowWriter before it writes
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+# Estimated bytes a combiner's hash table may hold before spilling a sorted run to disk
+COMBINER_MEMORY = 64 << 20
+
+# Estimated bytes of rows held in memory when grouping unsorted input before spilling a sorted run
+GROUPING_MEMORY = 64 << 20
+
+# Dictionary-encode the materialized partitions of input formats and intern the keys of rows held when grouping
+DICTIONARY_ENCODING = False
+
+# Seconds between checkpoints of a run with --checkpoint
+CHECKPOINT_INTERVAL = 60
+
+# Write the hit, miss and eviction counts of converter caches to stderr at exit, to tune their sizes.
+# TRIPOLIUM_CACHE_STATS=1 in the environment or the driver's --cacheStats=1 turn this on for one job
+REPORT_CACHE_STATS = os.environ.get('TRIPOLIUM_CACHE_STATS', '0') not in ('0', 'false', 'False')
+
+# Separates stage names in a pipeline spec
+STAGE_SEPARATOR = '|'
+
+# Modules searched, in order, for the schema named by a mapper's schema argument
+INSTALLED_SCHEMA = (
+	'schema',
+)
+
+# Third-party mappers the driver may run, as class name -> module path
+INSTALLED_MAPPERS = {
+	# 'MyMapper': 'mypackage.mappers',
+}
+
+# Milliseconds the driver may spend importing its modules before startup.py fails
+STARTUP_BUDGET = 15
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+simulator.py
+
+Emulate SQL/MR execution on a local machine to see how a function scales.
+
+The input file is split into one partition per worker on the value of a
+column, by hash like PARTITION BY, or by key range. Every worker then runs
+the mapreduce.py driver with the given mapper and arguments, reading its
+partition on stdin and writing to a stdout pipe, all at the same time. The
+outputs are gathered in worker order and a report of each worker's rows,
+throughput and time, the skew between workers and the straggler time is
+written to stderr.
+
+	python simulator.py <MapperName> --inputFile=events.txt --partitionColumnIndex=0
+		[--workers=4] [--partitioning=hash|range] [--outputFile=out.txt] [--mapper or driver options]
+		
+Options the simulator does not know are passed on to every worker. CPU
+seconds are measured per worker, so the slowest worker's CPU time
+estimates the query time on a cluster with a core per worker even when the
+local machine has fewer cores.
+"""
+
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from bisect import bisect_right
+from contextlib import closing
+
+from settings import COL_DELIMITER, ROW_DELIMITER, BATCH_SIZE
+
+# Options consumed by the simulator rather than passed to the workers
+SIMULATOR_OPTIONS = ('inputFile', 'workers', 'partitioning', 'outputFile', 'sampleSize')
+
+# Number of keys sampled to choose the boundaries of range partitions
+SAMPLE_SIZE = 10000
+
+# Number of bytes copied at a time from a worker's stdout
+COPY_SIZE = 1 << 16
+
+
+def column_key(line, columnIndex):
+	"""Return the value of the 0-based column columnIndex of a delimited row."""
+	fields = line.rstrip(ROW_DELIMITER).split(COL_DELIMITER, columnIndex + 1)
+	if len(fields) <= columnIndex:
+		raise ValueError("row has no column %d: %r" % (columnIndex, line))
+	return fields[columnIndex]
+	
+	
+def as_numbers(keys):
+	"""Return keys as floats when every one of them is a number, None otherwise."""
+	try:
+		return [float(key) for key in keys]
+	except ValueError:
+		return None
+		
+		
+def range_bounds(fileName, columnIndex, partitions, sampleSize=SAMPLE_SIZE, seed=0):
+	"""Return the upper bounds of all but the last of partitions key ranges and the key function they compare.
+	
+	The bounds are quantiles of a reservoir sample of the keys, compared as
+	numbers when every sampled key is one.
+	"""
+	from compression import open_input
+	rnd = random.Random(seed)
+	sample = []
+	with closing(open_input(fileName)) as f:
+		for i, line in enumerate(f):
+			if i < sampleSize:
+				sample.append(column_key(line, columnIndex))
+			else:
+				j = rnd.randint(0, i)
+				if j < sampleSize:
+					sample[j] = column_key(line, columnIndex)
+	keyFunction = float if as_numbers(sample) is not None else str
+	sample = sorted(map(keyFunction, sample))
+	bounds = [sample[len(sample) * i // partitions] for i in range(1, partitions)] if sample else []
+	return bounds, keyFunction
+	
+	
+class Partition(object):
+	"""The rows of one worker, buffered into a partition file."""
+	def __init__(self, index, fileName):
+		super(Partition, self).__init__()
+		self.index = index
+		self.fileName = fileName
+		self.outputFile = open(fileName, 'wb')
+		self.buffer = []
+		self.rows = 0
+		self.bytes = 0
+		
+	def add(self, line):
+		if not line.endswith(ROW_DELIMITER):
+			line += ROW_DELIMITER
+		self.buffer.append(line)
+		self.rows += 1
+		self.bytes += len(line)
+		if len(self.buffer) >= BATCH_SIZE:
+			self.flush()
+			
+	def flush(self):
+		self.outputFile.write(''.join(self.buffer))
+		self.buffer = []
+		
+	def close(self):
+		self.flush()
+		self.outputFile.close()
+		
+		
+def partition_file(fileName, columnIndex, workers, directory, partitioning='hash', sampleSize=SAMPLE_SIZE):
+	"""Split the rows of a file into a partition file per worker on the value of a column.
+	
+	Hash partitioning sends every row with the same key to the same worker.
+	Range partitioning also keeps the keys of a worker contiguous. The order
+	of rows is kept within a partition.
+	
+	:type partitioning: string
+	:param partitioning: 'hash' or 'range'
+	
+	:rtype: list
+	:return: The Partition of every worker
+	"""
+	if partitioning not in ('hash', 'range'):
+		raise ValueError("unknown partitioning %r, expected 'hash' or 'range'" % (partitioning,))
+	from compression import open_input
+	parts = [Partition(i, os.path.join(directory, 'part-%05d' % (i,))) for i in range(workers)]
+	if partitioning == 'range':
+		bounds, keyFunction = range_bounds(fileName, columnIndex, workers, sampleSize)
+		route = lambda key: bisect_right(bounds, keyFunction(key))
+	else:
+		crc32 = zlib.crc32
+		route = lambda key: (crc32(key) & 0xffffffff) % workers
+	with closing(open_input(fileName)) as f:
+		for line in f:
+			parts[route(column_key(line, columnIndex))].add(line)
+	for part in parts:
+		part.close()
+	return parts
+	
+	
+class Worker(object):
+	"""A driver process mapping one partition, timed from its start until it exits.
+	
+	:type command: list
+	:param command: The driver command line
+	
+	:type partition: Partition
+	:param partition: The partition read on stdin
+	
+	:type directory: string
+	:param directory: Where the worker's output and stderr are kept
+	"""
+	def __init__(self, command, partition, directory):
+		super(Worker, self).__init__()
+		self.command = command
+		self.partition = partition
+		self.outputFileName = os.path.join(directory, 'out-%05d' % (partition.index,))
+		self.errorFileName = os.path.join(directory, 'err-%05d' % (partition.index,))
+		self.rowsOut = 0
+		self.bytesOut = 0
+		self.wallTime = self.cpuTime = 0.0
+		self.returncode = None
+		self.thread = threading.Thread(target=self.run)
+		self.thread.daemon = True
+		
+	def start(self):
+		self.thread.start()
+		
+	def join(self):
+		self.thread.join()
+		
+	def run(self):
+		env = dict(os.environ, TRIPOLIUM_DEBUG='0')
+		with open(self.partition.fileName, 'rb') as stdin, open(self.errorFileName, 'wb') as stderr, \
+				open(self.outputFileName, 'wb') as output:
+			start = time.time()
+			process = subprocess.Popen(self.command, stdin=stdin, stdout=subprocess.PIPE, stderr=stderr, env=env,
+				close_fds=True)
+			for block in iter(lambda: process.stdout.read(COPY_SIZE), ''):
+				output.write(block)
+				self.bytesOut += len(block)
+				self.rowsOut += block.count(ROW_DELIMITER)
+			# wait4 rather than wait, for the CPU time of the worker
+			pid, status, usage = os.wait4(process.pid, 0)
+			self.wallTime = time.time() - start
+			process.stdout.close()
+		self.cpuTime = usage.ru_utime + usage.ru_stime
+		process.returncode = self.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+		
+	def errors(self):
+		"""Return what the worker wrote to stderr."""
+		with open(self.errorFileName, 'rb') as f:
+			return f.read()
+			
+			
+def median(values):
+	"""Return the median of values, the upper one of an even number."""
+	values = sorted(values)
+	return values[len(values) // 2] if values else 0.0
+	
+	
+def ratio(a, b):
+	"""Return a / b as a float, 0 when b is 0."""
+	return float(a) / b if b else 0.0
+	
+	
+def report(workers, partitionTime, wallTime, outputFile=sys.stderr):
+	"""Write the per-worker table, the skew between workers and the straggler time."""
+	write = outputFile.write
+	write("%6s %12s %12s %12s %10s %10s %12s\n" % ('worker', 'rowsIn', 'bytesIn', 'rowsOut', 'wall(s)', 'cpu(s)', 'rows/cpu-s'))
+	for worker in workers:
+		part = worker.partition
+		write("%6d %12d %12d %12d %10.3f %10.3f %12.0f\n" % (part.index, part.rows, part.bytes, worker.rowsOut,
+			worker.wallTime, worker.cpuTime, ratio(part.rows, worker.cpuTime)))
+	rows = [worker.partition.rows for worker in workers]
+	cpuTimes = [worker.cpuTime for worker in workers]
+	wallTimes = [worker.wallTime for worker in workers]
+	totalRows = sum(rows)
+	write("%6s %12d %12d %12d %10.3f %10.3f %12.0f\n" % ('total', totalRows, sum([worker.partition.bytes for worker in workers]),
+		sum([worker.rowsOut for worker in workers]), wallTime, sum(cpuTimes), ratio(totalRows, sum(cpuTimes))))
+	meanRows = ratio(totalRows, len(workers))
+	write("skew: the largest partition has %.2fx the mean rows, the slowest worker %.2fx the mean cpu time\n" % (
+		ratio(max(rows), meanRows), ratio(max(cpuTimes), ratio(sum(cpuTimes), len(workers)))))
+	slowest = max(workers, key=lambda worker: worker.wallTime)
+	busiest = max(workers, key=lambda worker: worker.cpuTime)
+	write("straggler: worker %d finished %.3fs after the median worker, worker %d used %.3fs more cpu than the median\n" % (
+		slowest.partition.index, slowest.wallTime - median(wallTimes), busiest.partition.index, busiest.cpuTime - median(cpuTimes)))
+	write("partitioned in %.3fs, estimated cluster time with a core per worker %.3fs, %.0f rows/s\n" % (
+		partitionTime, max(cpuTimes), ratio(totalRows, max(cpuTimes))))
+		
+		
+def simulate(mapperName, inputFile, partitionColumnIndex, workers=4, partitioning='hash', outputFile=sys.stdout,
+		driverArgs=(), sampleSize=SAMPLE_SIZE):
+	"""Partition inputFile, run a driver per partition and gather their outputs into outputFile.
+	
+	:type driverArgs: list
+	:param driverArgs: The '--option=value' arguments passed to every driver
+	
+	:rtype: list
+	:return: The finished Worker of every partition
+	"""
+	directory = tempfile.mkdtemp(prefix='tripolium-sim-')
+	try:
+		start = time.time()
+		parts = partition_file(inputFile, partitionColumnIndex, workers, directory, partitioning, sampleSize)
+		partitionTime = time.time() - start
+		driver = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mapreduce.py')
+		command = [sys.executable, driver, mapperName] + list(driverArgs)
+		start = time.time()
+		running = [Worker(command, part, directory) for part in parts]
+		for worker in running:
+			worker.start()
+		for worker in running:
+			worker.join()
+		wallTime = time.time() - start
+		for worker in running:
+			with open(worker.outputFileName, 'rb') as f:
+				shutil.copyfileobj(f, outputFile, COPY_SIZE)
+		outputFile.flush()
+		for worker in running:
+			errors = worker.errors()
+			if errors:
+				sys.stderr.write(''.join(["worker %d: %s\n" % (worker.partition.index, line) for line in errors.splitlines()]))
+		report(running, partitionTime, wallTime)
+		return running
+	finally:
+		shutil.rmtree(directory, ignore_errors=True)
+		
+		
+if __name__ == '__main__':
+	if len(sys.argv) < 2 or sys.argv[1].startswith('--'):
+		sys.stderr.write(__doc__)
+		sys.exit(2)
+	mapperName = sys.argv[1]
+	options = dict(arg[2:].split('=', 1) for arg in sys.argv[2:])
+	driverArgs = [arg for arg in sys.argv[2:] if arg[2:].split('=', 1)[0] not in SIMULATOR_OPTIONS]
+	outputFile = open(options['outputFile'], 'wb') if 'outputFile' in options else sys.stdout
+	finished = simulate(mapperName, options['inputFile'], int(options['partitionColumnIndex']), int(options.get('workers', 4)),
+		options.get('partitioning', 'hash'), outputFile, driverArgs, int(options.get('sampleSize', SAMPLE_SIZE)))
+	failed = [worker for worker in finished if worker.returncode]
+	for worker in failed:
+		sys.stderr.write("worker %d exited with status %d\n" % (worker.partition.index, worker.returncode))
+	sys.exit(1 if failed else 0)
@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+sketches.py
+
+Mergeable probabilistic sketches that summarise a partition in fixed memory.
+
+	HyperLogLog     distinct count
+	CountMinSketch  item frequencies, with a heap of the heaviest items
+	TDigest         quantiles of a numeric column
+
+A sketch serializes to a single text field, '<kind>:<base64>', so it can be
+emitted as the value of a row and merged with sketches of other partitions.
+Items are hashed with md5, which is stable across processes and platforms,
+unlike hash(). Item strings are stored in headers as latin-1 so any bytes
+round-trip.
+"""
+
+import heapq
+import json
+import math
+import re
+import struct
+import zlib
+from array import array
+from binascii import a2b_base64, b2a_base64
+from hashlib import md5
+
+_unpackHash = struct.Struct('<QQ').unpack
+_nonZero = re.compile('[^\x00]')
+
+
+def hash128(item):
+	"""Return two independent 64-bit hashes of the string item."""
+	return _unpackHash(md5(item).digest())
+
+
+def encode(kind, header, data):
+	"""Serialize a sketch from its JSON header and binary data."""
+	return kind + ':' + b2a_base64(zlib.compress(json.dumps(header, encoding='latin-1') + '\n' + data))[:-1]
+
+
+def decode(s):
+	"""Return the (kind, header, data) of a serialized sketch."""
+	kind, payload = s.split(':', 1)
+	header, data = zlib.decompress(a2b_base64(payload)).split('\n', 1)
+	return kind, json.loads(header), data
+
+
+def loads(s):
+	"""Return the sketch serialized in s."""
+	kind, header, data = decode(s)
+	return SKETCHES[kind].from_state(header, data)
+
+
+def merge_all(sketches):
+	"""Return the union of an iterable of sketches, merged into the first one."""
+	sketches = iter(sketches)
+	merged = next(sketches)
+	for sketch in sketches:
+		merged.merge(sketch)
+	return merged
+
+
+class HyperLogLog(object):
+	"""Estimate the number of distinct items.
+
+	The relative standard error is about 1.04 / sqrt(2 ** precision), 0.8% at
+	the default precision of 14, which takes 16KB of registers.
+
+	:type precision: int
+	:param precision: The number of hash bits that select a register, from 4 to 18
+	"""
+	kind = 'hll'
+
+	def __init__(self, precision=14):
+		super(HyperLogLog, self).__init__()
+		if not 4 <= precision <= 18:
+			raise ValueError("precision must be between 4 and 18, not %d" % (precision,))
+		self.precision = precision
+		self.registers = bytearray(1 << precision)
+
+	def add(self, item):
+		h = hash128(item)[0]
+		shift = 64 - self.precision
+		index = h >> shift
+		rank = shift - (h & ((1 << shift) - 1)).bit_length() + 1
+		if rank > self.registers[index]:
+			self.registers[index] = rank
+
+	def update(self, items):
+		"""Add every item of an iterable."""
+		registers = self.registers
+		shift = 64 - self.precision
+		mask = (1 << shift) - 1
+		for item in items:
+			h = _unpackHash(md5(item).digest())[0]
+			rank = shift - (h & mask).bit_length() + 1
+			index = h >> shift
+			if rank > registers[index]:
+				registers[index] = rank
+
+	def merge(self, other):
+		if other.precision != self.precision:
+			raise ValueError("can not merge HyperLogLog sketches of precision %d and %d" % (self.precision, other.precision))
+		registers, otherRegisters = self.registers, other.registers
+		if otherRegisters.count('\x00') * 4 > len(otherRegisters) * 3:
+			# Mostly empty, as the sketch of a small partition is, so only visit the set registers
+			for match in _nonZero.finditer(otherRegisters):
+				i = match.start()
+				if otherRegisters[i] > registers[i]:
+					registers[i] = otherRegisters[i]
+		else:
+			self.registers = bytearray(map(max, registers, otherRegisters))
+
+	def count(self):
+		"""Return the estimated number of distinct items."""
+		m = len(self.registers)
+		alpha = 0.7213 / (1 + 1.079 / m)
+		estimate = alpha * m * m / sum([2.0 ** -r for r in self.registers])
+		if estimate <= 2.5 * m:
+			zeros = self.registers.count('\x00')
+			if zeros:
+				estimate = m * math.log(float(m) / zeros)
+		return int(round(estimate))
+
+	def summary(self):
+		return str(self.count())
+
+	def dumps(self):
+		return encode(self.kind, {'precision': self.precision}, str(self.registers))
+
+	@classmethod
+	def from_state(cls, header, data):
+		sketch = cls(header['precision'])
+		sketch.registers = bytearray(data)
+		return sketch
+
+
+class CountMinSketch(object):
+	"""Estimate item frequencies, and keep the top heaviest items.
+
+	Estimates never undercount, and overcount by at most 2N / width with
+	probability 1 - 2 ** -depth, where N is the total weight added.
+
+	:type width: int
+	:param width: The number of counters per row
+
+	:type depth: int
+	:param depth: The number of rows of counters, each with its own hash
+
+	:type top: int
+	:param top: The number of heavy hitters to keep
+	"""
+	kind = 'cms'
+
+	def __init__(self, width=2048, depth=4, top=100):
+		super(CountMinSketch, self).__init__()
+		self.width = width
+		self.depth = depth
+		self.top = top
+		self.counters = array('d', [0.0]) * (width * depth)
+		self.total = 0.0
+		# Heavy hitter estimates, and a min-heap of (estimate, item) that may hold stale entries
+		self.heavy = {}
+		self.heap = []
+
+	def cells(self, item):
+		"""Return the index of item's counter in every row."""
+		h1, h2 = hash128(item)
+		width = self.width
+		return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+	def add(self, item, weight=1.0):
+		counters = self.counters
+		cells = self.cells(item)
+		for cell in cells:
+			counters[cell] += weight
+		self.total += weight
+		self.offer(item, min([counters[cell] for cell in cells]))
+
+	def offer(self, item, estimate):
+		"""Consider item, with the given estimate, for the heavy hitters."""
+		heavy, heap = self.heavy, self.heap
+		if item in heavy:
+			heavy[item] = estimate
+			return
+		if len(heavy) < self.top:
+			heavy[item] = estimate
+			heapq.heappush(heap, (estimate, item))
+			return
+		while True:
+			least, leastItem = heap[0]
+			if heavy.get(leastItem) == least:
+				break
+			# Stale entry, the item's estimate has grown since it was pushed
+			heapq.heapreplace(heap, (heavy[leastItem], leastItem))
+		if estimate > least:
+			heapq.heapreplace(heap, (estimate, item))
+			del heavy[leastItem]
+			heavy[item] = estimate
+
+	def estimate(self, item):
+		"""Return the estimated total weight of item."""
+		counters = self.counters
+		return min([counters[cell] for cell in self.cells(item)])
+
+	def merge(self, other):
+		if (other.width, other.depth) != (self.width, self.depth):
+			raise ValueError("can not merge Count-Min sketches of different width or depth")
+		counters = self.counters
+		for i, count in enumerate(other.counters):
+			counters[i] += count
+		self.total += other.total
+		candidates = set(self.heavy) | set(other.heavy)
+		self.heavy, self.heap = {}, []
+		for item in candidates:
+			self.offer(item, self.estimate(item))
+
+	def heavy_hitters(self):
+		"""Return the (item, estimate) heavy hitters, heaviest first."""
+		return sorted(self.heavy.iteritems(), key=lambda pair: (-pair[1], pair[0]))
+
+	def summary(self):
+		return '|'.join(['%s=%d' % pair for pair in self.heavy_hitters()])
+
+	def dumps(self):
+		header = {'width': self.width, 'depth': self.depth, 'top': self.top, 'total': self.total,
+			'heavy': self.heavy_hitters()}
+		return encode(self.kind, header, self.counters.tostring())
+
+	@classmethod
+	def from_state(cls, header, data):
+		sketch = cls(header['width'], header['depth'], header['top'])
+		sketch.counters = array('d')
+		sketch.counters.fromstring(data)
+		sketch.total = header['total']
+		for item, estimate in header['heavy']:
+			sketch.offer(item.encode('latin-1'), estimate)
+		return sketch
+
+
+class TDigest(object):
+	"""Estimate quantiles of a stream of numbers with a merging t-digest.
+
+	Values are buffered and merged into at most about compression centroids,
+	which are smallest near the tails, so extreme quantiles stay accurate.
+
+	:type compression: int
+	:param compression: Bounds the number of centroids, larger is more accurate
+	"""
+	kind = 'tdigest'
+
+	# Quantiles reported by summary
+	QUANTILES = (0.5, 0.9, 0.99)
+
+	def __init__(self, compression=100):
+		super(TDigest, self).__init__()
+		self.compression = compression
+		self.means = []
+		self.weights = []
+		self.buffer = []
+		self.bufferSize = 10 * compression
+		self.min = float('inf')
+		self.max = float('-inf')
+
+	def add(self, value, weight=1.0):
+		self.buffer.append((value, weight))
+		if len(self.buffer) >= self.bufferSize:
+			self.compress()
+
+	def update(self, values):
+		"""Add every value of an iterable with weight 1."""
+		for value in values:
+			self.add(value)
+
+	def k(self, q):
+		return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+	def q(self, k):
+		return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+
+	def compress(self):
+		"""Merge the buffered values into the centroids."""
+		if not self.buffer:
+			return
+		items = sorted(zip(self.means, self.weights) + self.buffer)
+		self.buffer = []
+		self.min = min(self.min, items[0][0])
+		self.max = max(self.max, items[-1][0])
+		total = float(sum([w for x, w in items]))
+		means, weights = [], []
+		mean, weight = items[0]
+		done = 0.0
+		limit = self.q(self.k(0.0) + 1)
+		for x, w in items[1:]:
+			if (done + weight + w) / total <= limit:
+				weight += w
+				mean += (x - mean) * w / weight
+			else:
+				means.append(mean)
+				weights.append(weight)
+				done += weight
+				limit = self.q(self.k(done / total) + 1)
+				mean, weight = x, w
+		means.append(mean)
+		weights.append(weight)
+		self.means, self.weights = means, weights
+
+	def merge(self, other):
+		other.compress()
+		self.buffer.extend(zip(other.means, other.weights))
+		self.min = min(self.min, other.min)
+		self.max = max(self.max, other.max)
+		self.compress()
+
+	def count(self):
+		self.compress()
+		return sum(self.weights)
+
+	def quantile(self, q):
+		"""Return the estimated value at quantile q, between 0 and 1."""
+		self.compress()
+		if not self.means:
+			return float('nan')
+		total = sum(self.weights)
+		target = q * total
+		means, weights = self.means, self.weights
+		# Interpolate between the midpoints of adjacent centroids
+		cumulative = 0.0
+		prevMid, prevMean = 0.0, self.min
+		for mean, weight in zip(means, weights):
+			mid = cumulative + weight / 2
+			if target < mid:
+				if mid == prevMid:
+					return mean
+				return prevMean + (mean - prevMean) * (target - prevMid) / (mid - prevMid)
+			cumulative += weight
+			prevMid, prevMean = mid, mean
+		if total == prevMid:
+			return self.max
+		return prevMean + (self.max - prevMean) * (target - prevMid) / (total - prevMid)
+
+	def summary(self):
+		return '|'.join(['p%g=%r' % (q * 100, self.quantile(q)) for q in self.QUANTILES])
+
+	def dumps(self):
+		self.compress()
+		header = {'compression': self.compression, 'min': self.min, 'max': self.max}
+		centroids = array('d')
+		for mean, weight in zip(self.means, self.weights):
+			centroids.append(mean)
+			centroids.append(weight)
+		return encode(self.kind, header, centroids.tostring())
+
+	@classmethod
+	def from_state(cls, header, data):
+		sketch = cls(header['compression'])
+		sketch.min, sketch.max = header['min'], header['max']
+		centroids = array('d')
+		centroids.fromstring(data)
+		sketch.means, sketch.weights = list(centroids[0::2]), list(centroids[1::2])
+		return sketch
+
+
+SKETCHES = dict((cls.kind, cls) for cls in (HyperLogLog, CountMinSketch, TDigest))
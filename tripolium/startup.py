@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+startup.py
+
+Check that the driver starts within its import-time budget.
+
+nCluster starts the driver once per partition, so every module it imports is
+paid for thousands of times per query. For each mapper this starts fresh
+interpreters that import the driver and construct the mapper, then reports
+the median startup time in milliseconds and the modules that were loaded.
+Constructors import what their mapper needs, so they are timed too. Mappers
+that can not be constructed without arguments are given PROBE_ARGS, over a
+stand-in schema module.
+
+	python startup.py [MapperName ...] [--runs=N] [--budget=MS]
+
+The exit status is 1 when any mapper takes longer than the budget, which
+defaults to STARTUP_BUDGET in settings.
+"""
+
+import os
+import subprocess
+import sys
+
+from registry import MAPPERS
+from settings import STARTUP_BUDGET
+
+
+# Arguments for the mappers that can not be constructed without them
+PROBE_ARGS = {
+	'PipelineMapper': {'stages': 'SchemaMapper|UpperMapper', '0.schema': 'PROBE_SCHEMA'},
+	'TopNMapper': {'schema': 'PROBE_SCHEMA', 'orderBy': 'value', 'partitionBy': 'key'},
+}
+
+# Run in a fresh interpreter, prints the startup time and the modules imported.
+# PROBE_SCHEMA is in a stand-in schema module, so the user's schema module is
+# not counted as part of the driver's startup.
+PROBE = """
+import sys, time
+schema = sys.modules['schema'] = type(sys)('schema')
+schema.PROBE_SCHEMA = {"key": {"index": 1, "type": str}, "value": {"index": 2, "type": int}}
+before = set(sys.modules)
+start = time.time()
+import mapreduce
+from registry import resolve_mapper
+resolve_mapper(%r)(**%r)
+elapsed = (time.time() - start) * 1000
+print elapsed
+print ' '.join(sorted(name for name, module in sys.modules.items() if module is not None and name not in before))
+"""
+
+
+def measure_startup(name, runs=5):
+	"""Return the median startup time in milliseconds and the modules imported to construct the mapper called name."""
+	cwd = os.path.dirname(os.path.abspath(__file__))
+	probe = PROBE % (name, PROBE_ARGS.get(name, {}))
+	times = []
+	for i in range(runs):
+		output = subprocess.check_output([sys.executable, '-c', probe], cwd=cwd)
+		elapsed, modules = output.splitlines()[-2:]
+		times.append(float(elapsed))
+	times.sort()
+	return times[len(times) // 2], modules.split()
+
+
+def main(names, runs=5, budget=STARTUP_BUDGET):
+	"""Report the startup time of every mapper in names.
+
+	:rtype: bool
+	:return: True if every mapper started within the budget
+	"""
+	ok = True
+	for name in names:
+		elapsed, modules = measure_startup(name, runs)
+		withinBudget = elapsed <= budget
+		ok = ok and withinBudget
+		sys.stdout.write("%-20s %6.2fms %s %s\n" % (name, elapsed, 'ok' if withinBudget else 'OVER', ' '.join(modules)))
+	return ok
+
+
+if __name__ == '__main__':
+	names = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+	options = dict(arg[2:].split('=') for arg in sys.argv[1:] if arg.startswith('--'))
+	ok = main(names or sorted(MAPPERS), int(options.get('runs', 5)), float(options.get('budget', STARTUP_BUDGET)))
+	sys.exit(0 if ok else 1)
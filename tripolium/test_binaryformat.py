@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_binaryformat.py
+
+Tests of the binary row format, run from this directory:
+
+	python -m unittest test_binaryformat
+"""
+
+import unittest
+from cStringIO import StringIO
+
+import binaryformat
+from binaryformat import BinaryInputFormat, BinaryRowWriter, MAGIC
+
+
+def write_rows(pairs, **kwargs):
+	"""Return the binary stream a BinaryRowWriter writes for pairs."""
+	output = StringIO()
+	writer = BinaryRowWriter(output, **kwargs)
+	writer.write_pairs(pairs)
+	writer.close()
+	return output.getvalue()
+	
+	
+def read_rows(data, **kwargs):
+	"""Return the rows read back from a binary stream."""
+	return list(BinaryInputFormat(inputFile=StringIO(data), **kwargs).generate_input())
+	
+	
+class BinaryFormatTest(unittest.TestCase):
+
+	def test_round_trip(self):
+		pairs = [
+			(0, 'plain'),
+			(1, ('', 'tab\tand\nnewline', -7, 1 << 62, 2.5, None, True, False, u'caf\xe9')),
+			(1 << 70, '\x00\xff'),
+		]
+		rows = read_rows(write_rows(pairs))
+		self.assertEqual(rows, [
+			(0, 'plain'),
+			(1, '', 'tab\tand\nnewline', -7, 1 << 62, 2.5, None, True, False, u'caf\xe9'),
+			# Integers beyond 64 bits are written as their str
+			(str(1 << 70), '\x00\xff'),
+		])
+		self.assertTrue(type(rows[1][7]) is bool)
+		
+	def test_rows_span_reads(self):
+		pairs = [(i, 'x' * (i % 97)) for i in range(5000)]
+		readSize = binaryformat.READ_SIZE
+		binaryformat.READ_SIZE = 61
+		try:
+			self.assertEqual(read_rows(write_rows(pairs)), pairs)
+		finally:
+			binaryformat.READ_SIZE = readSize
+			
+	def test_compressed_round_trip(self):
+		pairs = [(i, ('row', i * 0.5)) for i in range(1000)]
+		data = write_rows(pairs, compression='gzip')
+		self.assertFalse(data.startswith(MAGIC))
+		self.assertEqual(read_rows(data, compression='auto'), [(i, 'row', i * 0.5) for i in range(1000)])
+		
+	def test_empty_input(self):
+		self.assertEqual(write_rows([]), MAGIC)
+		self.assertEqual(read_rows(MAGIC), [])
+		self.assertEqual(read_rows(''), [])
+		
+	def test_bad_input(self):
+		self.assertRaises(ValueError, read_rows, 'text\trows\n')
+		self.assertRaises(ValueError, read_rows, write_rows([(0, 'row')])[:-1])
+		
+		
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_checkpoint.py
+
+Tests of resuming checkpointed runs, run from this directory:
+
+	python -m unittest test_checkpoint
+"""
+
+import cPickle as pickle
+import os
+import shutil
+import tempfile
+import unittest
+
+from binaryformat import BinaryRowWriter
+from checkpoint import Checkpoint, CheckpointingWriter, LineCounter, check_resumable, open_output
+from compression import open_input
+from inputformat import MmapInputFormat
+from mappers import HyperLogLogMapper, ReverseMapper
+from mapreduce import run
+from utils import RowWriter
+
+
+class Interrupted(Exception):
+	pass
+	
+	
+def interrupted(rows, after):
+	"""Generate the given number of rows, then raise Interrupted as a killed run would stop."""
+	for i, row in enumerate(rows):
+		if i == after:
+			raise Interrupted()
+		yield row
+		
+		
+class CheckpointTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp(prefix='tripolium-test-')
+		self.inputName = os.path.join(self.dir, 'input.txt')
+		self.outputName = os.path.join(self.dir, 'output')
+		self.checkpoint = Checkpoint(os.path.join(self.dir, 'job.ckpt'))
+		
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+		
+	def write_input(self, rows):
+		with open(self.inputName, 'wb') as f:
+			f.write(''.join([row + '\n' for row in rows]))
+			
+	def run_job(self, newMapper, newWriter, stopAfter=None):
+		"""Run newMapper() over the input as the driver does with --checkpoint, stopping after stopAfter rows."""
+		job = {'mapper': 'test', 'arguments': {}}
+		mapper = newMapper()
+		check_resumable(mapper)
+		state = self.checkpoint.load()
+		startLine = outputRows = 0
+		if state is not None:
+			mapper.set_state(state['mapperState'])
+			startLine = state['inputLine']
+		outputFile = open_output(self.outputName, state)
+		rowWriter = newWriter(outputFile)
+		if state is not None and state['outputBytes']:
+			outputRows = state['outputRows']
+			rowWriter.discard()
+		inputFormat = MmapInputFormat(self.inputName, useIndex=startLine > 0)
+		source = inputFormat.read_rows(startLine)
+		if stopAfter is not None:
+			source = interrupted(source, stopAfter)
+		source = LineCounter(source, startLine)
+		writer = CheckpointingWriter(rowWriter, outputFile, source, mapper, self.checkpoint, job, outputRows, interval=0)
+		try:
+			run(mapper, source, writer, startLine)
+			writer.close()
+			self.checkpoint.remove()
+		finally:
+			outputFile.close()
+			inputFormat.close()
+			
+	def read_output(self):
+		with open(self.outputName, 'rb') as f:
+			return open_input(f).read()
+			
+	def check_resumes(self, rows, newMapper, newWriter, stops):
+		"""Check that runs stopped after each of stops more rows resume to the output of an uninterrupted run."""
+		self.write_input(rows)
+		self.run_job(newMapper, newWriter)
+		expected = self.read_output()
+		for stopAfter in stops:
+			self.assertRaises(Interrupted, self.run_job, newMapper, newWriter, stopAfter)
+			self.assertTrue(os.path.exists(self.checkpoint.fileName))
+		self.run_job(newMapper, newWriter)
+		self.assertFalse(os.path.exists(self.checkpoint.fileName))
+		self.assertEqual(self.read_output(), expected)
+		return expected
+		
+	def test_resumed_output_matches(self):
+		rows = ['k%03d\tuser%d' % (i // 700, i % 300) for i in range(30000)]
+		newMapper = lambda: HyperLogLogMapper(column='1', partitionColumn='0', precision='6')
+		output = self.check_resumes(rows, newMapper, RowWriter, [5000, 1000, 9000, 6000])
+		self.assertEqual(len(output.splitlines()), 43)
+		
+	def test_resumed_compressed_output_matches(self):
+		rows = ['row %d' % (i,) for i in range(20000)]
+		newWriter = lambda outputFile: RowWriter(outputFile, compression='gzip')
+		output = self.check_resumes(rows, ReverseMapper, newWriter, [4500, 9000])
+		self.assertEqual(output.splitlines()[-1], '19999\t' + 'row 19999'[::-1])
+		
+	def test_resumed_binary_output_matches(self):
+		rows = ['row %d' % (i,) for i in range(20000)]
+		self.check_resumes(rows, ReverseMapper, BinaryRowWriter, [4500, 13000])
+		
+	def test_empty_input(self):
+		self.write_input([])
+		self.run_job(ReverseMapper, RowWriter)
+		self.assertEqual(self.read_output(), '')
+		self.assertEqual(self.checkpoint.load(), None)
+		
+	def test_checkpoint_round_trip(self):
+		self.checkpoint.save({'inputLine': 12, 'mapperState': {'rows': [1, 2]}})
+		state = self.checkpoint.load()
+		self.assertEqual((state['inputLine'], state['mapperState']), (12, {'rows': [1, 2]}))
+		with open(self.checkpoint.fileName, 'wb') as f:
+			pickle.dump(dict(state, version=0), f)
+		self.assertRaises(ValueError, self.checkpoint.load)
+		
+		
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_compression.py
+
+Tests of compressed input and output streams, run from this directory:
+
+	python -m unittest test_compression
+"""
+
+import unittest
+from cStringIO import StringIO
+
+import compression
+from compression import CompressingFile, check_compression, open_input
+from utils import RowWriter
+
+
+def compress(data, compressionName, streams=1):
+	"""Return data compressed in the given format, split into concatenated streams."""
+	output = StringIO()
+	f = CompressingFile(output, compressionName)
+	step = len(data) // streams + 1
+	for start in range(0, len(data), step):
+		f.write(data[start:start + step])
+		f.end_stream()
+	f.finish()
+	return output.getvalue()
+	
+	
+def lines(n):
+	return ''.join(['%d\trow %d\t\n' % (i, i) for i in range(n)])
+	
+	
+class CompressionTest(unittest.TestCase):
+
+	def formats(self):
+		names = ['gzip', 'bz2']
+		if compression.lzma is not None:
+			names.append('xz')
+		return names
+		
+	def test_round_trip(self):
+		data = lines(20000)
+		for name in self.formats():
+			for background in (False, True):
+				f = open_input(StringIO(compress(data, name)), background=background)
+				self.assertEqual(f.compression, name)
+				self.assertEqual(''.join(f), data)
+				
+	def test_concatenated_streams(self):
+		data = lines(5000)
+		for name in self.formats():
+			stream = compress(data, name, streams=4)
+			# Streams end at every kind of read boundary
+			for blockSize in (1 << 16, 7, 4096):
+				f = open_input(StringIO(stream), blockSize=blockSize)
+				self.assertEqual(f.read(), data)
+				
+	def test_row_writer(self):
+		for name in self.formats():
+			output = StringIO()
+			writer = RowWriter(output, compression=name)
+			writer.write_pairs([(i, 'value %d' % (i,)) for i in range(1000)])
+			writer.sync()
+			writer.write_row('last')
+			writer.close()
+			expected = ''.join(['%d\tvalue %d\n' % (i, i) for i in range(1000)]) + 'last\n'
+			self.assertEqual(open_input(StringIO(output.getvalue())).read(), expected)
+			
+	def test_plain_input(self):
+		f = StringIO(lines(10))
+		f.read(5)
+		self.assertTrue(open_input(f) is f)
+		self.assertEqual(f.read(), lines(10))
+		
+	def test_empty_input(self):
+		self.assertEqual(open_input(StringIO('')).read(), '')
+		for name in self.formats():
+			self.assertEqual(list(open_input(StringIO(compress('', name)))), [])
+			self.assertEqual(open_input(StringIO(''), name).read(), '')
+			
+	def test_check_compression(self):
+		check_compression(None)
+		check_compression('gzip')
+		check_compression('auto', auto=True)
+		self.assertRaises(ValueError, check_compression, 'auto')
+		self.assertRaises(ValueError, check_compression, 'zip')
+		if compression.lzma is None:
+			self.assertRaises(ImportError, check_compression, 'xz')
+			
+			
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_csvloader.py
+
+Tests of converting csv files to db rows, run from this directory:
+
+	python -m unittest test_csvloader
+"""
+
+import csv
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from csvloader import generate_blocks
+
+
+def make_records(n, seed=0):
+	"""Return n csv records, some with quoted delimiters, quotes and newlines."""
+	rnd = random.Random(seed)
+	fields = ['plain', 'a,b', 'say "hi"', 'two\nlines', '', 'x' * 50]
+	return [[str(i), rnd.choice(fields), rnd.choice(fields)] for i in range(n)]
+	
+	
+class CsvLoaderTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp(prefix='tripolium-test-')
+		
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+		
+	def write_csv(self, name, records):
+		fileName = os.path.join(self.dir, name)
+		with open(fileName, 'wb') as f:
+			csv.writer(f).writerows(records)
+		return fileName
+		
+	def rows(self, fileName, **kwargs):
+		return [row for rows in generate_blocks(fileName, dialect='excel', joined=False, **kwargs) for row in rows]
+		
+	def test_round_trip(self):
+		records = make_records(2000)
+		fileName = self.write_csv('records.csv', [['id', 'first', 'second']] + records)
+		expected = ['\t'.join(record) for record in records]
+		self.assertEqual(self.rows(fileName, header=True), expected)
+		# Small chunks split the file between quoted newlines
+		self.assertEqual(self.rows(fileName, header=True, workers=2, chunkSize=997), expected)
+		
+	def test_columns_by_name(self):
+		records = make_records(100, seed=1)
+		fileName = self.write_csv('records.csv', [['id', 'first', 'second']] + records)
+		expected = ['\t'.join([record[2], record[0]]) for record in records]
+		self.assertEqual(self.rows(fileName, header=True, columns='second,id', workers=2, chunkSize=101), expected)
+		
+	def test_empty_file(self):
+		fileName = self.write_csv('empty.csv', [])
+		for workers in (1, 2):
+			for header in (True, False):
+				self.assertEqual(self.rows(fileName, header=header, workers=workers), [])
+				
+	def test_header_only(self):
+		fileName = self.write_csv('header.csv', [['id', 'first', 'second']])
+		for workers in (1, 2):
+			self.assertEqual(self.rows(fileName, header=True, workers=workers), [])
+			
+			
+if __name__ == '__main__':
+	unittest.main()
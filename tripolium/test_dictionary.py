@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_dictionary.py
+
+Tests of dictionary encoding of repeated column values, run from this directory:
+
+	python -m unittest test_dictionary
+"""
+
+import random
+import unittest
+
+from dictionary import EncodedRows, InternTable, PackedColumn
+
+
+def make_rows(n, seed=0):
+	"""Return n tab-delimited rows with a repeated key, a few distinct values and a unique timestamp."""
+	rnd = random.Random(seed)
+	return ['\t'.join(['user%d' % (i // 100,), rnd.choice(['GET', 'POST', '']), '%.6f' % (1e9 + i * 0.37,)]) for i in range(n)]
+	
+	
+class InternTableTest(unittest.TestCase):
+
+	def test_codes_round_trip(self):
+		table = InternTable()
+		values = ['b', 'a', 'b', '', 'c', 'a']
+		codes = table.encode(values)
+		self.assertEqual(codes, [0, 1, 0, 2, 3, 1])
+		self.assertEqual(map(table.decoder(), codes), values)
+		self.assertEqual(len(table), 4)
+		
+	def test_discarded_codes_are_reused(self):
+		table = InternTable()
+		table.code('a')
+		table.code('b')
+		table.discard('a')
+		self.assertFalse('a' in table)
+		self.assertEqual(table.code('c'), 0)
+		self.assertEqual((table.value(0), table.value(1), len(table)), ('c', 'b', 2))
+		
+	def test_empty(self):
+		table = InternTable()
+		self.assertEqual(table.encode([]), [])
+		self.assertEqual(len(table), 0)
+		
+		
+class PackedColumnTest(unittest.TestCase):
+
+	def test_round_trip(self):
+		column = PackedColumn('\t')
+		self.assertEqual(list(column.encode(['a', '', 'bcd'])), [0, 1, 2])
+		self.assertEqual(list(column.encode(['', 'e'])), [3, 4])
+		self.assertEqual([column.value(code) for code in range(5)], ['a', '', 'bcd', '', 'e'])
+		self.assertEqual(list(column), ['a', '', 'bcd', '', 'e'])
+		
+	def test_empty(self):
+		column = PackedColumn('\t')
+		self.assertEqual((list(column), len(column)), ([], 0))
+		
+		
+class EncodedRowsTest(unittest.TestCase):
+
+	def encode(self, lines, **kwargs):
+		rows = EncodedRows('\t', **kwargs)
+		rows.extend(lines)
+		return rows
+		
+	def test_round_trip(self):
+		lines = make_rows(10000)
+		rows = self.encode(lines, blockSize=1000)
+		self.assertEqual(len(rows), len(lines))
+		self.assertEqual(list(rows), lines)
+		self.assertEqual([rows[i] for i in (0, 4321, -1)], [lines[0], lines[4321], lines[-1]])
+		self.assertEqual(rows[10:20], lines[10:20])
+		# The unique timestamps are packed, the repeated columns stay in dictionaries
+		self.assertEqual([type(column) for column in rows.columns], [InternTable, InternTable, PackedColumn])
+		
+	def test_append_before_a_block(self):
+		rows = EncodedRows('\t', blockSize=4)
+		lines = make_rows(10, seed=1)
+		for line in lines:
+			rows.append(line)
+		self.assertEqual(len(rows), 10)
+		self.assertEqual(list(rows), lines)
+		
+	def test_ragged_rows(self):
+		lines = ['a\tb\tc', 'a', '\t', 'a\tb\tc\td', '']
+		rows = self.encode(lines, blockSize=2)
+		self.assertEqual(list(rows), lines)
+		self.assertEqual(rows[1:4], lines[1:4])
+		
+	def test_empty(self):
+		rows = self.encode([])
+		self.assertEqual((list(rows), len(rows), rows[0:5]), ([], 0, []))
+		self.assertRaises(IndexError, rows.__getitem__, 0)
+		
+		
+if __name__ == '__main__':
+	unittest.main()
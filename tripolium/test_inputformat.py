@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_inputformat.py
+
+Tests of the input formats, run from this directory:
+
+	python -m unittest test_inputformat
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from cStringIO import StringIO
+from itertools import groupby
+
+from inputformat import MmapInputFormat, NClusterPartitionInputFormat
+
+
+def make_rows(n, keys, seed=0):
+	"""Return n tab-delimited rows over keys partition keys, in random order, some with empty columns."""
+	rnd = random.Random(seed)
+	rows = []
+	for i in range(n):
+		key = 'k%03d' % (rnd.randint(0, keys - 1),)
+		rows.append('\t'.join([key, str(i), rnd.choice(['', 'x', 'y z'])]))
+	return rows
+	
+	
+def expected_partitions(rows):
+	"""Return the (key, rows) partitions of rows, sorted by key with rows in input order."""
+	keyed = sorted([(row.split('\t', 1)[0], i, row) for i, row in enumerate(rows)])
+	return [(key, [row for k, i, row in items]) for key, items in groupby(keyed, lambda item: item[0])]
+	
+	
+class GroupedInputTest(unittest.TestCase):
+
+	def group(self, rows, **kwargs):
+		inp = NClusterPartitionInputFormat(0, colDelimiter='\t', presorted=False,
+			inputFile=StringIO(''.join([row + '\n' for row in rows])), **kwargs)
+		spills = []
+		spill = inp.spill
+		def counted(items):
+			spills.append(len(items))
+			spill(items)
+		inp.spill = counted
+		return [(key, list(partition)) for key, partition in inp.generate_input()], spills
+		
+	def test_in_memory(self):
+		rows = make_rows(2000, 50)
+		partitions, spills = self.group(rows)
+		self.assertEqual(spills, [])
+		self.assertEqual(partitions, expected_partitions(rows))
+		
+	def test_spilled_runs_merge_in_order(self):
+		rows = make_rows(5000, 50, seed=1)
+		partitions, spills = self.group(rows, memoryBudget=4096)
+		self.assertTrue(len(spills) > 10)
+		self.assertEqual(partitions, expected_partitions(rows))
+		
+	def test_every_row_spilled(self):
+		rows = make_rows(300, 7, seed=2)
+		partitions, spills = self.group(rows, memoryBudget=1)
+		self.assertEqual(len(spills), len(rows))
+		self.assertEqual(partitions, expected_partitions(rows))
+		
+	def test_spilled_encoded_materialized(self):
+		rows = make_rows(3000, 20, seed=3)
+		partitions, spills = self.group(rows, memoryBudget=4096, materialize=True, encode=True)
+		self.assertTrue(spills)
+		self.assertEqual(partitions, expected_partitions(rows))
+		
+	def test_empty_columns_kept(self):
+		rows = ['b\t1\t', '\ta\t2', 'b\t\t3']
+		partitions, spills = self.group(rows, memoryBudget=1)
+		self.assertEqual(partitions, [('', ['\ta\t2']), ('b', ['b\t1\t', 'b\t\t3'])])
+		
+	def test_empty_input(self):
+		self.assertEqual(self.group([], memoryBudget=1), ([], []))
+		
+		
+class PresortedInputTest(unittest.TestCase):
+
+	def group(self, rows, **kwargs):
+		inp = NClusterPartitionInputFormat(0, colDelimiter='\t',
+			inputFile=StringIO(''.join([row + '\n' for row in rows])), **kwargs)
+		return [(key, list(partition)) for key, partition in inp.generate_input()]
+		
+	def test_materialized_rows_match_streamed(self):
+		rows = sorted(make_rows(2000, 50, seed=4), key=lambda row: row.split('\t', 1)[0])
+		rows += ['z\t1\t', 'z\t\t']
+		streamed = self.group(rows)
+		self.assertEqual(streamed, expected_partitions(rows))
+		self.assertEqual(self.group(rows, materialize=True), streamed)
+		self.assertEqual(self.group(rows, materialize=True, encode=True), streamed)
+		
+	def test_empty_input(self):
+		self.assertEqual(self.group([]), [])
+		self.assertEqual(self.group([], materialize=True), [])
+		self.assertEqual(self.group([], materialize=True, encode=True), [])
+		
+		
+class MmapInputTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp(prefix='tripolium-test-')
+		
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+		
+	def write(self, rows, name='rows.txt', end='\n'):
+		fileName = os.path.join(self.dir, name)
+		with open(fileName, 'wb') as f:
+			f.write('\n'.join(rows) + (end if rows else ''))
+		return fileName
+		
+	def test_round_trip(self):
+		rows = make_rows(3000, 30)
+		for end in ('\n', ''):
+			inp = MmapInputFormat(self.write(rows, end=end))
+			self.assertEqual(list(inp.generate_input()), rows)
+			self.assertEqual(list(inp.read_rows()), rows)
+			self.assertEqual(list(inp.generate_input(startLine=2500)), rows[2500:])
+			self.assertEqual(inp.LINECOUNT, len(rows))
+			inp.close()
+			
+	def test_split_ranges_cover_the_rows(self):
+		rows = make_rows(3000, 30)
+		inp = MmapInputFormat(self.write(rows))
+		ranges = inp.split(7)
+		self.assertEqual(len(ranges), 7)
+		self.assertEqual([row for start, end in ranges for row in inp.generate_input(start=start, end=end)], rows)
+		inp.close()
+		
+	def test_index_is_saved_and_reused(self):
+		rows = make_rows(2000, 20)
+		fileName = self.write(rows)
+		inp = MmapInputFormat(fileName, useIndex=True)
+		self.assertTrue(os.path.exists(inp.INDEXFILE))
+		self.assertEqual(list(inp.read_rows(1500)), rows[1500:])
+		inp.close()
+		inp = MmapInputFormat(fileName, useIndex=True)
+		inp.build_index = None
+		inp.load_index()
+		self.assertEqual(list(inp.read_rows(1999)), rows[1999:])
+		inp.close()
+		
+	def test_index_of_a_rewritten_file_is_rebuilt(self):
+		rows = make_rows(2000, 20)
+		fileName = self.write(rows)
+		MmapInputFormat(fileName, useIndex=True).close()
+		# The same size, but rows of other lengths
+		rows = sorted(rows, key=len)
+		self.write(rows)
+		stat = os.stat(fileName)
+		os.utime(fileName, (stat.st_atime, stat.st_mtime + 1))
+		inp = MmapInputFormat(fileName, useIndex=True)
+		self.assertEqual(list(inp.read_rows(1000)), rows[1000:])
+		inp.close()
+		
+	def test_index_kept_in_memory_when_it_can_not_be_saved(self):
+		rows = make_rows(500, 5)
+		fileName = self.write(rows)
+		# A directory in the way of the index fails its write, even as root
+		os.mkdir(fileName + '.idx.tmp')
+		stderr, sys.stderr = sys.stderr, StringIO()
+		try:
+			inp = MmapInputFormat(fileName, useIndex=True)
+		finally:
+			stderr, sys.stderr = sys.stderr, stderr
+		self.assertTrue('keeping it in memory' in stderr.getvalue())
+		self.assertFalse(os.path.exists(inp.INDEXFILE))
+		self.assertEqual(list(inp.read_rows(250)), rows[250:])
+		inp.close()
+		
+	def test_empty_file(self):
+		fileName = self.write([])
+		inp = MmapInputFormat(fileName, useIndex=True)
+		self.assertEqual(list(inp.generate_input()), [])
+		self.assertEqual(list(inp.read_rows(3)), [])
+		self.assertEqual(inp.split(4), [])
+		self.assertEqual(inp.LINECOUNT, 0)
+		inp.close()
+		
+		
+if __name__ == '__main__':
+	unittest.main()
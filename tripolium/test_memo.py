@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_memo.py
+
+Tests of the LRU caches of column converters, run from this directory:
+
+	python -m unittest test_memo
+"""
+
+import unittest
+from cStringIO import StringIO
+
+import memo
+from memo import LRUCache, memoize
+
+
+class LRUCacheTest(unittest.TestCase):
+
+	def test_results_and_counts(self):
+		cache = LRUCache(str.upper, 2, 'test_counts')
+		self.assertEqual([cache(value) for value in ['a', 'b', 'a', 'c', 'b', 'c']], ['A', 'B', 'A', 'C', 'B', 'C'])
+		# b is evicted by c, then b evicts a
+		self.assertEqual(cache.stats(), {'hits': 2, 'misses': 4, 'evictions': 2, 'name': 'test_counts', 'size': 2, 'maxSize': 2})
+		
+	def test_empty_cache(self):
+		cache = LRUCache(str.upper, 2, 'test_empty')
+		self.assertEqual(cache.stats(), {'hits': 0, 'misses': 0, 'evictions': 0, 'name': 'test_empty', 'size': 0, 'maxSize': 2})
+		
+	def test_report_lists_counts(self):
+		@memoize(maxSize=8, name='test_report')
+		def double(value):
+			return value * 2
+		for value in ['x', 'y', 'x', 'x']:
+			double(value)
+		output = StringIO()
+		memo.report(output)
+		self.assertTrue("cache test_report: 2 hits, 2 misses, 0 evictions, maxSize 8, 50.0% hit rate\n" in output.getvalue())
+		
+	def test_report_sums_freed_caches_by_name(self):
+		for i in range(3):
+			cache = LRUCache(int, 4, 'test_freed')
+			cache('1')
+			cache('1')
+		del cache
+		output = StringIO()
+		memo.report(output)
+		self.assertTrue("cache test_freed: 3 hits, 3 misses, 0 evictions, maxSize 4, 50.0% hit rate\n" in output.getvalue())
+		
+		
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_overlap.py
+
+Tests of the shutdown of overlapped runs, run from this directory:
+
+	python -m unittest test_overlap
+"""
+
+import sys
+import unittest
+
+from mappers import IdentityMapper
+from overlap import run_overlapped
+
+
+class ListWriter(object):
+	"""A writer keeping the pairs written to it."""
+	def __init__(self, failAfter=None):
+		self.pairs = []
+		self.failAfter = failAfter
+		
+	def write_pairs(self, pairs):
+		self.pairs.extend(pairs)
+		if self.failAfter is not None and len(self.pairs) >= self.failAfter:
+			raise IOError("writer failed")
+			
+			
+def failing_source(rows):
+	"""Generate rows lines, then raise IOError as a broken input pipe would."""
+	for i in range(rows):
+		yield 'row%d\n' % (i,)
+	raise IOError("input failed")
+	
+	
+class OverlapShutdownTest(unittest.TestCase):
+
+	def setUp(self):
+		# Switch threads as often as possible, to widen any race between them
+		self.checkInterval = sys.getcheckinterval()
+		sys.setcheckinterval(1)
+		
+	def tearDown(self):
+		sys.setcheckinterval(self.checkInterval)
+		
+	def test_output_in_order(self):
+		writer = ListWriter()
+		run_overlapped(IdentityMapper(), ('row%d\n' % (i,) for i in range(10000)), writer, depth=2)
+		self.assertEqual(writer.pairs, [(i, 'row%d' % (i,)) for i in range(10000)])
+		
+	def test_reader_error_is_raised(self):
+		for attempt in range(300):
+			writer = ListWriter()
+			self.assertRaises(IOError, run_overlapped, IdentityMapper(), failing_source(10), writer)
+			
+	def test_reader_error_after_blocks_is_raised(self):
+		for attempt in range(20):
+			self.assertRaises(IOError, run_overlapped, IdentityMapper(), failing_source(20000), ListWriter(), depth=2)
+			
+	def test_writer_error_is_raised(self):
+		writer = ListWriter(failAfter=1)
+		self.assertRaises(IOError, run_overlapped, IdentityMapper(), ('row%d\n' % (i,) for i in range(100000)), writer, depth=2)
+		
+		
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_sketches.py
+
+Tests of the mergeable sketches and the mappers that emit them, run from this directory:
+
+	python -m unittest test_sketches
+"""
+
+import math
+import random
+import unittest
+
+from mappers import HyperLogLogMapper, CountMinMapper, QuantileMapper, SketchMergeMapper
+from sketches import HyperLogLog, CountMinSketch, TDigest, loads, merge_all
+
+
+class HyperLogLogTest(unittest.TestCase):
+
+	def test_round_trip(self):
+		sketch = HyperLogLog(10)
+		sketch.update([str(i) for i in range(20000)])
+		copy = loads(sketch.dumps())
+		self.assertEqual(copy.registers, sketch.registers)
+		self.assertEqual(copy.count(), sketch.count())
+		self.assertTrue(abs(sketch.count() - 20000) < 20000 * 4 * 1.04 / 32)
+		
+	def test_merge(self):
+		parts = [HyperLogLog(12) for i in range(4)]
+		for i in range(40000):
+			parts[i % 4].add(str(i % 10000))
+		whole = HyperLogLog(12)
+		whole.update([str(i) for i in range(10000)])
+		self.assertEqual(merge_all(parts).registers, whole.registers)
+		self.assertRaises(ValueError, HyperLogLog(12).merge, HyperLogLog(10))
+		
+	def test_empty(self):
+		self.assertEqual(HyperLogLog().count(), 0)
+		self.assertEqual(loads(HyperLogLog(4).dumps()).count(), 0)
+		
+		
+class CountMinSketchTest(unittest.TestCase):
+
+	def test_round_trip(self):
+		sketch = CountMinSketch(width=256, top=5)
+		rnd = random.Random(0)
+		for i in range(5000):
+			sketch.add('\xff%d' % (min(int(rnd.expovariate(0.5)), 20),))
+		copy = loads(sketch.dumps())
+		self.assertEqual(copy.counters, sketch.counters)
+		self.assertEqual(copy.total, 5000)
+		self.assertEqual(copy.heavy_hitters(), sketch.heavy_hitters())
+		self.assertEqual([item for item, estimate in sketch.heavy_hitters()][:2], ['\xff0', '\xff1'])
+		
+	def test_never_undercounts(self):
+		sketch = CountMinSketch(width=16, depth=2)
+		counts = {}
+		for i in range(2000):
+			item = str(i % 37)
+			sketch.add(item)
+			counts[item] = counts.get(item, 0) + 1
+		for item, count in counts.iteritems():
+			self.assertTrue(sketch.estimate(item) >= count)
+			
+	def test_empty(self):
+		sketch = loads(CountMinSketch().dumps())
+		self.assertEqual(sketch.heavy_hitters(), [])
+		self.assertEqual(sketch.estimate('missing'), 0)
+		
+		
+class TDigestTest(unittest.TestCase):
+
+	def test_round_trip(self):
+		sketch = TDigest()
+		values = range(100001)
+		random.Random(1).shuffle(values)
+		sketch.update(values)
+		copy = loads(sketch.dumps())
+		self.assertEqual(copy.count(), 100001)
+		for q in (0.01, 0.5, 0.99):
+			self.assertEqual(copy.quantile(q), sketch.quantile(q))
+			self.assertTrue(abs(sketch.quantile(q) - q * 100000) < 1000)
+		self.assertEqual((copy.quantile(0), copy.quantile(1)), (0, 100000))
+		
+	def test_merge(self):
+		parts = [TDigest() for i in range(3)]
+		for i in range(30000):
+			parts[i % 3].add(i)
+		merged = loads(merge_all([loads(part.dumps()) for part in parts]).dumps())
+		self.assertEqual(merged.count(), 30000)
+		self.assertTrue(abs(merged.quantile(0.5) - 15000) < 300)
+		
+	def test_empty(self):
+		sketch = loads(TDigest().dumps())
+		self.assertEqual(sketch.count(), 0)
+		self.assertTrue(math.isnan(sketch.quantile(0.5)))
+		
+		
+class SketchMapperTest(unittest.TestCase):
+
+	def run_mapper(self, mapper, values):
+		"""Return the pairs mapper emits for values, fed in blocks of 100 rows."""
+		pairs = []
+		for start in range(0, len(values), 100):
+			pairs.extend(mapper.map_batch(range(start, start + len(values[start:start + 100])), values[start:start + 100]))
+		pairs.extend(mapper.finish())
+		return pairs
+		
+	def test_sketch_per_partition_key(self):
+		values = ['k%d\tuser%d' % (i // 250, i % 50) for i in range(1000)]
+		pairs = self.run_mapper(HyperLogLogMapper(column='1', partitionColumn='0', precision='10'), values)
+		self.assertEqual([key for key, value in pairs], ['k0', 'k1', 'k2', 'k3'])
+		expected = HyperLogLog(10)
+		expected.update(['user%d' % (i,) for i in range(50)])
+		self.assertEqual([loads(value).registers for key, value in pairs], [expected.registers] * 4)
+		rows = ['%s\t%s' % pair for pair in pairs + pairs[:1]]
+		merged = self.run_mapper(SketchMergeMapper(), rows)
+		self.assertEqual([(key, loads(value).registers) for key, value in merged], [(key, expected.registers) for key, value in pairs])
+		merged = self.run_mapper(SketchMergeMapper(byKey='0'), rows)
+		self.assertEqual([(key, loads(value).registers) for key, value in merged], [('*', expected.registers)])
+		
+	def test_sketch_of_every_row(self):
+		pairs = self.run_mapper(CountMinMapper(column='0'), ['a', 'b', 'a'] * 100)
+		self.assertEqual([key for key, value in pairs], ['*'])
+		self.assertEqual(loads(pairs[0][1]).heavy_hitters(), [('a', 200), ('b', 100)])
+		
+	def test_empty_input(self):
+		self.assertEqual(self.run_mapper(HyperLogLogMapper(column='1', partitionColumn='0'), []), [])
+		pairs = self.run_mapper(QuantileMapper(column='0'), [])
+		self.assertEqual(len(pairs), 1)
+		self.assertEqual(loads(pairs[0][1]).count(), 0)
+		
+		
+if __name__ == '__main__':
+	unittest.main()
@@ -1,23 +1,236 @@
-import csv
+import atexit
 import sys
+from itertools import islice
 
 # from mapreduce.settings import COL_DELIMITER, ROW_DELIMITER
 
 # Tripolium modules
-from settings import COL_DELIMITER, ROW_DELIMITER
+from settings import (COL_DELIMITER, ROW_DELIMITER, BATCH_SIZE, INPUT_BLOCK_SIZE, OUTPUT_BUFFER_SIZE, OUTPUT_COMPRESSION,
+	COMPRESS_LEVEL)
 # from logging.loggers import logger
 
-def csv_to_db(csvFile=None):
-	"""Generate db rows from csv input."""	
-	with open(csvFile, 'rb') as f:
-		csvReader = csv.reader(f)
-		for row in csvReader:
-			yield COL_DELIMITER.join(row)
+def csv_to_db(csvFile=None, dialect='excel', columns=None, header=False, workers=1):
+	"""Generate db rows from csv input, which may be compressed.
+	
+	Large files are converted in parallel when workers > 1, see
+	csvloader.generate_blocks for the options and csvloader.load_csv to
+	write the rows out in bulk.
+	"""
+	from csvloader import generate_blocks
+	for rows in generate_blocks(csvFile, dialect, columns, header, workers, joined=False):
+		for row in rows:
+			yield row
 			
+class RowWriter(object):
+	"""Buffer output rows in memory and write them out in large blocks.
+	
+	:type outputFile: file
+	:param outputFile: The file object rows are written to
+	
+	:type bufferSize: int
+	:param bufferSize: The number of buffered bytes that triggers a flush
+	
+	:type compression: string
+	:param compression: Compress the output with 'gzip', 'bz2' or 'xz', None for plain output
+	
+	:type compressLevel: int
+	:param compressLevel: The compression level, 1 is fastest and 9 is smallest
+	"""
+	# True when blocks of delimited text rows may be passed to write_block
+	textBlocks = True
+	
+	def __init__(self, outputFile=sys.stdout, bufferSize=OUTPUT_BUFFER_SIZE, compression=None, compressLevel=COMPRESS_LEVEL):
+		super(RowWriter, self).__init__()
+		if compression:
+			from compression import CompressingFile
+			outputFile = CompressingFile(outputFile, compression, compressLevel)
+		self.compression = compression
+		self.outputFile = outputFile
+		self.bufferSize = bufferSize
+		self.rowFormat = '%s' + COL_DELIMITER + '%s' + ROW_DELIMITER
+		self.buffer = []
+		self.bufferedBytes = 0
+		self.bytesWritten = 0
+		
+	def write_row(self, s):
+		"""Buffer a string row, the row delimiter is appended on write."""
+		self.buffer.append(s)
+		self.buffer.append(ROW_DELIMITER)
+		self.bufferedBytes += len(s) + 1
+		if self.bufferedBytes >= self.bufferSize:
+			self.flush()
+			
+	def write_pairs(self, pairs):
+		"""Buffer a block of key, value pairs as delimited rows."""
+		block = format_rows(self.rowFormat, pairs)
+		self.buffer.append(block)
+		self.bufferedBytes += len(block)
+		if self.bufferedBytes >= self.bufferSize:
+			self.flush()
+			
+	def write_block(self, block):
+		"""Buffer a block of rows that are already delimited."""
+		self.buffer.append(block)
+		self.bufferedBytes += len(block)
+		if self.bufferedBytes >= self.bufferSize:
+			self.flush()
+			
+	def flush(self):
+		"""Write all buffered rows with a single write."""
+		if self.buffer:
+			data = ''.join(self.buffer)
+			self.outputFile.write(data)
+			self.bytesWritten += len(data)
+			self.buffer = []
+			self.bufferedBytes = 0
+			
+	def discard(self):
+		"""Drop the buffered rows without writing them.
+		
+		A resumed run's output already holds what the writer buffered when it
+		was created, such as the magic bytes of the binary format.
+		"""
+		self.buffer = []
+		self.bufferedBytes = 0
+		
+	def end_partition(self):
+		"""Flush buffered rows through to the output file at the end of a partition."""
+		self.flush()
+		self.outputFile.flush()
+		
+	def sync(self):
+		"""Flush buffered rows through to the output file, ending a compressed stream.
+		
+		The output written so far then decompresses on its own, and later rows go to a new stream.
+		"""
+		self.flush()
+		if self.compression:
+			self.outputFile.end_stream()
+		self.outputFile.flush()
+		
+	def close(self):
+		"""Flush any buffered rows, see end_partition, and end a compressed stream."""
+		self.end_partition()
+		if self.compression:
+			self.outputFile.finish()
+		
+		
+def format_rows(rowFormat, pairs):
+	"""Return key, value pairs formatted with rowFormat and joined into one block."""
+	if not isinstance(pairs, list):
+		pairs = list(pairs)
+	try:
+		# Formatting each tuple as it is skips unpacking it, which is most of the cost
+		return ''.join(map(rowFormat.__mod__, pairs))
+	except TypeError:
+		# Pairs that are lists rather than tuples
+		return ''.join([rowFormat % (k, v) for k, v in pairs])
+		
+		
+_rowWriter = None
+
+def get_row_writer():
+	"""Return the shared RowWriter for sys.stdout, flushed at exit."""
+	global _rowWriter
+	if _rowWriter is None:
+		_rowWriter = RowWriter(compression=OUTPUT_COMPRESSION)
+		atexit.register(_rowWriter.close)
+	return _rowWriter
+	
 def emitRow(s=None):
 	"""Emit string row, appending row delimiter."""
 	# logger.debug(s + settings.ROW_DELIMITER)
-	sys.stdout.write(s + ROW_DELIMITER)
+	get_row_writer().write_row(s)
+	
+def emitRows(pairs=None):
+	"""Emit a block of key, value pairs."""
+	get_row_writer().write_pairs(pairs)
+	
+class RowReader(object):
+	"""Read the rows of a file a large block at a time, splitting each block into rows at once.
+	
+	Rows are never read or stripped one at a time, and generate_batches
+	slices blocks of rows straight from the split blocks. Iterating yields
+	rows without their row delimiter.
+	
+	:type inputFile: file
+	:param inputFile: A file object, or anything with a read method such as an mmap or a DecompressingReader
+	
+	:type skip: int
+	:param skip: The number of leading rows to skip
+	
+	:type blockSize: int
+	:param blockSize: The number of bytes read at a time
+	"""
+	def __init__(self, inputFile, skip=0, blockSize=INPUT_BLOCK_SIZE):
+		super(RowReader, self).__init__()
+		self.inputFile = inputFile
+		self.skip = skip
+		self.blockSize = blockSize
+		
+	def generate_blocks(self):
+		"""Generate non-empty lists of whole rows, without their row delimiter."""
+		read, blockSize = self.inputFile.read, self.blockSize
+		skip, tail = self.skip, ''
+		while True:
+			data = read(blockSize)
+			if not data:
+				break
+			rows = (tail + data).split(ROW_DELIMITER) if tail else data.split(ROW_DELIMITER)
+			tail = rows.pop()
+			if skip:
+				n = min(skip, len(rows))
+				del rows[:n]
+				skip -= n
+			if rows:
+				yield rows
+		if tail and not skip:
+			yield [tail]
+			
+	def __iter__(self):
+		for rows in self.generate_blocks():
+			for row in rows:
+				yield row
+				
+	def generate_batches(self, batchSize=BATCH_SIZE, offset=0):
+		"""Generate (keys, values) blocks of batchSize rows, the last one may be smaller."""
+		pending = []
+		for rows in self.generate_blocks():
+			if pending:
+				rows = pending + rows
+			end = len(rows) - len(rows) % batchSize
+			for i in xrange(0, end, batchSize):
+				yield range(offset, offset + batchSize), rows[i:i + batchSize]
+				offset += batchSize
+			pending = rows[end:]
+		if pending:
+			yield range(offset, offset + len(pending)), pending
+			
+	def close(self):
+		self.inputFile.close()
+		
+		
+def generate_batches(source=None, batchSize=BATCH_SIZE, offset=0):
+	"""Generate (keys, values) blocks of at most batchSize rows from source.
+	
+	Keys are the 0-based input line numbers counted from offset, values have the row delimiter stripped.
+	A source with its own generate_batches, such as a RowReader, makes the blocks itself.
+	"""
+	if hasattr(source, 'generate_batches'):
+		for batch in source.generate_batches(batchSize, offset):
+			yield batch
+		return
+	source = iter(source)
+	while True:
+		lines = list(islice(source, batchSize))
+		if not lines:
+			break
+		if isinstance(lines[0], basestring):
+			values = [line.rstrip(ROW_DELIMITER) for line in lines]
+		else:
+			values = lines
+		yield range(offset, offset + len(values)), values
+		offset += len(values)
 	
 if __name__ == "__main__":
 	for row in csv_to_db("user.csv"):